@@ -20,17 +20,54 @@
 # If not, see <http://www.gnu.org/licenses/>.
 
 from ibis import *
-from nltk import *
 
 ######################################################################
 # CFG grammar based on NLTK
 ######################################################################
 
 class CFG_Grammar(Grammar):
-    """CFG parser based on NLTK."""
+    """CFG parser based on NLTK.
+    
+    NLTK is not imported until the grammar is used, since the import
+    takes a long time. loadGrammar only remembers the filename, and the 
+    grammar is loaded by warmup, which is called the first time the 
+    parser is needed. Call warmup explicitly to load it in advance.
+    """
+    
+    grammarFilename = None
+    grammarText = None
+    _parser = None
     
     def loadGrammar(self, grammarFilename):
-        self.parser = parse.load_parser(grammarFilename, trace=1, cache=False)
+        self.grammarFilename = grammarFilename
+        self._parser = None
+
+    def loadGrammarText(self, grammarText):
+        """Use the feature grammar in a string (the contents of a .fcfg
+        file) instead of the grammar file."""
+        self.grammarText = grammarText
+        self._parser = None
+
+    def warmup(self):
+        """Import NLTK and load the grammar, if that is not done yet."""
+        if self._parser is not None:
+            return
+        if self.grammarText is not None:
+            from nltk import grammar, parse
+            if hasattr(grammar, 'parse_fcfg'):
+                fcfg = grammar.parse_fcfg(self.grammarText)
+            else:
+                fcfg = grammar.FeatureGrammar.fromstring(self.grammarText)
+            self._parser = parse.FeatureChartParser(fcfg, trace=1)
+        elif self.grammarFilename is not None:
+            from nltk import parse
+            self._parser = parse.load_parser(self.grammarFilename, trace=1, cache=False)
+
+    @property
+    def parser(self):
+        """The NLTK parser, which is loaded on first use."""
+        self.warmup()
+        return self._parser
 
     def interpret(self, input):
         """Parse an input string into a dialogue move or a set of moves."""
@@ -40,6 +77,30 @@ class CFG_Grammar(Grammar):
         except: pass
         return set([])
 
+    def interpret_nbest(self, input):
+        """Parse an input string into a stream of pairs (score, move), 
+        one for each parse tree, best first. The moves are only built
+        from the trees when they are needed. NLTK raises a ValueError
+        if the grammar does not cover the input words."""
+        parser = self.parser
+        trees = []
+        if parser is not None:
+            try: trees = parser.nbest_parse(input.split())
+            except ValueError: pass
+        if not trees:
+            try: move = eval(input)
+            except Exception: move = None
+            yield 1.0, move
+            return
+        for rank, tree in enumerate(trees):
+            yield self.score(tree, rank), self.sem2move(tree.node['sem'])
+
+    def score(self, tree, rank):
+        """The score of a parse tree: its probability if the grammar is
+        probabilistic, otherwise decreasing with its rank."""
+        try: return tree.prob()
+        except AttributeError: return 1.0 / (rank + 1)
+
     def parseString(self, input):
         tokens = input.split()
         trees = self.parser.nbest_parse(tokens)
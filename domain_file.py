@@ -0,0 +1,352 @@
+# -*- encoding: utf-8 -*-
+
+#
+# domain_file.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# and the GNU Lesser General Public License along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+
+"""Compiled domain files, which can be memory-mapped by many processes.
+
+write_domain_file saves a domain (its symbols, plans and relevance
+tables, see ibis.CompiledDomain) and optionally a grammar in a single
+file. open_domain_file maps the file read-only, and returns a compiled
+domain without calling add_plan, i.e., without parsing or typechecking
+the plans again. Only the relevance tables (the sorts of predicates and
+individuals) are read directly from the mapped file, so that all 
+processes which open the same file share these pages; the other 
+sections are unpickled into private memory of each process.
+
+The grammar is saved as its data (forms, templates and the text of its
+CFG file), and it is rebuilt from the classes in ibis and cfg_grammar,
+so opening the file does not import the module which defined the 
+dialogue system. This requires that the grammar's own class adds no
+methods or attributes, e.g., "class TravelGrammar(SimpleGenGrammar, 
+CFG_Grammar): pass"; otherwise the whole grammar is pickled, and its 
+module is imported when the file is opened. The CFG is not compiled, 
+NLTK parses its text the first time the parser is needed.
+
+write_system_file also saves the database and the state of a newly 
+reset dialogue manager, and open_system_file creates a dialogue manager
+from the file which is ready to start a dialogue, i.e., a warm start.
+
+The file consists of a header, a table of contents, and sections which
+start at multiples of 8 bytes:
+
+    header:   MAGIC, the number of sections (uint32)
+    contents: for each section, its name (16 bytes, padded with NUL),
+              its offset and its length (uint64)
+    sections: "symbols"   - the pickled symbol table of the domain
+              "domain"    - the pickled attributes of the domain
+              "pred_sort" - the sort ids of the predicates (int32)
+              "ind_sort"  - the sort ids of the individuals (int32)
+              "grammar"   - the names of the grammar's classes and its
+                            pickled state, or the pickled grammar (optional)
+              "cfg"       - the text of the grammar's CFG file (optional)
+              "database"  - the pickled database (system files only)
+              "system"    - the pickled dialogue manager class, and a
+                            snapshot of its reset state (system files only)
+
+The classes of the database and the dialogue manager are imported when
+a system file is opened.
+
+Usage: python domain_file.py [--system module:attribute] [--no-grammar] [--warm-start] filename
+"""
+
+import sys
+import time
+import mmap
+import struct
+import array
+import cPickle as pickle
+
+from ibis import *
+from rule_trace import snapshot_state, restore_state
+
+MAGIC = "IBISDOM2"
+
+_HEADER = struct.Struct("<8sI")
+_ENTRY = struct.Struct("<16sQQ")
+_INT = struct.Struct("<i")
+
+######################################################################
+# writing
+######################################################################
+
+def _int_section(values):
+    table = array.array('i', values)
+    if sys.byteorder != 'little':
+        table.byteswap()
+    return table.tostring()
+
+# The modules whose grammar classes are rebuilt by name when a file is
+# opened, instead of unpickling the grammar with its own class.
+_GRAMMAR_MODULES = ('ibis', 'cfg_grammar', 'trindikit')
+
+def _grammar_bases(grammar):
+    """Return the library classes that a grammar is an instance of, or
+    None if the grammar's class adds any behaviour of its own.
+    """
+    cls = type(grammar)
+    if cls.__module__ in _GRAMMAR_MODULES:
+        return (cls,)
+    own = [key for key in cls.__dict__
+           if key not in ('__module__', '__doc__', '__dict__', '__weakref__')]
+    if own or any(base.__module__ not in _GRAMMAR_MODULES for base in cls.__bases__):
+        return None
+    return cls.__bases__
+
+def _grammar_sections(grammar):
+    bases = _grammar_bases(grammar)
+    if bases is None:
+        return [("grammar", pickle.dumps((None, grammar), 2))]
+    if hasattr(grammar, '__getstate__'):
+        state = grammar.__getstate__()
+    else:
+        state = dict(grammar.__dict__)
+    state.pop('_parser', None)
+    if 'cache' in state:
+        state['cache'] = {}
+    names = [(base.__module__, base.__name__) for base in bases]
+    sections = [("grammar", pickle.dumps((names, state), 2))]
+    filename = getattr(grammar, 'grammarFilename', None)
+    if getattr(grammar, 'grammarText', None) is None and filename:
+        if filename.startswith("file:"):
+            filename = filename[len("file:"):]
+        try:
+            with open(filename, "rb") as f:
+                sections.append(("cfg", f.read()))
+        except IOError:
+            pass
+    return sections
+
+def _domain_sections(domain, grammar):
+    if not isinstance(domain, CompiledDomain):
+        domain = domain.compiled()
+    attributes = dict((key, val) for key, val in domain.__dict__.items()
+                      if key not in ('symbols', 'pred_sort', 'ind_sort'))
+    sections = [("symbols", pickle.dumps(domain.symbols, 2)),
+                ("domain", pickle.dumps(attributes, 2)),
+                ("pred_sort", _int_section(domain.pred_sort)),
+                ("ind_sort", _int_section(domain.ind_sort))]
+    if grammar is not None:
+        sections.extend(_grammar_sections(grammar))
+    return sections
+
+def _write_sections(filename, sections):
+    offset = _HEADER.size + _ENTRY.size * len(sections)
+    contents = []
+    for name, data in sections:
+        offset += -offset % 8
+        contents.append((name, offset, len(data)))
+        offset += len(data)
+    with open(filename, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(sections)))
+        for name, offset, length in contents:
+            f.write(_ENTRY.pack(name, offset, length))
+        for (name, offset, length), (_, data) in zip(contents, sections):
+            f.write("\0" * (offset - f.tell()))
+            f.write(data)
+
+def write_domain_file(filename, domain, grammar=None):
+    """Write a domain, and optionally a grammar, to a compiled domain file."""
+    _write_sections(filename, _domain_sections(domain, grammar))
+
+def write_system_file(filename, system):
+    """Write a dialogue system to a compiled domain file: the domain, 
+    the grammar, the database, and the state of a new dialogue manager 
+    of the same class, after reset. The class must be importable, e.g., 
+    it cannot be created by ibis_replay.headless.
+    """
+    cls = type(system)
+    template = cls(system.DOMAIN, system.DATABASE, system.GRAMMAR)
+    template.reset()
+    sections = _domain_sections(system.DOMAIN, system.GRAMMAR)
+    sections.append(("database", pickle.dumps(system.DATABASE, 2)))
+    sections.append(("system", pickle.dumps((cls, snapshot_state(template)), 2)))
+    _write_sections(filename, sections)
+
+######################################################################
+# reading
+######################################################################
+
+class MappedArray(object):
+    """A read-only array of 32-bit integers in a memory-mapped file.
+
+    MappedArray(buffer, offset, length) -> new array of 'length' integers,
+        starting at 'offset' in the buffer
+    """
+
+    def __init__(self, buffer, offset, length):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError("MappedArray index out of range")
+        return _INT.unpack_from(self.buffer, self.offset + 4 * index)[0]
+
+    def __iter__(self):
+        for index in xrange(self.length):
+            yield self[index]
+
+    def __repr__(self):
+        return "<MappedArray with %s elements>" % self.length
+
+
+_grammar_classes = {}
+
+def _grammar_class(names):
+    """Return the grammar class combining the named library classes."""
+    names = tuple(map(tuple, names))
+    if names not in _grammar_classes:
+        bases = tuple(getattr(__import__(module), name) for module, name in names)
+        if len(bases) == 1:
+            _grammar_classes[names] = bases[0]
+        else:
+            name = "_".join(base.__name__ for base in bases)
+            _grammar_classes[names] = type(name, bases, {'__module__': __name__})
+    return _grammar_classes[names]
+
+
+class DomainFileError(Exception):
+    """Raised when a file is not a compiled domain file."""
+
+
+def read_contents(buffer):
+    """Return a dict from section names to pairs (offset, length)."""
+    if len(buffer) < _HEADER.size:
+        raise DomainFileError("The file is too short")
+    magic, count = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise DomainFileError("The file is not a compiled domain file")
+    contents = {}
+    for nr in range(count):
+        name, offset, length = _ENTRY.unpack_from(buffer, _HEADER.size + nr * _ENTRY.size)
+        contents[name.rstrip("\0")] = (offset, length)
+    return contents
+
+class _DomainFile(object):
+    """A memory-mapped compiled domain file."""
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.contents = read_contents(self.buffer)
+
+    def section(self, name):
+        """Return the contents of a section, or None if it is missing."""
+        if name not in self.contents:
+            return None
+        offset, length = self.contents[name]
+        return self.buffer[offset:offset+length]
+
+    def load(self, name):
+        """Unpickle a section, or return None if it is missing."""
+        data = self.section(name)
+        return None if data is None else pickle.loads(data)
+
+    def grammar(self):
+        """Rebuild the grammar, or return None if there is none."""
+        if "grammar" not in self.contents:
+            return None
+        names, state = self.load("grammar")
+        if names is None:
+            return state
+        cls = _grammar_class(names)
+        grammar = cls.__new__(cls)
+        if hasattr(grammar, '__setstate__'):
+            grammar.__setstate__(state)
+        else:
+            grammar.__dict__.update(state)
+        if "cfg" in self.contents:
+            grammar.loadGrammarText(self.section("cfg"))
+        return grammar
+
+    def domain(self):
+        domain = CompiledDomain.__new__(CompiledDomain)
+        domain.__dict__.update(self.load("domain"))
+        domain.symbols = self.load("symbols")
+        if sys.byteorder == 'little':
+            for name in ('pred_sort', 'ind_sort'):
+                offset, length = self.contents[name]
+                setattr(domain, name, MappedArray(self.buffer, offset, length // 4))
+        else:
+            domain.compile()
+        return domain
+
+
+def open_domain_file(filename):
+    """Open a compiled domain file. Returns a pair (domain, grammar),
+    where domain is a CompiledDomain and grammar is None if there is
+    no grammar in the file.
+    """
+    domainfile = _DomainFile(filename)
+    return domainfile.domain(), domainfile.grammar()
+
+def open_system_file(filename, channel=None, cls=None):
+    """Create a dialogue manager from a file written by write_system_file.
+    
+    The dialogue manager is of the saved class, or of 'cls' if given, and
+    its state is restored from the file, so it does not have to be reset.
+    """
+    domainfile = _DomainFile(filename)
+    if "system" not in domainfile.contents:
+        raise DomainFileError("The file does not contain a dialogue system")
+    savedcls, state = domainfile.load("system")
+    dm = (cls or savedcls)(domainfile.domain(), domainfile.load("database"),
+                           domainfile.grammar(), channel)
+    restore_state(dm, state)
+    return dm
+
+######################################################################
+# running from the command line
+######################################################################
+
+def main(args):
+    import optparse
+    from ibis_replay import load_system
+    parser = optparse.OptionParser(usage="%prog [options] filename")
+    parser.add_option("--system", default="travel:ibis",
+                      help="the dialogue system, as module:attribute [%default]")
+    parser.add_option("--no-grammar", action="store_true",
+                      help="do not include the grammar")
+    parser.add_option("--warm-start", action="store_true",
+                      help="save the whole system, including the database "
+                      "and a reset state (implies the grammar)")
+    options, files = parser.parse_args(args)
+    if len(files) != 1:
+        parser.error("exactly one domain file is required")
+    system = load_system(options.system)
+    if options.warm_start:
+        write_system_file(files[0], system)
+        start = time.time()
+        dm = open_system_file(files[0])
+        print "Wrote %s: %s, opened in %.3f ms" % (
+            files[0], type(dm).__name__, (time.time() - start) * 1e3)
+        return 0
+    grammar = None if options.no_grammar else system.GRAMMAR
+    write_domain_file(files[0], system.DOMAIN, grammar)
+    start = time.time()
+    domain, grammar = open_domain_file(files[0])
+    print "Wrote %s: %d plans, opened in %.3f ms" % (
+        files[0], len(domain.plans), (time.time() - start) * 1e3)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
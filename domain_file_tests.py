@@ -0,0 +1,90 @@
+# -*- encoding: utf-8 -*-
+
+#
+# domain_file_tests.py
+#
+# This file contains unit tests for compiled domain files.
+#
+
+from ibis import *
+from ibis_replay import *
+from ibis_replay_tests import TRANSCRIPTS, PriceDB, price_system
+from domain_file import *
+from rule_trace import flatten_state
+import os
+import sys
+import subprocess
+import tempfile
+import unittest
+
+class DomainFileTests(unittest.TestCase):
+    def setUp(self):
+        self.previous_tracer = set_tracer(None)
+        fd, self.filename = tempfile.mkstemp(suffix=".dom")
+        os.close(fd)
+
+    def tearDown(self):
+        set_tracer(self.previous_tracer)
+        os.remove(self.filename)
+
+    def test_domain_file(self):
+        system = price_system()
+        write_domain_file(self.filename, system.DOMAIN, system.GRAMMAR)
+        domain, grammar = open_domain_file(self.filename)
+        self.assertTrue(isinstance(domain, CompiledDomain))
+        self.assertTrue(isinstance(domain.ind_sort, MappedArray))
+        self.assertEqual(list(domain.ind_sort), list(system.DOMAIN.compiled().ind_sort))
+        self.assertEqual(domain.plans, system.DOMAIN.plans)
+        self.assertEqual(domain.plan_questions, system.DOMAIN.plan_questions)
+        que = Question("?x.dest_city(x)")
+        for ans in ["paris", "-london", "dest_city(berlin)", "yes", "123"]:
+            ans = Answer(ans).content
+            self.assertEqual(domain.relevant(ans, que),
+                             bool(system.DOMAIN.relevant(ans, que)))
+        self.assertEqual(grammar.generateMove(Ask(que)), "Where do you want to go?")
+
+        loaded = IBIS1(domain, PriceDB(), grammar)
+        result = replay(loaded, parse_transcripts(TRANSCRIPTS))
+        self.assertEqual(result.mismatches(), [])
+
+    def test_system_file(self):
+        system = price_system()
+        write_system_file(self.filename, system)
+        self.assertTrue(type(open_system_file(self.filename)) is IBIS1)
+        channel = QueueChannel()
+        dm = open_system_file(self.filename, channel, headless(IBIS1))
+        self.assertTrue(isinstance(dm.DATABASE, PriceDB))
+        fresh = headless(IBIS1)(system.DOMAIN, system.DATABASE, system.GRAMMAR)
+        fresh.reset()
+        self.assertEqual(flatten_state(dm), flatten_state(fresh))
+        dm.IS.private.agenda.push(Greet())
+        dm.system_turn()
+        self.assertEqual(channel.outputs, ["Hello."])
+
+        write_domain_file(self.filename, system.DOMAIN)
+        self.assertRaises(DomainFileError, open_system_file, self.filename)
+
+    def test_grammar_without_system_module(self):
+        import travel
+        write_domain_file(self.filename, travel.ibis.DOMAIN, travel.ibis.GRAMMAR)
+        script = ("import sys\n"
+                  "from domain_file import *\n"
+                  "domain, grammar = open_domain_file(sys.argv[1])\n"
+                  "print 'travel' in sys.modules\n"
+                  "print type(grammar).__name__, grammar.grammarText is not None\n"
+                  "print grammar.generateMove(Ask('?x.dest_city(x)'))\n")
+        process = subprocess.Popen([sys.executable, "-c", script, self.filename],
+                                   stdout=subprocess.PIPE,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        output = process.communicate()[0].splitlines()
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(output, ["False", "SimpleGenGrammar_CFG_Grammar True",
+                                  "Where do you want to go?"])
+
+    def test_not_a_domain_file(self):
+        with open(self.filename, "wb") as f:
+            f.write("not a domain file")
+        self.assertRaises(DomainFileError, open_domain_file, self.filename)
+
+if __name__ == '__main__':
+    unittest.main()
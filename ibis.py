@@ -19,6 +19,24 @@
 # and the GNU Lesser General Public License along with this program.  
 # If not, see <http://www.gnu.org/licenses/>.
 
+import re
+import array
+import uuid
+import itertools
+
+# NumPy is optional, and is imported on first use by _import_numpy, 
+# since the import takes a long time. It is None if it is not installed.
+_NOT_IMPORTED = object()
+_numpy = _NOT_IMPORTED
+
+def _import_numpy():
+    global _numpy
+    if _numpy is _NOT_IMPORTED:
+        try:
+            import numpy as _numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
 
 from trindikit import *
 from ibis_types import *
@@ -34,6 +52,10 @@ class Grammar(object):
     Override generate and interpret if you want to use a real grammar.
     """
 
+    def warmup(self):
+        """Load any resources which are otherwise loaded on first use."""
+        pass
+
     def generate(self, moves):
         """Generate a surface string from a set of dialogue moves."""
         return self.joinPhrases(self.generateMove(move) for move in moves)
@@ -41,14 +63,22 @@ class Grammar(object):
     def generateMove(self, move):
         return str(move)
 
+    def generatePhrase(self, move):
+        """Generate a punctuated phrase from a single dialogue move."""
+        return self.punctuate(self.generateMove(move))
+
+    def generatePhrases(self, moves):
+        """Generate punctuated phrases from dialogue moves, one at a time."""
+        for move in moves:
+            yield self.generatePhrase(move)
+
+    def punctuate(self, phrase):
+        if phrase[-1] in ".?!":
+            return phrase
+        return phrase + "."
+
     def joinPhrases(self, phrases):
-        str = ""
-        for p in phrases:
-            if str != "": str += " "
-            str += p
-            if not (p[-1] == "." or p[-1] == "?" or p[-1] == "!"):
-                str += "."
-        return str
+        return " ".join(self.punctuate(p) for p in phrases)
 
     def interpret(self, input):
         """Parse an input string into a dialogue move or a set of moves."""
@@ -64,32 +94,120 @@ class Grammar(object):
 # Simple generation grammar
 ######################################################################
 
+# A template variable in a move string, see SimpleGenGrammar.
+_TEMPLATE_VARIABLE = re.compile(r"\{([A-Za-z][A-Za-z0-9_]*)\}")
+
 class SimpleGenGrammar(Grammar):
+    """A generation grammar consisting of a table of canned phrases.
+
+    Forms are added with addForm(move, output), where the move can be
+    a Move or a string which is parsed into one (see parse_move in 
+    ibis_types). Strings that are not moves (such as "icm:neg*sem") 
+    are matched against str(move).
+
+    A form is a template if the individual of an Answer is a variable
+    in braces, e.g., "Answer('price({X})')". Then {X} in the output is
+    replaced by the individual of the generated move; other braces in 
+    the output are left as they are. The polarity of the proposition 
+    is ignored, so the template also generates "-price(123)" as "The 
+    price is 123".
+
+    The phrase for each move is only computed once, and then cached.
+    The cache is shared by all dialogues which use the grammar, so it
+    holds at most CACHE_SIZE phrases; when it is full, it is cleared.
+    Moves whose phrases depend on the input (such as per*pos ICMs) are
+    generated by the functions in self.generators, which are keyed
+    by move class (or a superclass), and are not cached.
+    """
+
+    CACHE_SIZE = 1000
+
     def __init__(self):
         self.forms = dict()
-        self.addForm("'Greet'()", 'Hello')
-        self.addForm("icm:neg*sem", 'I don\'t understand')
+        self.strforms = dict()
+        self.templates = dict()
+        self.cache = dict()
+        self.generators = {ICM: self.generateICM}
+        self.addForm(Greet(), 'Hello')
+        self.addForm(ICM('neg', 'sem'), 'I don\'t understand')
+
+    def __getstate__(self):
+        # generators which are methods of the grammar are pickled by name
+        state = dict(self.__dict__)
+        state['generators'] = dict(
+            (cls, gen.__name__ if getattr(gen, '__self__', None) is self else gen)
+            for cls, gen in self.generators.items())
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.generators = dict(
+            (cls, getattr(self, gen) if isinstance(gen, basestring) else gen)
+            for cls, gen in self.generators.items())
 
     def addForm(self, move, output):
-        self.forms[move] = output
+        """Add an output form for a move, or a move template."""
+        self.cache.clear()
+        if not isinstance(move, basestring):
+            self.forms[move] = output
+            return
+        variable = _TEMPLATE_VARIABLE.search(move)
+        if variable:
+            var = variable.group(1)
+            template = parse_move(move.replace(variable.group(0), var))
+            key, ind = self.templateKey(template)
+            if key is None or ind.content != var:
+                raise ParseError("The variable %s must be the individual of an "
+                                 "Answer: %s" % (variable.group(0), move))
+            self.templates[key] = ("{%s}" % var, output)
+            return
+        try:
+            self.forms[parse_move(move)] = output
+        except ParseError:
+            self.strforms[move] = output
+
+    def templateKey(self, move):
+        """Return the template key and the individual of a move,
+        or (None, None) if the move cannot match any template.
+        """
+        if isinstance(move, Answer) and isinstance(move.content, Prop):
+            prop = move.content
+            if prop.ind is not None:
+                return (type(move), prop.pred), prop.ind
+        return None, None
 
     def generateMove(self, move):
-        try: output = self.generateICM(move)
-        except:
-            s = str(move)
-            try: output = self.forms[s]
-            except KeyError: output = s
+        output = self.cache.get(move)
+        if output is None:
+            for cls in type(move).__mro__:
+                generator = self.generators.get(cls)
+                if generator:
+                    output = generator(move)
+                    if output is not None:
+                        return output
+                    break
+            output = self.compileMove(move)
+            if len(self.cache) >= self.CACHE_SIZE:
+                self.cache.clear()
+            self.cache[move] = output
         return output
 
-    def generateICM(self, move):
-        assert isinstance(move, ICM)
-        try: return self.generateIcmPerPos(move)
-        except: raise
-
-    def generateIcmPerPos(self, icm):
-        assert icm.level == "per"
-        assert icm.polarity == "pos"
-        return "I heard you say " + icm.icm_content
+    def compileMove(self, move):
+        """Find the output for a move, without consulting the cache."""
+        output = self.forms.get(move)
+        if output is not None:
+            return output
+        key, ind = self.templateKey(move)
+        if key in self.templates:
+            var, template = self.templates[key]
+            return template.replace(var, str(ind))
+        s = str(move)
+        return self.strforms.get(s, s)
+
+    def generateICM(self, icm):
+        """Generate an ICM move, or return None if it has a fixed form."""
+        if icm.level == "per" and icm.polarity == "pos":
+            return "I heard you say " + icm.icm_content
 
 ######################################################################
 # IBIS database
@@ -108,6 +226,12 @@ class Database(object):
 # IBIS domain
 ######################################################################
 
+# The number of answers which CompiledDomain.relevant_answers tests at
+# once using relevant_matrix. For a single question, the NumPy version 
+# of CompiledDomain.relevant_matrix is faster than testing the answers 
+# one by one from about 100 answers.
+RELEVANCE_BATCH = 100
+
 class Domain(object):
     """An IBIS domain, consisting of predicates, sorts and individuals.
     
@@ -126,6 +250,8 @@ class Domain(object):
         self.inds = dict((ind,sort) for sort in self.sorts 
                          for ind in self.sorts[sort])
         self.plans = {}
+        self.plan_questions = set()
+        self.resolution_index = {}
 
     def add_plan(self, trigger, plan):
         """Add a plan to the domain."""
@@ -139,6 +265,60 @@ class Domain(object):
         for m in plan:
             m._typecheck(self)
         self.plans[trigger] = tuple(plan)
+        self.index_plan(plan)
+
+    def index_plan(self, plan):
+        """Add the questions of the Findout and Raise constructs in a
+        plan (and in the branches of its If constructs) to the 
+        resolution index, see resolved_questions.
+        """
+        for construct in plan:
+            if isinstance(construct, If):
+                self.index_plan(construct.iftrue)
+                self.index_plan(construct.iffalse)
+            elif isinstance(construct, (Findout, Raise)):
+                que = construct.content
+                if que in self.plan_questions:
+                    continue
+                self.plan_questions.add(que)
+                # the keys are the preds or the propositions which resolve que
+                if isinstance(que, WhQ):
+                    keys = [que.pred]
+                elif isinstance(que, YNQ):
+                    keys = [que.prop]
+                elif isinstance(que, AltQ):
+                    keys = [ynq.prop for ynq in que.ynqs]
+                for key in keys:
+                    self.resolution_index.setdefault(key, set()).add(que)
+
+    def resolved_questions(self, props, questions):
+        """Return the set of the questions that are resolved by some of
+        the propositions in 'props'.
+        
+        The questions in plans added with add_plan are looked up in the 
+        resolution index, so this takes time proportional to the number 
+        of propositions, not to the number of questions times the number
+        of propositions. Other questions are tested with self.resolves.
+        """
+        index = self.resolution_index
+        resolved = set()
+        others = []
+        for prop in props:
+            if not isinstance(prop, Prop):
+                others.append(prop)
+                continue
+            if prop.yes:
+                resolved.update(index.get(prop.pred, ()))
+            resolved.update(que for que in index.get(prop, ()) 
+                            if self.resolves(prop, que))
+        result = set()
+        for que in questions:
+            if que in resolved:
+                result.add(que)
+            elif que not in self.plan_questions or others:
+                if any(self.resolves(prop, que) for prop in props):
+                    result.add(que)
+        return result
 
     def relevant(self, answer, question):
         """True if 'answer' is relevant to 'question'."""
@@ -165,6 +345,50 @@ class Domain(object):
             return answer.yes == True
         return False
 
+    def relevant_matrix(self, answers, questions):
+        """Return a matrix M, where M[i][j] is true if answers[i] is 
+        relevant to questions[j]. 
+        """
+        return [[bool(self.relevant(ans, que)) for que in questions]
+                for ans in answers]
+
+    def relevance_test(self, question):
+        """Return a function which is true for the answers that are 
+        relevant to 'question', in the same way as self.relevant. The 
+        question, and the sort of its predicate, are only looked up once.
+        """
+        assert isinstance(question, Question)
+        if isinstance(question, WhQ):
+            pred = question.pred
+            sort = self.preds1.get(pred.content)
+            inds = self.inds
+            def test(answer):
+                if isinstance(answer, Prop):
+                    return answer.pred == pred
+                return (sort is not None and not isinstance(answer, YesNo) and
+                        inds.get(answer.ind.content) == sort)
+        elif isinstance(question, YNQ):
+            prop = question.prop
+            def test(answer):
+                return isinstance(answer, YesNo) or answer == prop
+        elif isinstance(question, AltQ):
+            props = [ynq.prop for ynq in question.ynqs]
+            def test(answer):
+                return answer in props
+        else:
+            def test(answer):
+                return False
+        return test
+
+    def relevant_answers(self, answers, question):
+        """Iterate over the answers that are relevant to 'question', in 
+        order. The answers can be any iterable, and are read lazily.
+        """
+        test = self.relevance_test(question)
+        for ans in answers:
+            if test(ans):
+                yield ans
+
     def combine(self, question, answer):
         """Return the proposition that is the result of combining 'question' 
         with 'answer'. This presupposes that 'answer' is relevant to 'question'.
@@ -194,11 +418,347 @@ class Domain(object):
         return planstack
 
 
+    def compiled(self):
+        """Return a CompiledDomain with the same contents as this domain."""
+        return CompiledDomain.from_domain(self)
+
+######################################################################
+# IBIS compiled domain
+######################################################################
+
+class SymbolTable(object):
+    """Dense integer ids for predicates, sorts and individuals.
+    
+    SymbolTable(keys=None) -> new table, with the keys (a dict from each
+        kind of symbol to a list of keys, as in self.keys) if given
+    
+    There is one table for each kind of symbol, mapping a key to an id,
+    and a list mapping the ids back to the keys. The keys of predicates
+    are pairs (arity, name), and the keys of individuals are their
+    contents (strings or integers). Ids are never reused, so codes of 
+    terms stay valid when new symbols are added. Every table has a 
+    unique token, which is stored together with the codes of terms.
+    """
+    
+    def __init__(self, keys=None):
+        self.ids = {'pred': {}, 'sort': {}, 'ind': {}}
+        self.keys = {'pred': [], 'sort': [], 'ind': []}
+        self.token = uuid.uuid4().hex
+        for kind, kind_keys in (keys or {}).items():
+            for key in kind_keys:
+                self.id(kind, key)
+    
+    def id(self, kind, key):
+        """Return the id of a symbol, adding it if it is new."""
+        ids = self.ids[kind]
+        try:
+            return ids[key]
+        except KeyError:
+            keys = self.keys[kind]
+            ids[key] = len(keys)
+            keys.append(key)
+            return ids[key]
+    
+    def find(self, kind, key):
+        """Return the id of a symbol, or None if it is not in the table."""
+        return self.ids[kind].get(key)
+    
+    def key(self, kind, id):
+        """Return the key of a symbol id."""
+        return self.keys[kind][id]
+    
+    def size(self, kind):
+        return len(self.keys[kind])
+
+# The first element of a term code is the kind of term:
+CODE_PROP, CODE_SHORTANS, CODE_YESNO, CODE_WHQ, CODE_YNQ, CODE_ALTQ = range(6)
+
+def term_code(term, symbols):
+    """Return the code of a term, a small tuple of integers, where the
+    predicates and individuals are coded by their ids in the SymbolTable
+    'symbols':
+    
+      - Prop(pred, ind, yes) -> (CODE_PROP, pred id, ind id or -1, yes)
+      - ShortAns(ind, yes)   -> (CODE_SHORTANS, ind id, yes)
+      - YesNo(yes)           -> (CODE_YESNO, yes)
+      - WhQ(pred)            -> (CODE_WHQ, pred id)
+      - YNQ(prop)            -> (CODE_YNQ, code of prop)
+      - AltQ(ynqs)           -> (CODE_ALTQ, code of prop 1, code of prop 2, ...)
+    
+    where yes is 1 or 0, so that the last element of the code of an
+    answer is always its polarity. If a predicate or an individual is
+    not in the table, the term has no code, and None is returned; no
+    symbols are added to the table. The code is computed once, and then
+    stored in the attribute _code of the term, with the token of the
+    table.
+    """
+    try:
+        token, code = term._code
+        if token == symbols.token:
+            return code
+    except AttributeError:
+        pass
+    if isinstance(term, Prop):
+        pred, ind, yes = term.content
+        pred = symbols.find('pred', (0 if ind is None else 1, pred.content))
+        ind = -1 if ind is None else symbols.find('ind', ind.content)
+        code = None if pred is None or ind is None else (CODE_PROP, pred, ind, int(yes))
+    elif isinstance(term, YesNo):
+        code = (CODE_YESNO, int(term.yes))
+    elif isinstance(term, ShortAns):
+        ind = symbols.find('ind', term.ind.content)
+        code = None if ind is None else (CODE_SHORTANS, ind, int(term.yes))
+    elif isinstance(term, WhQ):
+        pred = symbols.find('pred', (1, term.pred.content))
+        code = None if pred is None else (CODE_WHQ, pred)
+    elif isinstance(term, YNQ):
+        prop = term_code(term.prop, symbols)
+        code = None if prop is None else (CODE_YNQ, prop)
+    elif isinstance(term, AltQ):
+        props = tuple(term_code(ynq.prop, symbols) for ynq in term.ynqs)
+        code = None if None in props else (CODE_ALTQ,) + props
+    else:
+        raise TypeError("%r is not an answer or a question" % (term,))
+    if code is not None:
+        term._code = (symbols.token, code)
+    return code
+
+def code_term(code, symbols):
+    """Return the term with the given code, the inverse of term_code."""
+    kind = code[0]
+    if kind == CODE_PROP:
+        arity, pred = symbols.key('pred', code[1])
+        if arity == 0:
+            return Prop(Pred0(pred), None, bool(code[3]))
+        return Prop(Pred1(pred), Ind(symbols.key('ind', code[2])), bool(code[3]))
+    elif kind == CODE_SHORTANS:
+        return ShortAns(Ind(symbols.key('ind', code[1])), bool(code[2]))
+    elif kind == CODE_YESNO:
+        return YesNo(bool(code[1]))
+    elif kind == CODE_WHQ:
+        return WhQ(Pred1(symbols.key('pred', code[1])[1]))
+    elif kind == CODE_YNQ:
+        return YNQ(code_term(code[1], symbols))
+    elif kind == CODE_ALTQ:
+        return AltQ([YNQ(code_term(prop, symbols)) for prop in code[1:]])
+    raise ValueError("%r is not a term code" % (code,))
+
+
+class CompiledDomain(Domain):
+    """An IBIS domain where the symbols are coded as integers.
+    
+    CompiledDomain(preds0, preds1, sorts) creates a new domain, in the
+    same way as Domain. Or use domain.compiled() for an existing domain.
+    
+    Every predicate, sort and individual of the domain has an integer id
+    in the SymbolTable self.symbols, and answers and questions are coded
+    as small tuples of integers by self.code. The arrays self.pred_sort
+    and self.ind_sort map predicate ids and individual ids to sort ids,
+    or -1 if there is no sort. The relevance and resolvedness tests only
+    compare integers. Terms with symbols outside the domain (such as 
+    individuals typed by the user) have no code, and are tested in the
+    same way as in Domain.
+    
+    The domain is compiled when it is created. If new predicates, sorts
+    or individuals are added afterwards, call self.compile() again.
+    """
+    
+    def __init__(self, preds0, preds1, sorts):
+        Domain.__init__(self, preds0, preds1, sorts)
+        self.compile()
+    
+    @classmethod
+    def from_domain(cls, domain):
+        """Create a compiled domain from an existing domain."""
+        compiled = cls.__new__(cls)
+        compiled.__dict__.update(domain.__dict__)
+        compiled.compile()
+        return compiled
+    
+    def compile(self):
+        """Add the symbols to self.symbols and build the sort arrays."""
+        symbols = self.__dict__.setdefault('symbols', SymbolTable())
+        for pred in self.preds0:
+            symbols.id('pred', (0, pred))
+        for sort in self.sorts:
+            symbols.id('sort', sort)
+        for pred, sort in self.preds1.items():
+            symbols.id('pred', (1, pred))
+            symbols.id('sort', sort)
+        for ind in self.inds:
+            symbols.id('ind', ind)
+        self.pred_sort = array.array('i', [-1]) * symbols.size('pred')
+        for pred, sort in self.preds1.items():
+            self.pred_sort[symbols.id('pred', (1, pred))] = symbols.id('sort', sort)
+        self.ind_sort = array.array('i', [-1]) * symbols.size('ind')
+        for ind, sort in self.inds.items():
+            self.ind_sort[symbols.id('ind', ind)] = symbols.id('sort', sort)
+    
+    def code(self, term):
+        """The code of a term in this domain (see term_code), or None."""
+        return term_code(term, self.symbols)
+    
+    def term(self, code):
+        """The term with a code in this domain (see code_term)."""
+        return code_term(code, self.symbols)
+    
+    def ind_sort_id(self, ind):
+        """The sort id of an individual id, or -1."""
+        return self.ind_sort[ind] if 0 <= ind < len(self.ind_sort) else -1
+    
+    def pred_sort_id(self, pred):
+        """The sort id of a predicate id, or -1."""
+        return self.pred_sort[pred] if 0 <= pred < len(self.pred_sort) else -1
+    
+    def relevant(self, answer, question):
+        """True if 'answer' is relevant to 'question'."""
+        ans = term_code(answer, self.symbols)
+        que = term_code(question, self.symbols)
+        if ans is None or que is None:
+            return bool(Domain.relevant(self, answer, question))
+        return self.relevant_code(ans, que)
+    
+    def relevant_code(self, ans, que):
+        """True if the answer code 'ans' is relevant to the question code 'que'."""
+        kind = que[0]
+        if kind == CODE_WHQ:
+            if ans[0] == CODE_PROP:
+                return ans[1] == que[1]
+            elif ans[0] == CODE_SHORTANS:
+                sort = self.ind_sort_id(ans[1])
+                return sort >= 0 and sort == self.pred_sort_id(que[1])
+            return False
+        elif kind == CODE_YNQ:
+            return ans[0] == CODE_YESNO or ans == que[1]
+        elif kind == CODE_ALTQ:
+            return ans in que[1:]
+        return False
+    
+    def relevant_matrix(self, answers, questions):
+        """Return a matrix M, where M[i][j] is true if answers[i] is 
+        relevant to questions[j]. 
+        
+        If NumPy is installed, M is a boolean array, which is computed 
+        from integer arrays of the answer and question codes. Otherwise,
+        M is a list of lists, as for Domain.relevant_matrix.
+        """
+        numpy = _import_numpy()
+        if numpy is None:
+            return Domain.relevant_matrix(self, answers, questions)
+        acodes = [term_code(ans, self.symbols) for ans in answers]
+        qcodes = [term_code(que, self.symbols) for que in questions]
+        if None in acodes or None in qcodes:
+            return Domain.relevant_matrix(self, answers, questions)
+        # dense ids for the propositions in this batch
+        props = {}
+        def prop_id(code):
+            return props.setdefault(code, len(props))
+        def column(values):
+            return numpy.array(values, dtype=numpy.intc).reshape(-1, 1)
+        akind = column([a[0] for a in acodes])
+        apred = column([a[1] if a[0] == CODE_PROP else -1 for a in acodes])
+        asort = column([self.ind_sort_id(a[1]) if a[0] == CODE_SHORTANS else -1
+                        for a in acodes])
+        aprop = column([prop_id(a) if a[0] == CODE_PROP else -1 for a in acodes])
+        qkind = column([q[0] for q in qcodes]).T
+        qpred = column([q[1] if q[0] == CODE_WHQ else -2 for q in qcodes]).T
+        qsort = column([self.pred_sort_id(q[1]) if q[0] == CODE_WHQ else -2
+                        for q in qcodes]).T
+        qprop = column([prop_id(q[1]) if q[0] == CODE_YNQ else -2 for q in qcodes]).T
+        matrix = ((akind == CODE_PROP) & (apred == qpred) |
+                  (asort >= 0) & (asort == qsort) |
+                  (akind == CODE_YESNO) & (qkind == CODE_YNQ) |
+                  (aprop == qprop))
+        for j, que in enumerate(qcodes):
+            if que[0] == CODE_ALTQ:
+                alternatives = [prop_id(prop) for prop in que[1:]]
+                matrix[:, j] = numpy.in1d(aprop[:, 0], alternatives)
+        return matrix
+
+    def relevant_answers(self, answers, question):
+        """Iterate over the answers that are relevant to 'question', in 
+        order. The answers are read in chunks of RELEVANCE_BATCH, and each
+        full chunk is tested all at once using relevant_matrix.
+        """
+        answers = iter(answers)
+        while True:
+            chunk = list(itertools.islice(answers, RELEVANCE_BATCH))
+            if len(chunk) < RELEVANCE_BATCH:
+                for ans in chunk:
+                    if self.relevant(ans, question):
+                        yield ans
+                return
+            matrix = self.relevant_matrix(chunk, [question])
+            for ans, row in zip(chunk, matrix):
+                if row[0]:
+                    yield ans
+
+    def resolves(self, answer, question):
+        """True if 'question' is resolved by 'answer'."""
+        ans = term_code(answer, self.symbols)
+        que = term_code(question, self.symbols)
+        if ans is None or que is None:
+            return Domain.resolves(self, answer, question)
+        return self.relevant_code(ans, que) and (que[0] == CODE_YNQ or ans[-1] == 1)
+
 ######################################################################
 # IBIS information state
 ######################################################################
 
+class BeliefView(object):
+    """A read-only view of the propositions in /private/bel and 
+    /shared/com, which does not copy the sets.
+    
+    BeliefView(bel, com) -> new view
+    
+    prop in view is true if prop is in any of the sets, and iterating
+    over the view gives every proposition once. The methods private 
+    and unshared iterate over some of the propositions in bel.
+    """
+    
+    def __init__(self, bel, com):
+        self.bel = bel
+        self.com = com
+    
+    def __contains__(self, prop):
+        return prop in self.bel or prop in self.com
+    
+    def __iter__(self):
+        for prop in self.bel:
+            yield prop
+        for prop in self.com:
+            if prop not in self.bel:
+                yield prop
+    
+    def __len__(self):
+        return len(self.bel) + sum(1 for prop in self.com if prop not in self.bel)
+    
+    def private(self):
+        """Iterate over the propositions in bel."""
+        return iter(self.bel)
+    
+    def unshared(self):
+        """Iterate over the propositions in bel which are not in com."""
+        for prop in self.bel:
+            if prop not in self.com:
+                yield prop
+    
+    def __repr__(self):
+        return "<BeliefView with %s propositions>" % len(self)
+
+
 class IBISInfostate(DialogueManager):
+    @property
+    def BELIEFS(self):
+        """A BeliefView of /private/bel and /shared/com. The same view
+        is returned as long as the sets in the infostate are the same.
+        """
+        private, shared = self.IS.private, self.IS.shared
+        view = self.__dict__.get('_beliefs')
+        if view is None or view.bel is not private.bel or view.com is not shared.com:
+            view = self._beliefs = BeliefView(private.bel, shared.com)
+        return view
+
     def init_IS(self):
         """Definition of the IBIS information state."""
         self.IS = record(private = record(agenda = stack(), 
@@ -207,7 +767,9 @@ class IBISInfostate(DialogueManager):
                          shared  = record(com    = set(),
                                           qud    = stackset(),
                                           lu     = record(speaker = Speaker,
-                                                          moves   = set())))
+                                                          moves   = set)))
+        # any set of moves can be copied from LATEST_MOVES, see get_latest_moves
+        self.IS.shared.lu.moves = moveset()
 
     def print_IS(self, prefix=""):
         """Pretty-print the information state."""
@@ -223,34 +785,116 @@ class IBISController(DialogueManager):
         self.IS.private.agenda.push(Greet())
         self.print_state()
         while True:
-            self.select()
-            if self.NEXT_MOVES:
-                self.generate()
-                self.output()
-                self.update()
-                self.print_state()
+            self.system_turn()
             if self.PROGRAM_STATE.get() == ProgramState.QUIT:
                 break
             self.input()
-            self.interpret()
+            if self.PROGRAM_STATE.get() == ProgramState.QUIT:
+                break
+            self.user_turn()
+
+    def system_turn(self):
+        """Select, generate and output the next system utterance, if any."""
+        self.select()
+        if self.NEXT_MOVES:
+            self.generate()
+            self.output()
             self.update()
             self.print_state()
 
+    def user_turn(self):
+        """Interpret and integrate the user utterance in INPUT."""
+        tracer = get_tracer()
+        if tracer:
+            tracer.turn()
+        self.interpret()
+        self.update()
+        self.print_state()
+
+    # Batch execution: turns of many dialogue managers in lockstep.
+    # The dialogue managers must be of the same class.
+
+    @classmethod
+    def batch_update(cls, dms):
+        """Run the update algorithm for each dialogue manager. Subclasses
+        can override this with a lockstep version of update.
+        
+        Returns the list of dialogue managers where update failed, i.e.,
+        raised PreconditionFailure. The others are updated as usual."""
+        failed = []
+        for dm in dms:
+            try:
+                dm.update()
+            except PreconditionFailure:
+                failed.append(dm)
+        return failed
+
+    @classmethod
+    def batch_select(cls, dms):
+        """Run the select algorithm for each dialogue manager. Subclasses
+        can override this with a lockstep version of select."""
+        for dm in dms:
+            dm.select()
+
+    @classmethod
+    def batch_user_turn(cls, dms):
+        """The same as dm.user_turn() for each dialogue manager, but the
+        update is run for all of them in lockstep, see batch_update.
+        Returns the list of dialogue managers where update failed."""
+        tracer = get_tracer()
+        for dm in dms:
+            if tracer:
+                tracer.turn()
+            dm.interpret()
+        failed = cls.batch_update(dms)
+        for dm in dms:
+            if dm not in failed:
+                dm.print_state()
+        return failed
+
+    @classmethod
+    def batch_system_turn(cls, dms):
+        """The same as dm.system_turn() for each dialogue manager, but 
+        select and update are run in lockstep. Returns the list of 
+        dialogue managers where update failed."""
+        cls.batch_select(dms)
+        speaking = [dm for dm in dms if dm.NEXT_MOVES]
+        for dm in speaking:
+            dm.generate()
+            dm.output()
+        failed = cls.batch_update(speaking)
+        for dm in speaking:
+            if dm not in failed:
+                dm.print_state()
+        return failed
+
 class IBIS(IBISController, IBISInfostate, StandardMIVS, 
            SimpleInput, SimpleOutput, DialogueManager):
     """The IBIS dialogue manager. 
     
     This is an abstract class: methods update and select are not implemented.
+
+    The input and output go through the console, unless another
+    channel is given, see trindikit.Channel.
     """
-    def __init__(self, domain, database, grammar):
+    def __init__(self, domain, database, grammar, channel=None):
         self.DOMAIN = domain
         self.DATABASE = database
         self.GRAMMAR = grammar
+        if channel is not None:
+            self.CHANNEL = channel
 
     def reset(self):
         self.init_IS()
         self.init_MIVS()
 
+    def warmup(self):
+        """Load the resources of the grammar in advance, instead of
+        when the first utterance is interpreted."""
+        warmup = getattr(self.GRAMMAR, 'warmup', None)
+        if warmup:
+            warmup()
+
     def print_state(self):
         print "+------------------------ - -  -"
         self.print_MIVS(prefix="| ")
@@ -267,28 +911,85 @@ class IBIS(IBISController, IBISInfostate, StandardMIVS,
 class IBIS1(IBIS):
     """The IBIS-1 dialogue manager."""
 
+    @algorithm
     def update(self):
         self.IS.private.agenda.clear()
         self.grounding()
+        maybe(self.reinterpret)
         maybe(self.integrate)
         maybe(self.downdate_qud)
         maybe(self.load_plan)
         repeat(self.exec_plan)
 
+    @classmethod
+    def batch_update(cls, dms):
+        """The update algorithm for many dialogue managers in lockstep,
+        see trindikit.batch_do. The dialogue managers where update is 
+        overridden are updated one at a time.
+        
+        The dialogue managers where grounding fails are left out of the
+        rest of the algorithm, as when update raises PreconditionFailure
+        for a single dialogue manager, and they are returned in a list.
+        
+        Under a tracer, the rules are traced once per dialogue manager,
+        as in update, but the update algorithm and the rule groups are 
+        traced once per batch, see trindikit.trace_batch."""
+        if any(type(dm).update.im_func is not IBIS1.update.im_func for dm in dms):
+            return super(IBIS1, cls).batch_update(dms)
+        return trace_batch("update", cls._lockstep_update, dms)
+
+    @classmethod
+    def _lockstep_update(cls, dms):
+        for dm in dms:
+            dm.IS.private.agenda.clear()
+        failed = batch_do(dms, cls.grounding)
+        if failed:
+            ungrounded = set(id(dm) for dm in failed)
+            dms = [dm for dm in dms if id(dm) not in ungrounded]
+        batch_maybe(dms, cls.reinterpret)
+        batch_maybe(dms, cls.integrate)
+        batch_maybe(dms, cls.downdate_qud)
+        batch_maybe(dms, cls.load_plan)
+        batch_repeat(dms, cls.exec_plan)
+        return failed
+
     grounding    = rule_group(get_latest_moves)
+    reinterpret  = rule_group(reinterpret)
     integrate    = rule_group(integrate_usr_ask, integrate_sys_ask,
                                 integrate_answer, integrate_greet,
                                 integrate_usr_quit, integrate_sys_quit)
     downdate_qud = rule_group(downdate_qud)
     load_plan    = rule_group(recover_plan, find_plan)
-    exec_plan    = rule_group(remove_findout, remove_raise, exec_consultDB, execute_if)
+    exec_plan    = rule_group(remove_resolved, exec_consultDB, execute_if)
 
+    @algorithm
     def select(self):
         if not self.IS.private.agenda:
             maybe(self.select_action)
         maybe(self.select_icm)
         maybe(self.select_move)
 
+    @classmethod
+    def batch_select(cls, dms):
+        """The select algorithm for many dialogue managers in lockstep,
+        traced in the same way as batch_update."""
+        if any(type(dm).select.im_func is not IBIS1.select.im_func for dm in dms):
+            return super(IBIS1, cls).batch_select(dms)
+        return trace_batch("select", cls._lockstep_select, dms)
+
+    @classmethod
+    def _lockstep_select(cls, dms):
+        batch_maybe([dm for dm in dms if not dm.IS.private.agenda], cls.select_action)
+        batch_maybe(dms, cls.select_icm)
+        batch_maybe(dms, cls.select_move)
+
     select_action = rule_group(select_respond, select_from_plan, reraise_issue)
     select_move   = rule_group(select_answer, select_ask, select_other)
     select_icm    = rule_group(select_icm_sem_neg)
+
+class StreamingIBIS1(StreamingOutput, IBIS1):
+    """The IBIS-1 dialogue manager, with streaming output.
+
+    Each selected move is passed on to OUTPUT_SINK as soon as it is
+    pushed onto NEXT_MOVES, see StreamingOutput.
+    """
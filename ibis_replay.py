@@ -0,0 +1,489 @@
+# -*- encoding: utf-8 -*-
+
+#
+# ibis_replay.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# and the GNU Lesser General Public License along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+
+"""Replaying scripted dialogues, such as the ones in travel_tests.txt.
+
+A transcript file consists of dialogues on the following form:
+
+    --- title of the dialogue
+    *
+    S> system utterance
+    U> user utterance
+    U>
+    S> ...
+    *
+
+The dialogues are replayed headlessly against an IBIS dialogue manager,
+checking that the system utterances are the expected ones, and measuring
+the latency, the number of applied update rules, and (optionally) the
+memory allocated in every turn, see AllocationMeter.
+
+Usage: python ibis_replay.py [options] [transcript files...]
+"""
+
+import sys
+import gc
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from trindikit import *
+from ibis import *
+
+######################################################################
+# transcripts
+######################################################################
+
+class Transcript(object):
+    """A scripted dialogue.
+
+    Transcript(title, turns) -> new transcript, where turns is a list
+        of pairs (speaker, utterance), with speaker either "S" or "U"
+    """
+
+    def __init__(self, title, turns):
+        self.title = title
+        self.turns = list(turns)
+
+    def user_turns(self):
+        """Split the transcript into the initial system utterances,
+        and a list of pairs (user utterance, system utterances).
+        """
+        initial = []
+        exchanges = []
+        for speaker, utterance in self.turns:
+            if speaker == "U":
+                exchanges.append((utterance, []))
+            elif exchanges:
+                exchanges[-1][1].append(utterance)
+            else:
+                initial.append(utterance)
+        return initial, exchanges
+
+    def __repr__(self):
+        return "<Transcript %r with %s turns>" % (self.title, len(self.turns))
+
+
+def parse_transcripts(lines):
+    """Parse transcripts from a sequence of lines, e.g., an open file.
+
+    Returns a list of Transcript objects.
+    """
+    transcripts = []
+    title = None
+    turns = None
+    for nr, line in enumerate(lines):
+        line = line.rstrip("\r\n")
+        if line.startswith("---"):
+            title = line[3:].strip()
+        elif line.strip() == "*":
+            if turns is None:
+                turns = []
+            else:
+                transcripts.append(Transcript(title, turns))
+                title = turns = None
+        elif turns is not None and line[:2] in ("S>", "U>"):
+            turns.append((line[0], line[2:].strip()))
+        elif line.strip():
+            raise SyntaxError("Line %d: could not parse transcript line: %s"
+                              % (nr+1, line))
+    if turns is not None:
+        raise SyntaxError("Unterminated transcript: %s" % title)
+    return transcripts
+
+def load_transcripts(filename):
+    """Parse all transcripts in a file."""
+    with open(filename) as f:
+        return parse_transcripts(f)
+
+######################################################################
+# replaying dialogues
+######################################################################
+
+class CountingTracer(Tracer):
+    """A tracer which only counts the number of applied update rules.
+
+    self.count is the number of rules applied since self.reset_count().
+    Session.step and step_batch reset the count at the start of every 
+    turn; they accept any tracer with the same count attribute and 
+    reset_count method, such as rule_trace.TraceRecorder.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def reset_count(self):
+        self.count = 0
+
+    def fired(self, rulename):
+        self.count += 1
+
+
+class CountingProfiler(CountingTracer, RuleProfiler):
+    """A RuleProfiler which also counts the applied update rules."""
+
+    def __init__(self):
+        CountingTracer.__init__(self)
+        RuleProfiler.__init__(self)
+
+
+class HeadlessIBIS(object):
+    """Mixin for IBIS dialogue managers, which does not print the state."""
+
+    def print_state(self):
+        pass
+
+_headless_classes = {}
+
+def headless(cls):
+    """Return a subclass of the dialogue manager class which does not
+    print the state.
+    """
+    if issubclass(cls, HeadlessIBIS):
+        return cls
+    if cls not in _headless_classes:
+        _headless_classes[cls] = type("Headless" + cls.__name__, (HeadlessIBIS, cls), {})
+    return _headless_classes[cls]
+
+
+def allocations_measured():
+    """True if AllocationMeter measures real allocations, with tracemalloc
+    or sys.getallocatedblocks. Otherwise it counts the gc-tracked objects,
+    which is only a rough proxy.
+    """
+    return tracemalloc is not None or hasattr(sys, 'getallocatedblocks')
+
+def allocated_objects():
+    """Return the number of allocated memory blocks, or, if that is not
+    available in this version of Python, the number of gc-tracked objects.
+    """
+    try:
+        return sys.getallocatedblocks()
+    except AttributeError:
+        return len(gc.get_objects())
+
+
+class AllocationMeter(object):
+    """Measures the memory which is allocated during a turn.
+
+    If tracemalloc is tracing (it is started by replay, if it is
+    available), the traces are cleared before the turn, so that stop
+    returns the number of bytes which were allocated during the turn 
+    and are still alive, and the peak number of bytes, which includes
+    the transient containers of the turn. Otherwise, stop returns the
+    difference in allocated_objects, and None as the peak.
+    """
+
+    def __init__(self):
+        self.before = 0
+
+    def start(self):
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.clear_traces()
+        else:
+            self.before = allocated_objects()
+
+    def stop(self):
+        """Return a pair (allocations, peak) for the turn."""
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()
+        return allocated_objects() - self.before, None
+
+
+class TurnStats(object):
+    """Measurements for one dialogue turn."""
+
+    def __init__(self, latency, rules, allocations, peak=None):
+        self.latency = latency
+        self.rules = rules
+        self.allocations = allocations
+        self.peak = peak
+
+
+class Session(object):
+    """A replay of one transcript, which can be run one turn at a time.
+
+    Session(system, transcript, measure_allocations, template) -> new 
+        session, where system is an IBIS instance, whose domain, database 
+        and grammar are used for a new headless dialogue manager; if a
+        SessionTemplate is given, it is used instead of calling reset
+    """
+
+    def __init__(self, system, transcript, measure_allocations=False, template=None):
+        self.channel = QueueChannel()
+        self.dm = headless(type(system))(system.DOMAIN, system.DATABASE, system.GRAMMAR,
+                      self.channel)
+        self.transcript = transcript
+        self.initial, self.exchanges = transcript.user_turns()
+        self.meter = AllocationMeter() if measure_allocations else None
+        self.template = template
+        self.position = -1
+        self.stats = []
+        self.mismatches = []
+
+    def finished(self):
+        return self.position >= len(self.exchanges)
+
+    def step(self, tracer):
+        """Run the next turn of the dialogue, and compare the output."""
+        dm = self.dm
+        tracer.reset_count()
+        allocations = peak = 0
+        if self.meter:
+            self.meter.start()
+        start = time.time()
+        if self.begin_turn():
+            dm.user_turn()
+        dm.system_turn()
+        latency = time.time() - start
+        if self.meter:
+            allocations, peak = self.meter.stop()
+        self.end_turn(TurnStats(latency, tracer.count, allocations, peak))
+
+    def begin_turn(self):
+        """Start the dialogue, or read the next user utterance. 
+        Returns True if there is a user turn to run before the system turn.
+        """
+        dm = self.dm
+        if self.position < 0:
+            if self.template:
+                self.template.start(dm)
+            else:
+                dm.reset()
+            dm.IS.private.agenda.push(Greet())
+            return False
+        utterance, expected = self.exchanges[self.position]
+        self.channel.feed(utterance)
+        dm.input()
+        return True
+
+    def end_turn(self, stats):
+        """Compare the output of the turn, and go to the next turn."""
+        if self.position < 0:
+            expected = self.initial
+        else:
+            utterance, expected = self.exchanges[self.position]
+        self.stats.append(stats)
+        outputs = self.channel.outputs
+        if outputs != expected:
+            self.mismatches.append((self.position + 1, expected, list(outputs)))
+        del outputs[:]
+        self.position += 1
+        if self.template and self.finished():
+            self.template.finish(self.dm)
+
+
+def step_batch(sessions, tracer):
+    """Run the next turn of several sessions of the same dialogue system,
+    where the update and select algorithms are run for all sessions in 
+    lockstep (see IBISController.batch_user_turn). The latency and the
+    number of rules of each turn are the averages of the batch, and no
+    allocations are measured.
+    """
+    tracer.reset_count()
+    start = time.time()
+    users = [session.dm for session in sessions if session.begin_turn()]
+    cls = type(sessions[0].dm)
+    cls.batch_user_turn(users)
+    cls.batch_system_turn([session.dm for session in sessions])
+    latency = (time.time() - start) / len(sessions)
+    rules = float(tracer.count) / len(sessions)
+    for session in sessions:
+        session.end_turn(TurnStats(latency, rules, 0))
+
+
+class ReplayResult(object):
+    """The result of replaying a number of sessions.
+
+    If the replay was profiled, self.profiler is the RuleProfiler.
+    """
+
+    def __init__(self, sessions, elapsed, profiler=None):
+        self.sessions = sessions
+        self.elapsed = elapsed
+        self.profiler = profiler
+        self.stats = [stat for s in sessions for stat in s.stats]
+
+    def mismatches(self):
+        """Return a list of (title, turn, expected, got) for all
+        turns where the output differs from the transcript.
+        """
+        return [(s.transcript.title, turn, expected, got)
+                for s in self.sessions
+                for (turn, expected, got) in s.mismatches]
+
+    def throughput(self):
+        """The number of turns per second."""
+        return len(self.stats) / self.elapsed if self.elapsed else 0.0
+
+    def steady_stats(self):
+        """The measurements of all turns except the first turn of each
+        session, which resets the state."""
+        return [stat for s in self.sessions for stat in s.stats[1:]]
+
+    def report(self, out=None):
+        """Print a report of the measurements."""
+        out = out or sys.stdout
+        latencies = sorted(stat.latency * 1000 for stat in self.stats)
+        rules = [stat.rules for stat in self.stats]
+        allocations = [stat.allocations for stat in self.stats]
+        print >>out, "sessions:     %d" % len(self.sessions)
+        print >>out, "turns:        %d" % len(self.stats)
+        print >>out, "elapsed:      %.3f s" % self.elapsed
+        print >>out, "throughput:   %.1f turns/s" % self.throughput()
+        print >>out, "latency (ms): " + "  ".join(
+            "p%s=%.3f" % (p, percentile(latencies, p)) for p in (50, 90, 99, 100))
+        print >>out, "rules/turn:   mean=%.1f max=%d" % (mean(rules), max(rules))
+        if any(allocations):
+            steady = [stat.allocations for stat in self.steady_stats()]
+            print >>out, "allocs/turn:  mean=%.1f max=%d steady=%.1f" % (
+                mean(allocations), max(allocations), mean(steady))
+            peaks = [stat.peak for stat in self.stats if stat.peak is not None]
+            if peaks:
+                print >>out, "peak/turn:    mean=%.1f max=%d bytes" % (mean(peaks),
+                                                                   max(peaks))
+        mismatches = self.mismatches()
+        print >>out, "mismatches:   %d" % len(mismatches)
+        for title, turn, expected, got in mismatches:
+            print >>out, "  %s, turn %d: expected %r, got %r" % (title, turn, expected, got)
+
+
+def percentile(sorted_values, p):
+    """The p:th percentile of a sorted list, using the nearest-rank method."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1,
+                      int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+def mean(values):
+    return float(sum(values)) / len(values) if values else 0.0
+
+
+def session_template(system):
+    """Return a SessionTemplate for headless sessions of a dialogue system."""
+    dm = headless(type(system))(system.DOMAIN, system.DATABASE, system.GRAMMAR,
+                                QueueChannel())
+    dm.reset()
+    return SessionTemplate(dm)
+
+def replay(system, transcripts, repeat=1, sessions=1, measure_allocations=False,
+           profile=False, templates=False, batch=False):
+    """Replay the transcripts headlessly against a dialogue system.
+
+    Every transcript is replayed 'repeat' times in each of 'sessions'
+    simultaneous sessions. The sessions take turns round-robin, which
+    simulates concurrent dialogues in one process. If 'profile' is true,
+    the update rules are profiled with a RuleProfiler, which makes the
+    replay slower. If 'templates' is true, the sessions are started from
+    a SessionTemplate instead of by reset. If 'measure_allocations' is
+    true, the allocations of every turn are measured with tracemalloc,
+    if it is available, see AllocationMeter. If 'batch' is true, each
+    round of turns is run in lockstep by step_batch, instead of one 
+    session at a time, and no allocations are measured. Returns a 
+    ReplayResult.
+    """
+    tracer = CountingProfiler() if profile else CountingTracer()
+    template = session_template(system) if templates else None
+    tracing = (measure_allocations and tracemalloc is not None 
+               and not tracemalloc.is_tracing())
+    if tracing:
+        tracemalloc.start()
+    previous = set_tracer(tracer)
+    try:
+        active = [Session(system, transcript, measure_allocations, template)
+                  for _ in range(sessions)
+                  for transcript in transcripts
+                  for _ in range(repeat)]
+        finished = []
+        start = time.time()
+        while active:
+            if batch:
+                step_batch(active, tracer)
+            else:
+                for session in active:
+                    session.step(tracer)
+            finished.extend(s for s in active if s.finished())
+            active = [s for s in active if not s.finished()]
+        elapsed = time.time() - start
+    finally:
+        set_tracer(previous)
+        if tracing:
+            tracemalloc.stop()
+    return ReplayResult(finished, elapsed, tracer if profile else None)
+
+######################################################################
+# running from the command line
+######################################################################
+
+def load_system(spec):
+    """Load a dialogue system from a string 'module:attribute'."""
+    modname, _, attr = spec.partition(":")
+    module = __import__(modname)
+    return getattr(module, attr or "ibis")
+
+def main(args):
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options] [transcript files...]")
+    parser.add_option("--system", default="travel:ibis",
+                      help="the dialogue system, as module:attribute [%default]")
+    parser.add_option("--repeat", type="int", default=1,
+                      help="replay every transcript N times [%default]")
+    parser.add_option("--sessions", type="int", default=1,
+                      help="number of simultaneous sessions [%default]")
+    parser.add_option("--allocations", action="store_true",
+                      help="measure the allocations per turn, with tracemalloc "
+                      "if it is available (slow)")
+    parser.add_option("--profile", action="store_true",
+                      help="profile the update rules, and print a table")
+    parser.add_option("--flamegraph", metavar="FILE",
+                      help="profile, and write collapsed stacks to FILE")
+    parser.add_option("--templates", action="store_true",
+                      help="start the sessions from a template instead of by reset")
+    parser.add_option("--batch", action="store_true",
+                      help="run the turns of all sessions in lockstep")
+    parser.add_option("--compile", action="store_true",
+                      help="compile the IBIS update rules (see rule_compiler.py)")
+    options, files = parser.parse_args(args)
+    system = load_system(options.system)
+    if options.compile:
+        import ibis_rules
+        from rule_compiler import compile_rules
+        for name, reason in sorted(compile_rules(ibis_rules).items()):
+            print "Could not compile %s: %s" % (name, reason)
+    transcripts = []
+    for filename in files or ["travel_tests.txt"]:
+        transcripts.extend(load_transcripts(filename))
+    profile = options.profile or options.flamegraph
+    result = replay(system, transcripts, options.repeat, options.sessions,
+                    options.allocations, profile, options.templates, options.batch)
+    result.report()
+    if options.profile:
+        print
+        result.profiler.pprint()
+    if options.flamegraph:
+        with open(options.flamegraph, "w") as f:
+            f.write(result.profiler.collapsed())
+    return 1 if result.mismatches() else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,150 @@
+# -*- encoding: utf-8 -*-
+
+#
+# ibis_replay_tests.py
+#
+# This file contains unit tests for replaying scripted dialogues.
+#
+
+from ibis import *
+from ibis_replay import *
+import gc
+import unittest
+
+TRANSCRIPTS = """
+--- price query
+*
+S> Hello.
+U> Ask("?x.price(x)")
+S> Where do you want to go?
+U>
+S> Where do you want to go?
+U> Answer("paris")
+S> The price is 123.
+*
+
+--- misunderstanding
+*
+S> Hello.
+U> dfg dfgdfgdfg
+S> I heard you say dfg dfgdfgdfg. I don't understand.
+*
+""".splitlines()
+
+class PriceDB(Database):
+    def consultDB(self, question, context):
+        return Prop(Pred1("price"), Ind(123), True)
+
+def price_system():
+    domain = Domain([], {'price': 'int', 'dest_city': 'city'},
+                    {'city': ['paris', 'london']})
+    domain.add_plan("?x.price(x)",
+                    [Findout("?x.dest_city(x)"),
+                     ConsultDB("?x.price(x)")])
+    grammar = SimpleGenGrammar()
+    grammar.addForm("Ask('?x.dest_city(x)')", "Where do you want to go?")
+    grammar.addForm("Answer('price({X})')", "The price is {X}")
+    return IBIS1(domain, PriceDB(), grammar)
+
+class IbisReplayTests(unittest.TestCase):
+    def setUp(self):
+        self.previous_tracer = set_tracer(None)
+
+    def tearDown(self):
+        set_tracer(self.previous_tracer)
+
+    def test_parse_transcripts(self):
+        transcripts = parse_transcripts(TRANSCRIPTS)
+        self.assertEqual(len(transcripts), 2)
+        self.assertEqual(transcripts[0].title, "price query")
+        initial, exchanges = transcripts[0].user_turns()
+        self.assertEqual(initial, ["Hello."])
+        self.assertEqual(exchanges[1], ("", ["Where do you want to go?"]))
+        self.assertRaises(SyntaxError, parse_transcripts, ["*", "S> Hello."])
+
+    def test_replay(self):
+        transcripts = parse_transcripts(TRANSCRIPTS)
+        result = replay(price_system(), transcripts, repeat=2, sessions=2)
+        self.assertEqual(result.mismatches(), [])
+        self.assertEqual(len(result.sessions), 8)
+        self.assertEqual(len(result.stats), 8 * 3)
+        self.assertTrue(all(stat.rules > 0 for stat in result.stats))
+
+    def test_replay_templates(self):
+        transcripts = parse_transcripts(TRANSCRIPTS)
+        result = replay(price_system(), transcripts, repeat=2, templates=True)
+        self.assertEqual(result.mismatches(), [])
+        self.assertEqual(len(result.stats), 2 * (4 + 2))
+
+    @unittest.skipUnless(allocations_measured(),
+                         "there is no allocation counter in this version of Python")
+    def test_allocations(self):
+        transcripts = parse_transcripts(TRANSCRIPTS)
+        system = price_system()
+        replay(system, transcripts)
+        # no garbage collection during the measurements
+        gc.disable()
+        try:
+            baseline = replay(system, transcripts, measure_allocations=True)
+            result = replay(system, transcripts, repeat=3, measure_allocations=True,
+                            templates=True)
+        finally:
+            gc.enable()
+        self.assertEqual(result.mismatches(), [])
+        steady = [stat.allocations for stat in result.steady_stats()]
+        self.assertEqual(len(steady), 3 * (3 + 1))
+        # no turn of the repeated sessions from a template allocates more
+        # than the most expensive turn of a single replay, up to a few
+        # small objects (bytes with tracemalloc, otherwise memory blocks)
+        import ibis_replay
+        slack = 1024 if ibis_replay.tracemalloc is not None else 8
+        expected = [stat.allocations for stat in baseline.steady_stats()]
+        self.assertTrue(max(steady) <= max(expected) + slack, (steady, expected))
+
+    def test_replay_batch(self):
+        transcripts = parse_transcripts(TRANSCRIPTS)
+        single = replay(price_system(), transcripts, repeat=2, sessions=2)
+        batch = replay(price_system(), transcripts, repeat=2, sessions=2, batch=True)
+        self.assertEqual(batch.mismatches(), [])
+        self.assertEqual(len(batch.stats), len(single.stats))
+        self.assertEqual(sum(stat.rules for stat in batch.stats),
+                         sum(stat.rules for stat in single.stats))
+        transcripts = parse_transcripts(["*", "S> Goodbye.", "*"] + TRANSCRIPTS)
+        result = replay(price_system(), transcripts, batch=True)
+        self.assertEqual(result.mismatches(), [(None, 0, ["Goodbye."], ["Hello."])])
+
+    def test_profile_batch(self):
+        transcripts = parse_transcripts(TRANSCRIPTS)
+        single = replay(price_system(), transcripts, sessions=3, profile=True)
+        batch = replay(price_system(), transcripts, sessions=3, profile=True, batch=True)
+        self.assertEqual(batch.mismatches(), [])
+        single, batch = single.profiler.snapshot(), batch.profiler.snapshot()
+        self.assertEqual(batch["rule"], dict((name, dict(stats, wall=batch["rule"][name]["wall"],
+                                                         cpu=batch["rule"][name]["cpu"]))
+                                             for name, stats in single["rule"].items()))
+        # algorithms and rule groups are traced once per batch
+        for kind in ("algorithm", "group"):
+            self.assertEqual(sorted(batch[kind]), sorted(single[kind]))
+            for name, stats in batch[kind].items():
+                self.assertTrue(0 < stats["attempts"] < single[kind][name]["attempts"])
+
+    def test_replay_mismatch(self):
+        transcripts = parse_transcripts(["*", "S> Goodbye.", "*"])
+        result = replay(price_system(), transcripts)
+        self.assertEqual(result.mismatches(), [(None, 0, ["Goodbye."], ["Hello."])])
+
+    def test_profile(self):
+        transcripts = parse_transcripts(TRANSCRIPTS)
+        result = replay(price_system(), transcripts, profile=True)
+        self.assertEqual(result.mismatches(), [])
+        stats = result.profiler.snapshot()
+        self.assertEqual(stats["rule"]["exec_consultDB"]["firings"], 1)
+        integrate = stats["rule"]["integrate_answer"]
+        self.assertEqual(integrate["attempts"],
+                         integrate["firings"] + integrate["failures"])
+        self.assertTrue("update" in stats["algorithm"])
+        self.assertEqual(len(stats["turns"]), 1 + 4)
+        self.assertTrue("update;<integrate_usr_ask|" in result.profiler.collapsed())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,347 @@
+# -*- encoding: utf-8 -*-
+
+#
+# ibis_router.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# and the GNU Lesser General Public License along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+
+"""Running dialogue sessions in several worker processes.
+
+Every worker process hosts many headless sessions of the same dialogue
+system, and listens on a Unix socket. A Router connects to all workers,
+and sends every turn to the worker given by a hash of the session id,
+so that all turns of a session go to the same worker (session affinity).
+
+The protocol is line-based: a batch of turns is sent to a worker as one
+line with a JSON list of requests, and the worker answers with one line
+with a JSON list of responses, in the same order:
+
+    request:  {"session": id, "input": utterance}
+              where a missing (or null) input starts a new session,
+              and "end": true finishes the session after the turn
+    response: {"session": id, "output": [system utterances]}
+              with "end": true if the session is finished, or
+              {"session": id, "error": message}
+
+A session is also finished when the dialogue manager quits, and when
+it has been idle for longer than the timeout of the worker.
+
+The load generator replays transcripts (see ibis_replay.py) in many
+simultaneous sessions, one turn of each session per batch, and reports
+the number of turns per second for different numbers of workers.
+
+Usage: python ibis_router.py [--system module:attribute] [--workers 1,2,4]
+                             [--sessions N] [--repeat N] [transcript files...]
+"""
+
+import sys
+import os
+import json
+import time
+import zlib
+import socket
+import shutil
+import tempfile
+import multiprocessing
+
+from trindikit import *
+from ibis import *
+from ibis_replay import headless, session_template, load_system, load_transcripts
+
+######################################################################
+# workers
+######################################################################
+
+class Worker(object):
+    """The sessions of one worker process.
+
+    Worker(system, timeout=None) -> new worker, whose sessions are 
+        headless dialogue managers with the domain, database and grammar
+        of system; they are started from a SessionTemplate, and finished
+        when they have been idle for more than timeout seconds
+    """
+
+    def __init__(self, system, timeout=None):
+        self.system = system
+        self.template = session_template(system)
+        self.timeout = timeout
+        self.sessions = {}
+        self.last_turn = {}
+
+    def finish(self, session):
+        """Finish a session, and put its state in the template's pool."""
+        self.last_turn.pop(session, None)
+        self.template.finish(self.sessions.pop(session))
+
+    def expire(self, now):
+        """Finish the sessions which have been idle for too long."""
+        if self.timeout is not None:
+            for session, last in self.last_turn.items():
+                if now - last > self.timeout:
+                    self.finish(session)
+
+    def turn(self, request):
+        """Run one turn of a session, and return the response."""
+        session = request["session"]
+        utterance = request.get("input")
+        if isinstance(utterance, unicode):
+            utterance = utterance.encode("utf-8")
+        if utterance is None:
+            if session in self.sessions:
+                self.finish(session)
+            channel = QueueChannel()
+            dm = headless(type(self.system))(self.system.DOMAIN, self.system.DATABASE,
+                                             self.system.GRAMMAR, channel)
+            self.template.start(dm)
+            self.sessions[session] = dm
+            dm.IS.private.agenda.push(Greet())
+            dm.system_turn()
+        else:
+            dm = self.sessions.get(session)
+            if dm is None:
+                return {"session": session, "error": "unknown session"}
+            channel = dm.CHANNEL
+            channel.feed(utterance)
+            dm.input()
+            dm.user_turn()
+            dm.system_turn()
+        self.last_turn[session] = time.time()
+        response = {"session": session, "output": list(channel.outputs)}
+        del channel.outputs[:]
+        if request.get("end") or dm.PROGRAM_STATE.get() == ProgramState.QUIT:
+            self.finish(session)
+            response["end"] = True
+        return response
+
+    def handle(self, requests):
+        """Run a batch of turns, and return the list of responses.
+
+        If a turn raises an exception, its session is dropped, and the
+        response is an error. Idle sessions are finished before the batch.
+        """
+        self.expire(time.time())
+        responses = []
+        for request in requests:
+            try:
+                responses.append(self.turn(request))
+            except Exception, err:
+                self.sessions.pop(request.get("session"), None)
+                self.last_turn.pop(request.get("session"), None)
+                responses.append({"session": request.get("session"), 
+                                  "error": "%s: %s" % (type(err).__name__, err)})
+        return responses
+
+
+def serve_worker(path, system, timeout=None):
+    """Run a worker process: listen on the Unix socket 'path', and
+    answer batches of requests from one router until it disconnects.
+    """
+    set_tracer(None)
+    worker = Worker(system, timeout)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    conn, _ = server.accept()
+    server.close()
+    channel = SocketChannel(conn)
+    while True:
+        line = channel.readline()
+        if line is None:
+            break
+        channel.writeline(json.dumps(worker.handle(json.loads(line))))
+        channel.flush()
+    channel.close()
+
+######################################################################
+# the router
+######################################################################
+
+def session_worker(session, workers):
+    """The worker number (0 <= n < workers) of a session id."""
+    if not isinstance(session, str):
+        session = unicode(session).encode("utf-8")
+    return (zlib.crc32(session) & 0xffffffff) % workers
+
+
+class Router(object):
+    """Routes turns to worker processes by session id.
+
+    Router(system, workers, timeout=None) -> new router, which starts
+        'workers' worker processes for the dialogue system, and connects
+        to them; sessions which are idle for more than timeout seconds
+        are finished by the workers
+
+    The router must be closed, which stops the workers.
+    """
+
+    def __init__(self, system, workers, timeout=None):
+        self.directory = tempfile.mkdtemp(prefix="ibis_router")
+        self.processes = []
+        self.channels = []
+        try:
+            paths = [os.path.join(self.directory, "worker%d" % nr) for nr in range(workers)]
+            for path in paths:
+                process = multiprocessing.Process(target=serve_worker,
+                                                  args=(path, system, timeout))
+                process.daemon = True
+                process.start()
+                self.processes.append(process)
+            for path in paths:
+                self.channels.append(SocketChannel(self.connect(path)))
+        except:
+            self.close()
+            raise
+
+    def connect(self, path, timeout=30.0):
+        """Connect to a worker, waiting until it is listening."""
+        deadline = time.time() + timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+                return sock
+            except socket.error:
+                sock.close()
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def submit(self, requests):
+        """Send a batch of requests to the workers, and return the
+        responses, in the same order as the requests.
+
+        Every worker gets (at most) one line with all its requests, and
+        all workers run their batches in parallel.
+        """
+        batches = [[] for _ in self.channels]
+        for nr, request in enumerate(requests):
+            batches[session_worker(request["session"], len(batches))].append(nr)
+        for channel, batch in zip(self.channels, batches):
+            if batch:
+                channel.writeline(json.dumps([requests[nr] for nr in batch]))
+                channel.flush()
+        responses = [None] * len(requests)
+        for channel, batch in zip(self.channels, batches):
+            if batch:
+                line = channel.readline()
+                if line is None:
+                    raise IOError("A worker process has stopped")
+                for nr, response in zip(batch, json.loads(line)):
+                    responses[nr] = response
+        return responses
+
+    def close(self):
+        """Disconnect from the workers, and wait for them to stop."""
+        for channel in self.channels:
+            channel.close()
+        for process in self.processes:
+            process.join()
+        self.channels = []
+        self.processes = []
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+######################################################################
+# load generation
+######################################################################
+
+class LoadResult(object):
+    """The result of a load test."""
+
+    def __init__(self, workers, sessions, turns, elapsed, mismatches):
+        self.workers = workers
+        self.sessions = sessions
+        self.turns = turns
+        self.elapsed = elapsed
+        self.mismatches = mismatches
+
+    def throughput(self):
+        """The number of turns per second."""
+        return self.turns / self.elapsed if self.elapsed else 0.0
+
+
+def load_test(system, transcripts, workers=1, sessions=1, repeat=1):
+    """Replay the transcripts through a Router with a number of workers.
+
+    Every transcript is replayed 'repeat' times in each of 'sessions'
+    simultaneous sessions, as in ibis_replay.replay. Every batch has
+    one turn of each active session. The time for starting the workers
+    is not included. Returns a LoadResult.
+    """
+    dialogues = [("%d:%d:%d" % (nr, rep, ses), transcript.user_turns())
+                 for ses in range(sessions)
+                 for nr, transcript in enumerate(transcripts)
+                 for rep in range(repeat)]
+    router = Router(system, workers)
+    try:
+        turns = mismatches = 0
+        positions = dict((session, -1) for session, _ in dialogues)
+        active = dialogues
+        start = time.time()
+        while active:
+            requests = []
+            expected = []
+            for session, (initial, exchanges) in active:
+                position = positions[session]
+                request = {"session": session}
+                if position < 0:
+                    expected.append(initial)
+                else:
+                    request["input"], output = exchanges[position]
+                    expected.append(output)
+                if position + 1 >= len(exchanges):
+                    request["end"] = True
+                requests.append(request)
+            for response, output in zip(router.submit(requests), expected):
+                if response.get("output") != output:
+                    mismatches += 1
+            turns += len(requests)
+            for session, _ in active:
+                positions[session] += 1
+            active = [(session, turns_) for session, turns_ in active
+                      if positions[session] < len(turns_[1])]
+        elapsed = time.time() - start
+    finally:
+        router.close()
+    return LoadResult(workers, len(dialogues), turns, elapsed, mismatches)
+
+######################################################################
+# running from the command line
+######################################################################
+
+def main(args):
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options] [transcript files...]")
+    parser.add_option("--system", default="travel:ibis",
+                      help="the dialogue system, as module:attribute [%default]")
+    parser.add_option("--workers", default="1,2,4",
+                      help="comma-separated numbers of worker processes [%default]")
+    parser.add_option("--sessions", type="int", default=100,
+                      help="number of simultaneous sessions [%default]")
+    parser.add_option("--repeat", type="int", default=1,
+                      help="replay every transcript N times [%default]")
+    options, files = parser.parse_args(args)
+    system = load_system(options.system)
+    transcripts = []
+    for filename in files or ["travel_tests.txt"]:
+        transcripts.extend(load_transcripts(filename))
+    print "%7s %8s %8s %10s %10s" % ("workers", "sessions", "turns", "turns/s", "mismatches")
+    for workers in [int(n) for n in options.workers.split(",")]:
+        result = load_test(system, transcripts, workers, options.sessions, options.repeat)
+        print "%7d %8d %8d %10.1f %10d" % (result.workers, result.sessions, result.turns,
+                                           result.throughput(), result.mismatches)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
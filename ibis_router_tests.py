@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+
+#
+# ibis_router_tests.py
+#
+# This file contains unit tests for running sessions in worker processes.
+#
+
+from ibis_router import *
+from ibis_replay import parse_transcripts
+from ibis_replay_tests import TRANSCRIPTS, price_system
+import time
+import unittest
+
+class IbisRouterTests(unittest.TestCase):
+    def setUp(self):
+        self.previous_tracer = set_tracer(None)
+
+    def tearDown(self):
+        set_tracer(self.previous_tracer)
+
+    def test_session_worker(self):
+        self.assertEqual(set(session_worker(nr, 3) for nr in range(100)), set([0, 1, 2]))
+        self.assertEqual(session_worker("abc", 4), session_worker(u"abc", 4))
+        self.assertEqual(session_worker(u"k\xf6", 4), session_worker("k\xc3\xb6", 4))
+
+    def test_worker(self):
+        worker = Worker(price_system())
+        responses = worker.handle([{"session": 1}, {"session": 2},
+                                   {"session": 1, "input": u'Ask("?x.price(x)")'},
+                                   {"session": 2, "input": "dfg dfg", "end": True},
+                                   {"session": 2, "input": "dfg dfg"}])
+        self.assertEqual([r.get("output") for r in responses],
+                         [["Hello."], ["Hello."], ["Where do you want to go?"],
+                          ["I heard you say dfg dfg. I don't understand."], None])
+        self.assertEqual(responses[-1], {"session": 2, "error": "unknown session"})
+        self.assertEqual(sorted(worker.sessions), [1])
+
+    def test_finished_sessions(self):
+        worker = Worker(price_system(), timeout=60)
+        worker.handle([{"session": 1}, {"session": 2}])
+        first = worker.sessions[1]
+        worker.handle([{"session": 1}])
+        self.assertTrue(worker.sessions[1] is not first)
+        self.assertTrue(worker.sessions[1].IS is first.IS)
+        response = worker.turn({"session": 1, "input": "Quit()"})
+        self.assertTrue(response["end"])
+        self.assertEqual(sorted(worker.sessions), [2])
+        self.assertEqual(len(worker.template.pool), 1)
+        worker.expire(time.time() + 30)
+        self.assertEqual(sorted(worker.sessions), [2])
+        worker.expire(time.time() + 90)
+        self.assertEqual(worker.sessions, {})
+        self.assertEqual(worker.last_turn, {})
+
+    def test_router(self):
+        router = Router(price_system(), 2)
+        try:
+            requests = [{"session": nr} for nr in range(10)]
+            responses = router.submit(requests)
+            self.assertEqual([r["session"] for r in responses], range(10))
+            self.assertEqual([r["output"] for r in responses], [["Hello."]] * 10)
+            responses = router.submit([{"session": nr, "input": 'Ask("?x.price(x)")'}
+                                       for nr in range(10)])
+            self.assertEqual([r["output"] for r in responses],
+                             [["Where do you want to go?"]] * 10)
+        finally:
+            router.close()
+        self.assertFalse(os.path.exists(router.directory))
+
+    def test_load_test(self):
+        transcripts = parse_transcripts(TRANSCRIPTS)
+        result = load_test(price_system(), transcripts, workers=2, sessions=3)
+        self.assertEqual(result.mismatches, 0)
+        self.assertEqual(result.sessions, 3 * 2)
+        self.assertEqual(result.turns, 3 * (4 + 2))
+        self.assertTrue(result.throughput() > 0)
+
+if __name__ == '__main__':
+    unittest.main()
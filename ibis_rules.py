@@ -41,6 +41,43 @@ def get_latest_moves(IS, LATEST_MOVES, LATEST_SPEAKER):
         yield LATEST_MOVES
     IS.shared.lu.speaker = LATEST_SPEAKER.get()
 
+def integrable(moves, IS, DOMAIN):
+    """True if some of the moves can be integrated, i.e., if there is
+    an Ask, Greet or Quit move, or an Answer which is relevant to the 
+    top question on /shared/qud.
+    """
+    answers = []
+    for move in moves:
+        if isinstance(move, (Ask, Greet, Quit)):
+            return True
+        elif isinstance(move, Answer):
+            answers.append(move.content)
+    if answers and IS.shared.qud:
+        que = IS.shared.qud.top()
+        for ans in DOMAIN.relevant_answers(answers, que):
+            return True
+    return False
+
+@update_rule
+def reinterpret(IS, HYPOTHESES, DOMAIN):
+    """Replace the latest user moves with a later hypothesis.
+    
+    If none of the moves in /shared/lu can be integrated, the
+    HYPOTHESES are evaluated in order, until one is found whose
+    moves can be integrated. These moves replace the moves in 
+    /shared/lu, in place, since it is the same set as LATEST_MOVES.
+    """
+    @precondition
+    def V():
+        if IS.shared.lu.speaker == Speaker.USR:
+            if not integrable(IS.shared.lu.moves, IS, DOMAIN):
+                for score, moves in HYPOTHESES:
+                    if integrable(moves, IS, DOMAIN):
+                        yield R(score=score, moves=moves)
+    moves = IS.shared.lu.moves
+    moves.clear()
+    moves.update(V.moves)
+
 # Integrating utterances
 
 @update_rule
@@ -52,9 +89,8 @@ def integrate_sys_ask(IS):
     @precondition
     def V():
         if IS.shared.lu.speaker == Speaker.SYS:
-            for move in IS.shared.lu.moves:
-                if isinstance(move, Ask):
-                    yield R(move=move, que=move.content)
+            for move in moves_of_type(IS.shared.lu.moves, Ask):
+                yield R(move=move, que=move.content)
     IS.shared.qud.push(V.que)
 
 @update_rule
@@ -67,9 +103,8 @@ def integrate_usr_ask(IS):
     @precondition
     def V():
         if IS.shared.lu.speaker == Speaker.USR:
-            for move in IS.shared.lu.moves:
-                if isinstance(move, Ask):
-                    yield R(move=move, que=move.content)
+            for move in moves_of_type(IS.shared.lu.moves, Ask):
+                yield R(move=move, que=move.content)
     IS.shared.qud.push(V.que)
     IS.private.agenda.push(Respond(V.que))
 
@@ -83,10 +118,9 @@ def integrate_answer(IS, DOMAIN):
     @precondition
     def V():
         que = IS.shared.qud.top()
-        for move in IS.shared.lu.moves:
-            if isinstance(move, Answer):
-                if DOMAIN.relevant(move.content, que):
-                    yield R(que=que, ans=move.content)
+        answers = (move.content for move in moves_of_type(IS.shared.lu.moves, Answer))
+        for ans in DOMAIN.relevant_answers(answers, que):
+            yield R(que=que, ans=ans)
     prop = DOMAIN.combine(V.que, V.ans)
     IS.shared.com.add(prop)
 
@@ -98,9 +132,8 @@ def integrate_greet(IS):
     """
     @precondition
     def V():
-        for move in IS.shared.lu.moves:
-            if isinstance(move, Greet): 
-                yield R(move=move)
+        for move in moves_of_type(IS.shared.lu.moves, Greet):
+            yield R(move=move)
     pass
 
 @update_rule
@@ -112,9 +145,8 @@ def integrate_sys_quit(IS, PROGRAM_STATE):
     @precondition
     def V():
         if IS.shared.lu.speaker == Speaker.SYS:
-            for move in IS.shared.lu.moves:
-                if isinstance(move, Quit):
-                    yield R(move=move)
+            for move in moves_of_type(IS.shared.lu.moves, Quit):
+                yield R(move=move)
     PROGRAM_STATE.set(ProgramState.QUIT)
 
 @update_rule
@@ -126,9 +158,8 @@ def integrate_usr_quit(IS):
     @precondition
     def V():
         if IS.shared.lu.speaker == Speaker.USR:
-            for move in IS.shared.lu.moves:
-                if isinstance(move, Quit):
-                    yield R(move=move)
+            for move in moves_of_type(IS.shared.lu.moves, Quit):
+                yield R(move=move)
     IS.private.agenda.push(Quit())
 
 # Downdating the QUD
@@ -161,7 +192,7 @@ def downdate_qud(IS, DOMAIN):
 # Finding plans
 
 @update_rule
-def find_plan(IS, DOMAIN):
+def find_plan(IS, DOMAIN, BELIEFS):
     """Find a dialogue plan for resolving a question.
     
     If there is a Respond move first in /private/agenda, and 
@@ -174,7 +205,7 @@ def find_plan(IS, DOMAIN):
         move = IS.private.agenda.top()
         if isinstance(move, Respond):
             resolved = any(DOMAIN.resolves(prop, move.content) 
-                           for prop in IS.private.bel)
+                           for prop in BELIEFS.private())
             if not resolved:
                 plan = DOMAIN.get_plan(move.content)
                 if plan:
@@ -185,11 +216,12 @@ def find_plan(IS, DOMAIN):
 # Executing plans
 
 @update_rule
-def execute_if(IS):
+def execute_if(IS, BELIEFS):
     """Execute an If(...) plan construct.
     
     If the topmost construct in /private/plan is an If,
-    test if the condition is in /private/bel or /shared/com.
+    test if the condition is in /private/bel or /shared/com
+    (using the BELIEFS view, without building the union).
     If it is, add the iftrue plan to /private/plan,
     otherwise, add the iffalse plan to /private/plan.
     """
@@ -198,7 +230,7 @@ def execute_if(IS):
         move = IS.private.plan.top()
         if isinstance(move, If):
             if isinstance(move.cond, YNQ):
-                if move.cond.content in (IS.private.bel | IS.shared.com):
+                if move.cond.content in BELIEFS:
                     yield R(test=move.cond, success=True, subplan=move.iftrue)
                 else:
                     yield R(test=move.cond, success=False, subplan=move.iffalse)
@@ -224,6 +256,37 @@ def remove_findout(IS, DOMAIN):
                     yield R(move=move, prop=prop)
     IS.private.plan.pop()
 
+@update_rule
+def remove_resolved(IS, DOMAIN):
+    """Remove all resolved Findout and Raise moves from the top of
+    the current plan.
+    
+    This is the same as applying remove_findout and remove_raise 
+    repeatedly, but the questions which are resolved by /shared/com
+    are found all at once, see Domain.resolved_questions. So if 
+    several questions are answered in the same utterance, the plan 
+    goes directly to the next unresolved construct.
+    """
+    @precondition
+    def V():
+        moves = []
+        for move in reversed(IS.private.plan):
+            if not isinstance(move, (Findout, Raise)):
+                break
+            moves.append(move)
+        if moves:
+            resolved = DOMAIN.resolved_questions(IS.shared.com,
+                                                 [move.content for move in moves])
+            count = 0
+            for move in moves:
+                if move.content not in resolved:
+                    break
+                count += 1
+            if count:
+                yield R(moves=tuple(moves[:count]))
+    for move in V.moves:
+        IS.private.plan.pop()
+
 @update_rule
 def exec_consultDB(IS, DATABASE):
     """Consult the database for the answer to a question.
@@ -299,7 +362,7 @@ def select_from_plan(IS):
     IS.private.agenda.push(V.move)
 
 @update_rule
-def select_respond(IS, DOMAIN):
+def select_respond(IS, DOMAIN, BELIEFS):
     """Answer a question on the QUD.
     
     If both /private/agenda and /private/plan are empty, and there
@@ -311,10 +374,9 @@ def select_respond(IS, DOMAIN):
     def V():
         if not IS.private.agenda and not IS.private.plan:
             que = IS.shared.qud.top()
-            for prop in IS.private.bel:
-                if prop not in IS.shared.com:
-                    if DOMAIN.relevant(prop, que):
-                        yield R(que=que, prop=prop)
+            for prop in BELIEFS.unshared():
+                if DOMAIN.relevant(prop, que):
+                    yield R(que=que, prop=prop)
     IS.private.agenda.push(Respond(V.que))
 
 @update_rule
@@ -370,7 +432,7 @@ def select_ask(IS, NEXT_MOVES):
             IS.private.plan.pop()
 
 @update_rule
-def select_answer(IS, DOMAIN, NEXT_MOVES):
+def select_answer(IS, DOMAIN, BELIEFS, NEXT_MOVES):
     """Select an Answer move from the agenda.
     
     If the topmost move in /private/agenda is a Respond, and there
@@ -381,8 +443,7 @@ def select_answer(IS, DOMAIN, NEXT_MOVES):
                      (R(prop=prop)
                       for move in [IS.private.agenda.top()]
                       if isinstance(move, Respond)
-                      for prop in IS.private.bel
-                      if prop not in IS.shared.com
+                      for prop in BELIEFS.unshared()
                       if DOMAIN.relevant(prop, move.content)))
     
 #     @precondition
@@ -0,0 +1,280 @@
+# -*- encoding: utf-8 -*-
+
+#
+# ibis_synth.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# and the GNU Lesser General Public License along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+
+"""Synthetic IBIS domains and simulated users, for scaling benchmarks.
+
+synthetic_domain builds a Domain of any size, with one plan for the
+question "?x.goal(x)". The plan consists of Findouts, some of which are
+inside (nested) If constructs. A SimulatedUser answers the questions
+that the system asks, and benchmark measures how the time for the IBIS-1
+update and select algorithms grows with the size of the domain, and
+thereby with the size of the plan and of /shared/com.
+
+Usage: python ibis_synth.py [--sizes 10,20,40,80] [--dialogues N]
+"""
+
+import sys
+import math
+import random
+import time
+
+from trindikit import *
+from ibis import *
+from ibis_replay import headless
+
+GOAL = "?x.goal(x)"
+
+######################################################################
+# synthetic domains
+######################################################################
+
+def synthetic_domain(preds=20, sorts=5, inds=50, plan_length=10,
+                     nesting=1, segment=3, seed=0):
+    """Create a synthetic domain.
+
+    The domain has 'preds' 1-place predicates, 'sorts' sorts and 'inds'
+    individuals, which are evenly distributed over the sorts. Each
+    predicate has a random sort. There is one plan, for the question
+    "?x.goal(x)", with 'plan_length' Findouts of wh-questions, followed
+    by a ConsultDB.
+
+    The Findouts are divided into blocks of length segment * 2**(nesting-1),
+    and every other block is put in an If construct. Each block is in turn
+    divided in the same way into blocks half as long, down to blocks of
+    length 'segment', so that Ifs are nested up to a depth of 'nesting'.
+    The condition of an If is a 0-place predicate. Half of the Ifs are
+    preceded by a Findout of the condition, the other half are not, which
+    means that the false branch will be taken.
+    """
+    rnd = random.Random(seed)
+    sortnames = ["sort%d" % i for i in range(sorts)]
+    sortdict = dict((sort, []) for sort in sortnames)
+    for i in range(inds):
+        sortdict[sortnames[i % sorts]].append("ind%d" % i)
+    predicates = ["pred%d" % i for i in range(preds)]
+    preds1 = dict((pred, rnd.choice(sortnames)) for pred in predicates)
+    preds1["goal"] = "int"
+    preds0 = []
+
+    def build(questions, depth):
+        if depth == 0:
+            return [Findout(que) for que in questions]
+        plan = []
+        size = segment * 2 ** (depth - 1)
+        for nr, start in enumerate(range(0, len(questions), size)):
+            subplan = build(questions[start:start+size], depth-1)
+            if nr % 2 == 1:
+                cond = "cond%d" % len(preds0)
+                preds0.append(cond)
+                if rnd.random() < 0.5:
+                    plan.append(Findout("?%s()" % cond))
+                plan.append(If("?%s()" % cond, subplan))
+            else:
+                plan.extend(subplan)
+        return plan
+
+    questions = ["?x.%s(x)" % predicates[i % preds] for i in range(plan_length)]
+    plan = build(questions, nesting) + [ConsultDB(GOAL)]
+    domain = Domain(preds0, preds1, sortdict)
+    domain.add_plan(GOAL, plan)
+    return domain
+
+
+class SyntheticDB(Database):
+    """A database which answers the goal question with the number of
+    propositions in the context.
+    """
+
+    def consultDB(self, question, context):
+        return Prop(Pred1("goal"), Ind(len(context)), True)
+
+######################################################################
+# simulated users
+######################################################################
+
+class SimulatedUser(object):
+    """A user who answers the system's questions with random answers.
+
+    SimulatedUser(domain, seed) -> new simulated user
+
+    Wh-questions are answered with a random individual of the right sort,
+    and y/n-questions are always answered with yes. (In IBIS-1, a negative
+    answer does not resolve a y/n-question, so the system would repeat it.)
+    """
+
+    def __init__(self, domain, seed=0):
+        self.domain = domain
+        self.random = random.Random(seed)
+
+    def start(self):
+        """The first user utterance."""
+        return 'Ask("%s")' % GOAL
+
+    def respond(self, moves):
+        """Return the answer to the first question in the moves,
+        or None if the system did not ask anything.
+        """
+        for move in moves:
+            if isinstance(move, Ask):
+                return self.answer(move.content)
+        return None
+
+    def answer(self, que):
+        if isinstance(que, WhQ):
+            sort = self.domain.preds1[que.pred.content]
+            return 'Answer("%s")' % self.random.choice(self.domain.sorts[sort])
+        elif isinstance(que, AltQ):
+            return 'Answer("%s")' % self.random.choice(que.ynqs).prop
+        else:
+            return 'Answer("yes")'
+
+######################################################################
+# scaling benchmark
+######################################################################
+
+class ScalingResult(object):
+    """Measurements for one domain size."""
+
+    def __init__(self, size, plan_length):
+        self.size = size
+        self.plan_length = plan_length
+        self.turns = 0
+        self.max_com = 0
+        self.update_time = 0.0
+        self.select_time = 0.0
+
+    def update_per_turn(self):
+        return self.update_time / self.turns if self.turns else 0.0
+
+    def select_per_turn(self):
+        return self.select_time / self.turns if self.turns else 0.0
+
+
+def run_dialogue(dm, user, result, max_turns=1000):
+    """Run one simulated dialogue, adding the timings to 'result'."""
+    channel = dm.CHANNEL
+    dm.reset()
+    dm.IS.private.agenda.push(Greet())
+    dm.system_turn()
+    utterance = user.start()
+    for _ in range(max_turns):
+        if utterance is None:
+            break
+        channel.feed(utterance)
+        dm.input()
+        dm.interpret()
+        t0 = time.time()
+        dm.update()
+        t1 = time.time()
+        dm.select()
+        t2 = time.time()
+        update_time = t1 - t0
+        if dm.NEXT_MOVES:
+            dm.generate()
+            dm.output()
+            t3 = time.time()
+            dm.update()
+            update_time += time.time() - t3
+        result.update_time += update_time
+        result.select_time += t2 - t1
+        result.turns += 1
+        result.max_com = max(result.max_com, len(dm.IS.shared.com))
+        del channel.outputs[:]
+        utterance = user.respond(dm.LATEST_MOVES)
+
+
+def scaling_domain(size, seed=0):
+    """The synthetic domain used by the benchmark for a given size."""
+    return synthetic_domain(preds=size, sorts=max(1, size // 4), inds=size * 4,
+                            plan_length=size, nesting=2, seed=seed)
+
+def benchmark(sizes, dialogues=5, seed=0, compiled=False):
+    """Measure IBIS-1 update and select times for each domain size.
+    If 'compiled' is true, the domains are compiled (see CompiledDomain).
+
+    Returns a list of ScalingResult objects.
+    """
+    results = []
+    previous = set_tracer(None)
+    try:
+        for size in sizes:
+            domain = scaling_domain(size, seed)
+            if compiled:
+                domain = domain.compiled()
+            dm = headless(IBIS1)(domain, SyntheticDB(), Grammar(), QueueChannel())
+            result = ScalingResult(size, size)
+            for nr in range(dialogues):
+                run_dialogue(dm, SimulatedUser(domain, seed + nr), result)
+            results.append(result)
+    finally:
+        set_tracer(previous)
+    return results
+
+def growth_exponents(results, key):
+    """Estimate the exponent k in time ~ size**k between successive sizes."""
+    exponents = [None]
+    for r1, r2 in zip(results, results[1:]):
+        t1, t2 = key(r1), key(r2)
+        if t1 > 0 and t2 > 0 and r2.size != r1.size:
+            exponents.append(math.log(t2 / t1) / math.log(float(r2.size) / r1.size))
+        else:
+            exponents.append(None)
+    return exponents
+
+def report(results, max_exponent=None, out=None):
+    """Print a table of the results. Returns False if any growth exponent
+    for the update time per turn is larger than max_exponent.
+    """
+    out = out or sys.stdout
+    ok = True
+    exponents = growth_exponents(results, ScalingResult.update_per_turn)
+    print >>out, "%6s %6s %6s %6s %12s %12s %6s" % (
+        "size", "plan", "turns", "com", "update(us)", "select(us)", "k")
+    for result, k in zip(results, exponents):
+        flag = ""
+        if k is not None and max_exponent is not None and k > max_exponent:
+            flag = " !"
+            ok = False
+        print >>out, "%6d %6d %6d %6d %12.1f %12.1f %6s%s" % (
+            result.size, result.plan_length, result.turns, result.max_com,
+            result.update_per_turn() * 1e6, result.select_per_turn() * 1e6,
+            "-" if k is None else "%.2f" % k, flag)
+    return ok
+
+def main(args):
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--sizes", default="10,20,40,80",
+                      help="comma-separated domain sizes [%default]")
+    parser.add_option("--dialogues", type="int", default=5,
+                      help="simulated dialogues per size [%default]")
+    parser.add_option("--seed", type="int", default=0,
+                      help="random seed [%default]")
+    parser.add_option("--max-exponent", type="float", default=None,
+                      help="fail if the update time per turn grows faster "
+                      "than size**K between two sizes")
+    parser.add_option("--compiled", action="store_true",
+                      help="use compiled domains (see CompiledDomain)")
+    options, _ = parser.parse_args(args)
+    sizes = [int(size) for size in options.sizes.split(",")]
+    results = benchmark(sizes, options.dialogues, options.seed, options.compiled)
+    return 0 if report(results, options.max_exponent) else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -8,8 +8,24 @@
 #
 
 from ibis import *
+from ibis_synth import *
+from ibis_replay import headless
+from rule_trace import flatten_state
 import unittest
 
+@update_rule
+def get_answered_moves(IS, LATEST_MOVES, LATEST_SPEAKER):
+    """Grounding which fails unless there is an Answer move."""
+    @precondition
+    def V():
+        if any(isinstance(move, Answer) for move in LATEST_MOVES):
+            yield LATEST_MOVES
+    IS.shared.lu.moves = LATEST_MOVES
+    IS.shared.lu.speaker = LATEST_SPEAKER.get()
+
+class AnswerOnlyIBIS1(IBIS1):
+    grounding = rule_group(get_answered_moves)
+
 class IbisTests(unittest.TestCase):
     preds0 = 'return'
 
@@ -24,6 +40,12 @@ class IbisTests(unittest.TestCase):
 
     domain = Domain(preds0, preds1, sorts)
 
+    def setUp(self):
+        self.previous_tracer = set_tracer(None)
+
+    def tearDown(self):
+        set_tracer(self.previous_tracer)
+
 
     def test_relevant(self):
         # Y/N questions
@@ -119,5 +141,291 @@ class IbisTests(unittest.TestCase):
         res = Prop("dest_city(paris)")
         self.assertEqual(self.domain.combine(que, ans.content), res)
 
+    def test_compiled_domain(self):
+        compiled = self.domain.compiled()
+        answers = ["yes", "no", "paris", "-paris", "five", "dest_city(paris)",
+                   "-dest_city(london)", "price(123)", "return()", "-return()"]
+        questions = ["?return()", "?x.dest_city(x)", "?x.price(x)",
+                     "?dest_city(paris)"]
+        questions = map(Question, questions)
+        questions.append(AltQ("?dest_city(paris)", "?dest_city(london)"))
+        for que in questions:
+            if compiled.code(que) is not None:
+                self.assertEqual(compiled.term(compiled.code(que)), que)
+            for ans in [Answer(a).content for a in answers]:
+                if compiled.code(ans) is not None:
+                    self.assertEqual(compiled.term(compiled.code(ans)), ans)
+                self.assertEqual(compiled.relevant(ans, que),
+                                 bool(self.domain.relevant(ans, que)))
+                self.assertEqual(compiled.resolves(ans, que),
+                                 bool(self.domain.resolves(ans, que)))
+                if compiled.relevant(ans, que):
+                    self.assertEqual(compiled.combine(que, ans),
+                                     self.domain.combine(que, ans))
+
+        self.assertEqual(compiled.code(Answer("-paris").content)[0], CODE_SHORTANS)
+        sizes = dict((kind, compiled.symbols.size(kind)) for kind in ('pred', 'ind'))
+        for ans in ["five", "dest_city(rome)", "-rome", "visit(paris)"]:
+            ans = Answer(ans).content
+            self.assertEqual(compiled.code(ans), None)
+            for que in questions + [Question("?dest_city(rome)")]:
+                self.assertEqual(compiled.relevant(ans, que),
+                                 bool(self.domain.relevant(ans, que)))
+                self.assertEqual(compiled.resolves(ans, que),
+                                 bool(self.domain.resolves(ans, que)))
+        self.assertEqual(sizes, dict((kind, compiled.symbols.size(kind))
+                                     for kind in ('pred', 'ind')))
+        other = Domain(self.preds0, {'dest_city': 'city'}, {'city': ['rome']}).compiled()
+        self.assertTrue(other.symbols is not compiled.symbols)
+        self.assertEqual(other.relevant(ShortAns("rome"), WhQ("?x.dest_city(x)")), True)
+        self.assertEqual(compiled.relevant(ShortAns("rome"), WhQ("?x.dest_city(x)")), False)
+
+    def test_relevant_matrix(self):
+        import ibis
+        compiled = self.domain.compiled()
+        answers = [Answer(a).content for a in 
+                   ["yes", "no", "paris", "-paris", "five", "plane", 
+                    "dest_city(paris)", "-dest_city(london)", "price(123)"]] * 12
+        questions = map(Question, ["?return()", "?x.dest_city(x)", "?x.means(x)",
+                                   "?dest_city(paris)", "?x.price(x)"])
+        questions.append(AltQ("?dest_city(paris)", "?dest_city(london)"))
+        expected = [[bool(self.domain.relevant(ans, que)) for que in questions]
+                    for ans in answers]
+        self.assertEqual(self.domain.relevant_matrix(answers, questions), expected)
+        for j, que in enumerate(questions):
+            self.assertEqual(list(self.domain.relevant_answers(iter(answers), que)),
+                             [ans for ans, row in zip(answers, expected) if row[j]])
+        numpy = ibis._import_numpy()
+        try:
+            for ibis._numpy in set([numpy, None]):
+                matrix = compiled.relevant_matrix(answers, questions)
+                self.assertEqual([list(row) for row in matrix], expected)
+                que = questions[1]
+                self.assertEqual(list(compiled.relevant_answers(iter(answers), que)),
+                                 [ans for ans in answers if self.domain.relevant(ans, que)])
+        finally:
+            ibis._numpy = numpy
+        self.assertEqual(len(compiled.relevant_matrix([], questions)), 0)
+
+    def test_resolved_questions(self):
+        domain = Domain(self.preds0, self.preds1, self.sorts)
+        plan = [Findout("?x.dest_city(x)"),
+                If("?dest_city(paris)", [Raise("?x.price(x)")]),
+                Findout(AltQ("?dest_city(paris)", "?dest_city(london)")),
+                Findout("?dest_city(berlin)")]
+        domain.add_plan("?x.price(x)", plan)
+        self.assertEqual(len(domain.plan_questions), 4)
+        questions = list(domain.plan_questions) + [Question("?x.means(x)")]
+        for props in [[], ["dest_city(paris)"], ["-dest_city(berlin)", "price(123)"],
+                      ["dest_city(berlin)", "-dest_city(london)", "means(plane)"]]:
+            props = map(Prop, props)
+            self.assertEqual(domain.resolved_questions(props, questions),
+                             set(que for que in questions 
+                                 if any(domain.resolves(prop, que) for prop in props)))
+
+        dm = headless(IBIS1)(domain, Database(), Grammar(), QueueChannel())
+        dm.reset()
+        dm.IS.private.plan = domain.get_plan(Question("?x.price(x)"))
+        dm.IS.shared.com.update([Prop("dest_city(paris)"), Prop("price(123)")])
+        remove_resolved(dm)
+        self.assertEqual(len(dm.IS.private.plan), 3)
+        self.assertTrue(isinstance(dm.IS.private.plan.top(), If))
+
+    def test_batch_grounding_failure(self):
+        domain = Domain([], self.preds1, self.sorts)
+        domain.add_plan("?x.price(x)", [Findout("?x.dest_city(x)")])
+        def session(moves):
+            dm = headless(AnswerOnlyIBIS1)(domain, Database(), Grammar(), QueueChannel())
+            dm.reset()
+            dm.IS.shared.qud.push(Question("?x.dest_city(x)"))
+            dm.IS.private.agenda.push(Greet())
+            dm.LATEST_MOVES.update(moves)
+            dm.LATEST_SPEAKER.set(Speaker.USR)
+            return dm
+        moves = [[Answer("paris")], [Ask("?x.price(x)")], [Answer("london")]]
+        batch = [session(m) for m in moves]
+        self.assertEqual(AnswerOnlyIBIS1.batch_update(batch), [batch[1]])
+        for dm, m in zip(batch, moves):
+            single = session(m)
+            try:
+                single.update()
+            except PreconditionFailure:
+                self.assertTrue(dm is batch[1])
+            self.assertEqual(flatten_state(dm), flatten_state(single))
+        self.assertEqual(list(batch[1].IS.shared.qud), [Question("?x.dest_city(x)")])
+        self.assertEqual(len(batch[1].IS.shared.com), 0)
+        self.assertEqual(batch[2].IS.shared.com, set([Prop("dest_city(london)")]))
+
+    def test_plain_set_moves(self):
+        class PlainMovesIBIS1(IBIS1):
+            def init_MIVS(self):
+                IBIS1.init_MIVS(self)
+                self.LATEST_MOVES = set()
+        domain = Domain([], self.preds1, self.sorts)
+        domain.add_plan("?x.price(x)", [Findout("?x.dest_city(x)")])
+        dm = headless(PlainMovesIBIS1)(domain, Database(), Grammar(), QueueChannel())
+        dm.reset()
+        dm.LATEST_MOVES.add(Ask("?x.price(x)"))
+        dm.LATEST_SPEAKER.set(Speaker.USR)
+        dm.update()
+        self.assertTrue(dm.IS.shared.lu.moves is dm.LATEST_MOVES)
+        self.assertEqual(list(dm.IS.shared.qud), [Question("?x.price(x)")])
+        self.assertEqual(list(dm.IS.private.plan), [Findout("?x.dest_city(x)")])
+
+    def test_belief_view(self):
+        dm = headless(IBIS1)(self.domain, Database(), Grammar(), QueueChannel())
+        dm.reset()
+        view = dm.BELIEFS
+        dm.IS.private.bel.update([Prop("price(123)"), Prop("dest_city(paris)")])
+        dm.IS.shared.com.add(Prop("dest_city(paris)"))
+        self.assertTrue(Prop("price(123)") in view)
+        self.assertFalse(Prop("dest_city(london)") in view)
+        self.assertEqual(len(view), 2)
+        self.assertEqual(sorted(view), sorted(dm.IS.private.bel | dm.IS.shared.com))
+        self.assertEqual(list(view.unshared()), [Prop("price(123)")])
+        self.assertTrue(dm.BELIEFS is view)
+        dm.reset()
+        self.assertFalse(dm.BELIEFS is view)
+        self.assertEqual(len(dm.BELIEFS), 0)
+
+        dm.IS.shared.com.add(Prop("dest_city(paris)"))
+        dm.IS.private.plan.push(If("?dest_city(paris)", [Raise("?x.price(x)")], 
+                                   [Findout("?x.dest_city(x)")]))
+        execute_if(dm)
+        self.assertEqual(dm.IS.private.plan.top(), Raise("?x.price(x)"))
+
+    def test_generate(self):
+        grammar = SimpleGenGrammar()
+        grammar.addForm("Ask('?x.dest_city(x)')", "Where do you want to go?")
+        grammar.addForm("Answer('price({X})')", "The price is {X}")
+
+        move = Ask("?x.dest_city(x)")
+        self.assertEqual(grammar.generateMove(move), "Where do you want to go?")
+
+        move = Answer("price(232)")
+        self.assertEqual(grammar.generateMove(move), "The price is 232")
+
+        # the polarity is ignored, as in travel
+        move = Answer("-price(232)")
+        self.assertEqual(grammar.generateMove(move), "The price is 232")
+        import travel
+        self.assertEqual(travel.grammar.generateMove(move), "The price is 232")
+
+        # only variables in braces make templates, other braces are literal
+        grammar.addForm("Answer('dest_city(Paris)')", "{Paris}")
+        grammar.addForm("Answer('means({M})')", "By {M} {or not}")
+        self.assertEqual(grammar.generateMove(Answer("dest_city(Paris)")), "{Paris}")
+        move = Answer("dest_city(Rome)")
+        self.assertEqual(grammar.generateMove(move), str(move))
+        self.assertEqual(grammar.generateMove(Answer("means(train)")), "By train {or not}")
+        self.assertRaises(ParseError, grammar.addForm, "Ask('?x.{X}(x)')", "")
+
+        # move strings are parsed, not evaluated
+        grammar.addForm("Answer(Prop('price(1)'))", "Not a move")
+        self.assertEqual(grammar.generateMove(Answer("price(1)")), "The price is 1")
+        self.assertEqual(grammar.strforms["Answer(Prop('price(1)'))"], "Not a move")
+
+        move = ICM("per", "pos", "paris")
+        self.assertEqual(grammar.generateMove(move), "I heard you say paris")
+
+        class QuotedICM(ICM):
+            pass
+        move = QuotedICM("per", "pos", "london")
+        self.assertEqual(grammar.generateMove(move), "I heard you say london")
+
+        moves = [Greet(), ICM("neg", "sem")]
+        self.assertEqual(grammar.generate(moves), "Hello. I don't understand.")
+
+        grammar.CACHE_SIZE = 3
+        for price in range(10):
+            grammar.generateMove(Answer("price(%d)" % price))
+            self.assertTrue(len(grammar.cache) <= 3)
+        self.assertEqual(grammar.generateMove(Answer("price(9)")), "The price is 9")
+
+    def test_nbest_interpretation(self):
+        class NBestGrammar(Grammar):
+            def interpret_nbest(self, input):
+                for score, ans in enumerate(input.split()):
+                    self.evaluated.append(ans)
+                    yield -score, Answer(ans)
+        grammar = NBestGrammar()
+        domain = Domain(self.preds0, self.preds1, self.sorts)
+        domain.add_plan("?x.dest_city(x)", [Findout("?x.dest_city(x)")])
+        dm = headless(IBIS1)(domain, Database(), grammar, QueueChannel())
+        dm.reset()
+        dm.LATEST_SPEAKER.set(Speaker.USR)
+        for input, evaluated, prop in [("five -berlin london", ["five", "-berlin"],
+                                        "-dest_city(berlin)"),
+                                       ("paris five", ["paris"], "dest_city(paris)")]:
+            dm.IS.shared.qud.push(Question("?x.dest_city(x)"))
+            grammar.evaluated = []
+            dm.INPUT.set(input)
+            dm.interpret()
+            self.assertEqual(grammar.evaluated, evaluated[:1])
+            dm.update()
+            self.assertEqual(grammar.evaluated, evaluated)
+            self.assertTrue(Prop(prop) in dm.IS.shared.com)
+
+        class OverridingGrammar(NBestGrammar):
+            def interpret(self, input):
+                return Answer("paris")
+        self.assertEqual(nbest_interpreter(grammar), grammar.interpret_nbest)
+        self.assertEqual(nbest_interpreter(Grammar()), None)
+        dm.GRAMMAR = OverridingGrammar()
+        self.assertEqual(nbest_interpreter(dm.GRAMMAR), None)
+        dm.INPUT.set("london")
+        dm.interpret()
+        self.assertEqual(list(dm.LATEST_MOVES), [Answer("paris")])
+
+    def test_streaming_output(self):
+        class CountingGrammar(SimpleGenGrammar):
+            def generateMove(self, move):
+                self.generated.append(move)
+                return SimpleGenGrammar.generateMove(self, move)
+        grammar = CountingGrammar()
+        grammar.addForm("Ask('?x.dest_city(x)')", "Where do you want to go?")
+        grammar.generated = []
+        domain = Domain(self.preds0, self.preds1, self.sorts)
+        domain.add_plan("?x.price(x)", [Findout("?x.dest_city(x)")])
+        channel = QueueChannel()
+        dm = headless(StreamingIBIS1)(domain, Database(), grammar, channel)
+        phrases = []
+        dm.OUTPUT_SINK = phrases.append
+        dm.reset()
+        dm.IS.private.agenda.push(Greet())
+        dm.system_turn()
+        self.assertEqual(phrases, ["Hello.", None])
+        self.assertEqual(dm.OUTPUT.get(), "Hello.")
+        self.assertEqual(grammar.generated, [Greet()])
+        del phrases[:]
+        channel.feed('Ask("?x.price(x)")')
+        dm.input()
+        dm.user_turn()
+        dm.system_turn()
+        self.assertEqual(phrases, ["Where do you want to go?", None])
+        self.assertEqual(dm.OUTPUT.get(), "Where do you want to go?")
+        self.assertEqual(len(grammar.generated), 2)
+        self.assertEqual(channel.outputs, [])
+        del phrases[:]
+        dm.generate()
+        dm.output()
+        self.assertEqual(phrases, ["[---]", None])
+
+    def test_synthetic_dialogue(self):
+        domain = synthetic_domain(preds=12, sorts=3, inds=12, plan_length=12,
+                                  nesting=2, seed=1)
+        self.assertEqual(len(domain.preds1), 13)
+        self.assertEqual(len(domain.inds), 12)
+        def depth(plan):
+            return max([1 + depth(m.iftrue + m.iffalse) for m in plan
+                        if isinstance(m, If)] or [0])
+        plan = domain.plans[Question(GOAL)]
+        self.assertEqual(depth(plan), 2)
+        self.assertEqual(len([m for m in plan if isinstance(m, Findout)
+                              and isinstance(m.content, WhQ)]), 3)
+        results = benchmark([12], dialogues=2, seed=1)
+        self.assertTrue(results[0].turns > 0)
+        self.assertTrue(results[0].max_com > 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -19,12 +19,31 @@
 # and the GNU Lesser General Public License along with this program.  
 # If not, see <http://www.gnu.org/licenses/>.
 
+import re
+
 from trindikit import *
 
 ######################################################################
 # IBIS semantic types
 ######################################################################
 
+class TypeCheckError(TypeError, AssertionError):
+    """Raised when a semantic term is created from arguments of the wrong
+    types, or does not typecheck in a domain. 
+    
+    It is also an AssertionError, which is what these checks used to 
+    raise, so existing callers keep working.
+    """
+    pass
+
+def _require(condition, message, *args):
+    """Raise a TypeCheckError if the condition is false, and typechecking
+    is on (see trindikit.set_typechecking). Unlike an assert statement, 
+    this does not depend on python -O.
+    """
+    if not condition and typechecking():
+        raise TypeCheckError(message % args)
+
 # Atomic types: individuals, predicates, sorts
 
 class Atomic(Type):
@@ -39,58 +58,61 @@ class Atomic(Type):
     contentclass = basestring
     
     def __init__(self, atom):
-        assert isinstance(atom, (basestring, int))
-        assert atom not in ("", "yes", "no")
-        try:
-            atom = int(atom)
-        except ValueError:
-            assert atom[0].isalpha()
-            assert all(ch.isalnum() or ch in "_-+:" for ch in atom)
+        if isinstance(atom, basestring):
+            atom = _atom_content(atom)
+        elif not isinstance(atom, (int, long)):
+            raise ParseError("%r must be a string or an integer" % (atom,))
         self.content = atom
     
+    @classmethod
+    def from_string(cls, atom):
+        return _make(cls, _atom_content(atom))
+    
     def __str__(self):
         return "%s" % self.content
 
 class Ind(Atomic): 
     """Individuals."""
     def _typecheck(self, context):
-        assert self.content in context.inds
+        _require(self.content in context.inds, "%s is not an individual in the domain", self)
 
 class Pred0(Atomic): 
     """0-place predicates."""
     def _typecheck(self, context):
-        assert self.content in context.preds0
+        _require(self.content in context.preds0, "%s is not a 0-place predicate in the domain", self)
 
 class Pred1(Atomic): 
     """1-place predicates."""
     def apply(self, ind):
         """Apply the predicate to an individual, returning a proposition."""
-        assert isinstance(ind, Ind), "%s must be an individual" % ind
+        _require(isinstance(ind, Ind), "%s must be an individual", ind)
         return Prop(self, ind)
 
     def _typecheck(self, context):
-        assert self.content in context.preds1
+        _require(self.content in context.preds1, "%s is not a 1-place predicate in the domain", self)
 
 class Sort(Pred1): 
     """Sort."""
     def _typecheck(self, context):
-        assert self.content in context.sorts
+        _require(self.content in context.sorts, "%s is not a sort in the domain", self)
 
 
 # Sentences: answers, questions
 
 class Sentence(Type): 
-    """Superclass for answers and questions."""
-    def __new__(cls, sent, *args, **kw):
-        if cls is Sentence:
-            assert isinstance(sent, basestring)
-            assert not args and not kw
-            if sent.startswith('?'):
-                return Question(sent)
-            else:
-                return Ans(sent)
-        else:
-            return Type.__new__(cls, sent, *args, **kw)
+    """Superclass for answers and questions.
+    
+    Sentence("?...") -> Question("?..."), and otherwise Sentence("...") -> Ans("...")
+    """
+    def __new__(cls, *args, **kw):
+        if cls is Sentence or cls is Ans or cls is Question:
+            raise ParseError("The abstract class %s can only be created from a string, "
+                             "not from %r" % (cls.__name__, args))
+        return Type.__new__(cls, *args, **kw)
+
+    @classmethod
+    def from_string(cls, sent):
+        return parse_term(sent, _parse_sentence)
 
 
 # Answer types: propositions, short answers, y/n-answers
@@ -112,45 +134,26 @@ class Ans(Sentence):
       - Ans("ind") -> ShortAns("...")
       - Ans("yes"), Ans("no") -> YesNo("...")
     """
-    def __new__(cls, ans, *args, **kw):
-        if cls is Ans:
-            assert isinstance(ans, basestring)
-            assert not args and not kw
-            if ans in ('yes', 'no'):
-                return YesNo(ans)
-            elif '(' not in ans and ')' not in ans:
-                return ShortAns(ans)
-            elif '(' in ans and ans.endswith(')'):
-                return Prop(ans)
-            else:
-                raise SyntaxError("Could not parse answer: %s" % ans)
-        else:
-            return Sentence.__new__(cls, ans, *args, **kw)
+    @classmethod
+    def from_string(cls, ans):
+        return parse_term(ans, _parse_ans)
 
 class Prop(Ans): 
     """Proposition."""
     def __init__(self, pred, ind=None, yes=True):
-        assert (isinstance(pred, (Pred0, basestring)) and ind is None or
-                isinstance(pred, Pred1) and isinstance(ind, Ind)), \
-                ("%s must be a predicate, and %s must be None or an individual" % 
-                 (pred, ind))
-        assert isinstance(yes, bool), "%s must be a bool" % yes
-        if isinstance(pred, basestring):
-            assert '(' in pred and pred.endswith(')'), \
-                "'%s' must be of the form '[-] pred ( [ind] )'" % pred
-            pred = pred[:-1]
-            if pred.startswith('-'):
-                yes = not yes
-                pred = pred[1:]
-            pred, _, ind = pred.partition('(')
-            if ind:
-                pred = Pred1(pred)
-                ind = Ind(ind)
-            else:
-                pred = Pred0(pred)
-                ind = None
+        if isinstance(pred, basestring) and ind is None:
+            pred, ind, yes2 = parse_term(pred, _parse_prop).content
+            yes = yes == yes2
+        _require(isinstance(pred, Pred0) and ind is None or
+                 isinstance(pred, Pred1) and isinstance(ind, Ind),
+                 "%s must be a predicate, and %s must be None or an individual", pred, ind)
+        _require(isinstance(yes, bool), "%s must be a bool", yes)
         self.content = pred, ind, yes
     
+    @classmethod
+    def from_string(cls, prop):
+        return parse_term(prop, _parse_prop, cls)
+    
     @property
     def pred(self): return self.content[0]
     @property
@@ -160,7 +163,7 @@ class Prop(Ans):
     
     def __neg__(self):
         pred, ind, yes = self.content
-        return Prop(self.pred, self.ind, not self.yes)
+        return type(self)(self.pred, self.ind, not self.yes)
     
     def __str__(self):
         pred, ind, yes = self.content
@@ -168,28 +171,32 @@ class Prop(Ans):
     
     def _typecheck(self, context):
         pred, ind, yes = self.content
-        assert (isinstance(pred, Pred0) and ind is None or
-                isinstance(pred, Pred1) and isinstance(ind, Ind))
-        assert isinstance(yes, bool)
+        _require(isinstance(pred, Pred0) and ind is None or
+                 isinstance(pred, Pred1) and isinstance(ind, Ind),
+                 "%s must be a predicate, and %s must be None or an individual", pred, ind)
+        _require(isinstance(yes, bool), "%s must be a bool", yes)
         pred._typecheck(context)
         if ind is not None: 
             ind._typecheck(context)
-            assert context.preds1[pred.content] == context.inds[ind.content]
+            _require(context.preds1.get(pred.content) == context.inds.get(ind.content),
+                     "%s and %s are not of the same sort", pred, ind)
 
 class ShortAns(Ans): 
     """Short answer."""
     contentclass = Ind
     
     def __init__(self, ind, yes=True):
-        assert isinstance(yes, bool), "%s must be a boolean" % yes
-        assert isinstance(ind, (Ind, basestring)), "%s must be an individual" % ind
+        _require(isinstance(yes, bool), "%s must be a boolean", yes)
         if isinstance(ind, basestring):
-            if ind.startswith('-'):
-                ind = ind[1:]
-                yes = not yes
-            ind = Ind(ind)
+            ind, yes2 = parse_term(ind, _parse_shortans).content
+            yes = yes == yes2
+        _require(isinstance(ind, Ind), "%s must be an individual", ind)
         self.content = ind, yes
 
+    @classmethod
+    def from_string(cls, ans):
+        return parse_term(ans, _parse_shortans, cls)
+
     @property
     def ind(self): return self.content[0]
     @property
@@ -197,7 +204,7 @@ class ShortAns(Ans):
 
     def __neg__(self):
         ind, yes = self.content
-        return ShortAns(ind, not yes)
+        return type(self)(ind, not yes)
 
     def __str__(self):
         ind, yes = self.content
@@ -205,8 +212,8 @@ class ShortAns(Ans):
 
     def _typecheck(self, context):
         ind, yes = self.content
-        assert isinstance(ind, Ind)
-        assert isinstance(yes, bool)
+        _require(isinstance(ind, Ind), "%s must be an individual", ind)
+        _require(isinstance(yes, bool), "%s must be a boolean", yes)
         ind._typecheck(context)
 
 class YesNo(ShortAns):
@@ -214,17 +221,20 @@ class YesNo(ShortAns):
     contentclass = bool
     
     def __init__(self, yes):
-        assert isinstance(yes, (bool, basestring)), "%s must be a boolean" % yes
         if isinstance(yes, basestring):
-            assert yes in ("yes", "no"), "'%s' must be 'yes' or 'no'" % yes
-            yes = yes == "yes"
+            yes = parse_term(yes, _parse_yesno).content
+        _require(isinstance(yes, bool), "%s must be a boolean", yes)
         self.content = yes
 
+    @classmethod
+    def from_string(cls, yes):
+        return parse_term(yes, _parse_yesno, cls)
+
     @property
     def yes(self): return self.content
 
     def __neg__(self):
-        return YesNo(not self.content)
+        return type(self)(not self.content)
 
     def __str__(self):
         return "yes" if self.content else "no"
@@ -246,36 +256,30 @@ class Question(Sentence):
       - Question("?x.pred(x)") -> WhQ("pred")
       - Question("?prop") -> YNQ("prop")
     """
-    def __new__(cls, que, *args, **kw):
+    @classmethod
+    def from_string(cls, que):
         """Parse a string into a Question.
     
         "?x.pred(x)" -> WhQ("pred")
         "?prop" -> YNQ("prop")
         """
-        if cls is Question:
-            assert isinstance(que, basestring)
-            assert not args and not kw
-            if que.startswith('?x.') and que.endswith('(x)'):
-                return WhQ(que[3:-3])
-            elif que.startswith('?'):
-                return YNQ(que[1:])
-            else:
-                raise SyntaxError("Could not parse question: %s" % que)
-        else:
-            return Sentence.__new__(cls, que, *args, **kw)
+        return parse_term(que, _parse_question)
 
 class WhQ(Question): 
     """Wh-question."""
     contentclass = Pred1
     
     def __init__(self, pred):
-        assert isinstance(pred, (Pred1, basestring))
         if isinstance(pred, basestring):
-            if pred.startswith('?x.') and pred.endswith('(x)'):
-                pred = pred[3:-3]
-            pred = Pred1(pred)
+            pred = parse_term(pred, _parse_whq).content
+        _require(isinstance(pred, Pred1), "%s must be a 1-place predicate", pred)
         self.content = pred
     
+    @classmethod
+    def from_string(cls, que):
+        """WhQ("?x.pred(x)") and WhQ("pred") -> the wh-question."""
+        return parse_term(que, _parse_whq, cls)
+    
     @property
     def pred(self): return self.content
     
@@ -287,13 +291,16 @@ class YNQ(Question):
     contentclass = Prop
     
     def __init__(self, prop):
-        assert isinstance(prop, (Prop, basestring))
         if isinstance(prop, basestring):
-            if prop.startswith('?'):
-                prop = prop[1:]
-            prop = Prop(prop)
+            prop = parse_term(prop, _parse_ynq).content
+        _require(isinstance(prop, Prop), "%s must be a proposition", prop)
         self.content = prop
     
+    @classmethod
+    def from_string(cls, que):
+        """YNQ("?prop") and YNQ("prop") -> the y/n-question."""
+        return parse_term(que, _parse_ynq, cls)
+    
     @property
     def prop(self): return self.content
     
@@ -317,10 +324,173 @@ class AltQ(Question):
         return "{" + " | ".join(map(str, self.content)) + "}"
 
     def _typecheck(self, context):
-        assert all(isinstance(q, YNQ) for q in self.content)
+        _require(all(isinstance(q, YNQ) for q in self.content),
+                 "all AltQ arguments must be y/n-questions")
         for q in self.content:
             q._typecheck(context)
 
+######################################################################
+# parsing semantic terms
+######################################################################
+
+# The syntax of the semantic terms is:
+#
+#   sentence = "?" question | answer
+#   question = "x" "." IDENT "(" "x" ")" | prop
+#   answer   = "yes" | "no" | prop | ["-"] atom
+#   prop     = ["-"] IDENT "(" [atom] ")"
+#   atom     = IDENT | ["-"] INTEGER
+#
+# where an IDENT starts with a letter, followed by letters, digits, 
+# and the characters "_-+:". The terms cannot contain whitespace.
+# Objects created from strings are cached, see TypeMeta in trindikit.
+
+class ParseError(SyntaxError, AssertionError):
+    """Raised when a string cannot be parsed into a semantic term.
+    
+    For backwards compatibility, this is also an AssertionError.
+    """
+    pass
+
+_TOKEN = re.compile(r"[A-Za-z][A-Za-z0-9_\-+:]*|[0-9]+|.", re.DOTALL)
+
+def _make(cls, content):
+    """Create an object without calling the constructor."""
+    obj = object.__new__(cls)
+    obj.content = content
+    return obj
+
+def parse_term(string, parser, cls=None):
+    """Parse the complete string with a parser function. 
+    
+    A parser function takes a list of tokens and a position, and 
+    returns the parsed object and the next position, or raises a
+    ParseError. If cls is given, it is passed on as a third argument,
+    and the parser creates an object of that class (a subclass of the 
+    class it parses) instead, see the from_string methods.
+    """
+    tokens = _TOKEN.findall(string)
+    try:
+        if cls is None:
+            result, pos = parser(tokens, 0)
+        else:
+            result, pos = parser(tokens, 0, cls)
+        if pos == len(tokens):
+            return result
+        problem = "unexpected %r" % tokens[pos]
+    except IndexError:
+        problem = "unexpected end"
+    except ParseError, err:
+        problem = str(err)
+    raise ParseError("Could not parse %s: %s (%s)" % (parser.__doc__, string, problem))
+
+def _atom_content(atom):
+    """Parse an atom. As for the original constructors, a string which
+    int() accepts (such as " 12" or "+5") is an integer."""
+    try:
+        return int(atom)
+    except ValueError:
+        return parse_term(atom, _parse_atom)
+
+def _expect(tokens, pos, token):
+    if tokens[pos] != token:
+        raise ParseError("expected %r, found %r" % (token, tokens[pos]))
+    return pos + 1
+
+def _parse_atom(tokens, pos):
+    """atom"""
+    token = tokens[pos]
+    if token in ("-", "+"):
+        sign = -1 if token == "-" else 1
+        pos += 1
+        token = tokens[pos]
+        if not token.isdigit():
+            raise ParseError("expected an integer, found %r" % token)
+        return sign * int(token), pos + 1
+    elif token.isdigit():
+        return int(token), pos + 1
+    elif token[0].isalpha() and token not in ("yes", "no"):
+        return token, pos + 1
+    raise ParseError("expected an atom, found %r" % token)
+
+def _parse_ident(tokens, pos):
+    token = tokens[pos]
+    if token[0].isalpha():
+        return token, pos + 1
+    raise ParseError("expected an identifier, found %r" % token)
+
+def _parse_prop(tokens, pos, cls=Prop):
+    """proposition"""
+    yes = True
+    if tokens[pos] == "-":
+        yes = False
+        pos += 1
+    pred, pos = _parse_ident(tokens, pos)
+    pos = _expect(tokens, pos, "(")
+    if tokens[pos] == ")":
+        return _make(cls, (_make(Pred0, pred), None, yes)), pos + 1
+    ind, pos = _parse_atom(tokens, pos)
+    pos = _expect(tokens, pos, ")")
+    return _make(cls, (_make(Pred1, pred), _make(Ind, ind), yes)), pos
+
+def _parse_shortans(tokens, pos, cls=ShortAns):
+    """short answer"""
+    yes = True
+    if tokens[pos] == "-":
+        yes = False
+        pos += 1
+    ind, pos = _parse_atom(tokens, pos)
+    return _make(cls, (_make(Ind, ind), yes)), pos
+
+def _parse_yesno(tokens, pos, cls=YesNo):
+    """y/n-answer"""
+    token = tokens[pos]
+    if token not in ("yes", "no"):
+        raise ParseError("expected 'yes' or 'no', found %r" % token)
+    return _make(cls, token == "yes"), pos + 1
+
+def _parse_ans(tokens, pos):
+    """answer"""
+    if tokens[pos] in ("yes", "no"):
+        return _parse_yesno(tokens, pos)
+    elif "(" in tokens:
+        return _parse_prop(tokens, pos)
+    else:
+        return _parse_shortans(tokens, pos)
+
+def _parse_whq(tokens, pos, cls=WhQ):
+    """wh-question"""
+    if tokens[pos] == "?":
+        for token in ("?", "x", "."):
+            pos = _expect(tokens, pos, token)
+        pred, pos = _parse_ident(tokens, pos)
+        for token in ("(", "x", ")"):
+            pos = _expect(tokens, pos, token)
+    else:
+        pred, pos = _parse_ident(tokens, pos)
+    return _make(cls, _make(Pred1, pred)), pos
+
+def _parse_ynq(tokens, pos, cls=YNQ):
+    """y/n-question"""
+    if tokens[pos] == "?":
+        pos += 1
+    prop, pos = _parse_prop(tokens, pos)
+    return _make(cls, prop), pos
+
+def _parse_question(tokens, pos):
+    """question"""
+    if tokens[pos] != "?":
+        raise ParseError("expected '?', found %r" % tokens[pos])
+    if tokens[pos+1:pos+3] == ["x", "."]:
+        return _parse_whq(tokens, pos)
+    return _parse_ynq(tokens, pos)
+
+def _parse_sentence(tokens, pos):
+    """sentence"""
+    if tokens[pos] == "?":
+        return _parse_question(tokens, pos)
+    return _parse_ans(tokens, pos)
+
 ######################################################################
 # IBIS dialogue moves
 ######################################################################
@@ -357,6 +527,32 @@ class ICM(Move):
     @property
     def icm_content(self): return self.content[2]
 
+# Moves are written as by their constructors, with the content quoted:
+# "Greet()", "Quit()", "Ask('?x.price(x)')" and "Answer('price(123)')".
+
+_MOVE = re.compile(r"""([A-Za-z]+)\((?:'([^']*)'|"([^"]*)")?\)$""")
+
+_MOVE_CLASSES = {'Greet': Greet, 'Quit': Quit, 'Ask': Ask, 'Answer': Answer}
+
+def parse_move(string):
+    """Parse a move, such as "Ask('?x.price(x)')". The content is 
+    parsed as a semantic term, and nothing is evaluated.
+    """
+    match = _MOVE.match(string.strip())
+    if not match or match.group(1) not in _MOVE_CLASSES:
+        raise ParseError("Could not parse move: %s" % string)
+    cls = _MOVE_CLASSES[match.group(1)]
+    content = match.group(2)
+    if content is None:
+        content = match.group(3)
+    if issubclass(cls, SingletonMove):
+        if content is not None:
+            raise ParseError("%s takes no content: %s" % (cls.__name__, string))
+        return cls()
+    if content is None:
+        raise ParseError("%s needs a content: %s" % (cls.__name__, string))
+    return cls(content)
+
 ######################################################################
 # IBIS plan constructors
 ######################################################################
@@ -407,9 +603,9 @@ class If(PlanConstructor):
         return (self.cond, self.iftrue, self.iffalse)
 
     def _typecheck(self, context):
-        assert isinstance(self.cond, Question)
-        assert all(isinstance(m, PlanConstructor) for m in self.iftrue)
-        assert all(isinstance(m, PlanConstructor) for m in self.iffalse)
+        _require(isinstance(self.cond, Question), "%s must be a question", self.cond)
+        _require(all(isinstance(m, PlanConstructor) for m in self.iftrue + self.iffalse),
+                 "the branches of %s must be plan constructors", self)
         self.cond._typecheck(context)
         for m in self.iftrue:
             m._typecheck(context)
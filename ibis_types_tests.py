@@ -155,5 +155,79 @@ class IbisTypesTests(unittest.TestCase):
         self.assertEquals(x.iftrue, tuple([Findout("?x.return_day(x)")]))
         self.assertEquals(x.iffalse, ())
 
+    def test_parse(self):
+        # cached objects
+        q = Question("?x.price(x)")
+        self.assertTrue(Question("?x.price(x)") is q)
+        self.assertTrue(Findout("?x.price(x)").content is q)
+        self.assertEquals(WhQ("price"), q)
+        self.assertEquals(YNQ("?return()"), Question("?return()"))
+
+        # integers
+        self.assertEquals(Ind("-5").content, -5)
+        self.assertEquals(Prop("price(-5)").ind, Ind(-5))
+        self.assertEquals(Ans("-5"), ShortAns(Ind(5), False))
+        self.assertEquals(Ind(" 12").content, 12)
+        self.assertEquals(Ind("+5").content, 5)
+        self.assertEquals(Ans("+5"), ShortAns(Ind(5)))
+
+        # the abstract classes only accept strings
+        for cls in (Sentence, Ans, Question):
+            self.assertRaises(AssertionError, cls, 5)
+            self.assertRaises(AssertionError, cls, Ind("paris"))
+
+        # combined negations
+        self.assertEquals(Prop("-return()", yes=False), Prop("return()"))
+        self.assertEquals(ShortAns("-paris", yes=False), ShortAns("paris"))
+
+        # syntax errors
+        for sent in ["price(x)(y)", "?x.price(x", "city(paris", "", "-",
+                     "paris london", " paris", "?x.price(y)"]:
+            self.assertRaises(ParseError, Sentence, sent)
+        self.assertRaises(SyntaxError, Question, "price(x)")
+        self.assertRaises(AssertionError, YesNo, "maybe")
+        self.assertRaises(ParseError, ShortAns, "yes")
+
+    def test_parse_subclass(self):
+        class PriceProp(Prop): pass
+        class CityAns(ShortAns): pass
+        class Polar(YesNo): pass
+        class CityQ(WhQ): pass
+        class ReturnQ(YNQ): pass
+        for cls, string in [(PriceProp, "price(123)"), (PriceProp, "-return()"),
+                            (CityAns, "-paris"), (Polar, "no"),
+                            (CityQ, "?x.dest_city(x)"), (ReturnQ, "?return()")]:
+            term = cls(string)
+            self.assertTrue(type(term) is cls, (term, cls))
+            self.assertEquals(str(term), string)
+            self.assertTrue(cls(str(term)) is term)
+        self.assertTrue(type(-PriceProp("price(123)")) is PriceProp)
+        self.assertTrue(type(Prop("price(123)")) is Prop)
+        self.assertTrue(type(ReturnQ("?return()").prop) is Prop)
+
+    def test_parse_move(self):
+        self.assertEquals(parse_move("Ask('?x.price(x)')"), Ask("?x.price(x)"))
+        self.assertEquals(parse_move('Answer("-paris")'), Answer("-paris"))
+        self.assertEquals(parse_move("Greet()"), Greet())
+        for string in ["Greet('hello')", "Ask()", "Ask('price(')", "icm:neg*sem",
+                       "__import__('os')", "Answer(Prop('price(1)'))"]:
+            self.assertRaises(ParseError, parse_move, string)
+
+    def test_typechecking(self):
+        domain = Domain([], {'dest_city': 'city'}, {'city': ['paris']})
+        previous = set_typechecking(True)
+        try:
+            # raised also with python -O, see run_tests.py
+            self.assertRaises(TypeCheckError, Prop, Pred1("dest_city"), "paris")
+            self.assertRaises(AssertionError, WhQ, Ind("paris"))
+            self.assertRaises(TypeError, ShortAns, Ind("paris"), 1)
+            self.assertRaises(TypeCheckError, Prop("dest_city(london)")._typecheck, domain)
+            Prop("dest_city(paris)")._typecheck(domain)
+            set_typechecking(False)
+            self.assertEquals(WhQ(Ind("paris")).content, Ind("paris"))
+            Prop("dest_city(london)")._typecheck(domain)
+        finally:
+            set_typechecking(previous)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,526 @@
+# -*- encoding: utf-8 -*-
+
+#
+# rule_compiler.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# and the GNU Lesser General Public License along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+
+"""Compiling update rules into straight-line Python functions.
+
+An update rule is written with an inner @precondition generator, which
+is created anew every time the rule is tried:
+
+    @update_rule
+    def integrate_answer(IS, DOMAIN):
+        @precondition
+        def V():
+            que = IS.shared.qud.top()
+            for move in IS.shared.lu.moves:
+                if isinstance(move, Answer):
+                    if DOMAIN.relevant(move.content, que):
+                        yield R(que=que, ans=move.content)
+        prop = DOMAIN.combine(V.que, V.ans)
+        IS.shared.com.add(prop)
+
+compile_rule transforms the syntax tree of such a rule into two plain
+functions, which are only created once. The precondition becomes a
+function with the same arguments as the rule, where every yield is
+replaced by a return. If every yielded result is a binding R(key=...,
+...) with the same keys, and the effects only read V.key, the
+precondition returns a tuple of the values instead, which the rule
+stores in local variables. A StopIteration exception (e.g., from the
+top of an empty stack) means that the precondition fails, just as it
+does in a generator. So the example above is compiled into:
+
+    def _precondition_integrate_answer(IS, DOMAIN):
+        que = IS.shared.qud.top()
+        for move in IS.shared.lu.moves:
+            if isinstance(move, Answer):
+                if DOMAIN.relevant(move.content, que):
+                    return (que, move.content)
+        return _NOMATCH
+
+    def integrate_answer(IS, DOMAIN):
+        try:
+            _V = _precondition_integrate_answer(IS, DOMAIN)
+        except StopIteration:
+            raise PreconditionFailure
+        if _V is _NOMATCH:
+            raise PreconditionFailure
+        _V_que, _V_ans = _V
+        if _trindikit._tracer:
+            _trindikit._tracer.bound(R(que=_V_que, ans=_V_ans))
+        prop = DOMAIN.combine(_V_que, _V_ans)
+        IS.shared.com.add(prop)
+
+The compiled function also has an attribute check, a function which
+only evaluates the precondition and returns its result, and an
+attribute apply, a function which only applies the effects given such
+a result. They are used by the check and apply methods of update rules
+(see rule_group in trindikit.py).
+
+Preconditions written as precondition(lambda: (... for ...)) are
+compiled in the same way. The rule authors keep writing the original
+syntax; compile_rules installs the compiled functions as the
+implementations of the update rules, and decompile_rules restores the
+originals.
+
+Usage: python rule_compiler.py [--size N] [--dialogues N] [--repeat N]
+runs a micro-benchmark of every IBIS rule, original vs. compiled.
+"""
+
+import sys
+import gc
+import ast
+import inspect
+import textwrap
+import types
+import time
+
+import trindikit
+from trindikit import *
+
+######################################################################
+# compiling rules
+######################################################################
+
+class RuleCompilationError(Exception):
+    """Raised when an update rule is not on a form that can be compiled."""
+    pass
+
+class _NoMatch(object):
+    def __repr__(self):
+        return "<no match>"
+
+_NOMATCH = _NoMatch()
+
+_RESULT = "_V"
+_LOCAL_PREFIX = "_V_"
+
+
+def is_update_rule(obj):
+    """Return True if the object is a rule created by @update_rule."""
+    return callable(obj) and hasattr(obj, 'rule_function')
+
+def _is_docstring(stmt):
+    return isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Str)
+
+def _name(id, ctx=None):
+    return ast.Name(id=id, ctx=ctx or ast.Load())
+
+def _generator_statements(genexp):
+    """Turn a generator expression into nested for and if statements,
+    with a yield statement innermost.
+    """
+    body = [ast.copy_location(ast.Expr(value=ast.Yield(value=genexp.elt)), genexp)]
+    for comp in reversed(genexp.generators):
+        for cond in reversed(comp.ifs):
+            body = [ast.copy_location(ast.If(test=cond, body=body, orelse=[]), cond)]
+        body = [ast.copy_location(ast.For(target=comp.target, iter=comp.iter,
+                                          body=body, orelse=[]), comp.iter)]
+    return body
+
+def _split_rule(funcdef):
+    """Split the body of a rule into the docstring, the name of the
+    precondition variable, the precondition statements, and the effects.
+    """
+    body = list(funcdef.body)
+    docstring = []
+    if body and _is_docstring(body[0]):
+        docstring = [body.pop(0)]
+    if not body:
+        raise RuleCompilationError("The rule has no precondition")
+    first = body.pop(0)
+    if (isinstance(first, ast.FunctionDef) and
+        [dec for dec in first.decorator_list
+         if isinstance(dec, ast.Name) and dec.id == 'precondition'] == first.decorator_list and
+        first.decorator_list and not first.args.args and
+        not first.args.vararg and not first.args.kwarg):
+        statements = [stmt for stmt in first.body if not _is_docstring(stmt)]
+        return docstring, first.name, statements, body
+    if (isinstance(first, ast.Assign) and len(first.targets) == 1 and
+        isinstance(first.targets[0], ast.Name) and
+        isinstance(first.value, ast.Call) and
+        isinstance(first.value.func, ast.Name) and
+        first.value.func.id == 'precondition' and
+        len(first.value.args) == 1 and not first.value.keywords and
+        isinstance(first.value.args[0], ast.Lambda) and
+        isinstance(first.value.args[0].body, ast.GeneratorExp)):
+        genexp = first.value.args[0].body
+        return docstring, first.targets[0].id, _generator_statements(genexp), body
+    raise RuleCompilationError("The first statement of the rule is not a precondition")
+
+
+class _YieldToReturn(ast.NodeTransformer):
+    """Replace yield statements by return statements, and return
+    statements by returning _NOMATCH. Collects the new return statements.
+    """
+
+    def __init__(self):
+        self.returns = []
+
+    def visit_Expr(self, node):
+        if isinstance(node.value, ast.Yield):
+            value = node.value.value or _name('None')
+            result = ast.copy_location(ast.Return(value=value), node)
+            self.returns.append(result)
+            return result
+        return self.generic_visit(node)
+
+    def visit_Return(self, node):
+        return ast.copy_location(ast.Return(value=_name('_NOMATCH')), node)
+
+    def visit_Yield(self, node):
+        raise RuleCompilationError("yield is only supported as a statement, "
+                                   "on line %d" % node.lineno)
+
+    def visit_FunctionDef(self, node):
+        return node
+
+    def visit_Lambda(self, node):
+        return node
+
+    def visit_ClassDef(self, node):
+        return node
+
+
+def _binding_keys(value):
+    """Return the keys of a yielded R(key=...), or None."""
+    if (isinstance(value, ast.Call) and isinstance(value.func, ast.Name) and
+        value.func.id == 'R' and not value.args and value.keywords and
+        not value.starargs and not value.kwargs):
+        return [kw.arg for kw in value.keywords]
+    return None
+
+def _attribute_keys(statements, varname):
+    """Return the set of attributes that are read from the variable in
+    the statements, or None if the variable is used in any other way.
+    """
+    keys = set()
+    attributes = set()
+    for stmt in statements:
+        for node in ast.walk(stmt):
+            if (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name)
+                and node.value.id == varname and isinstance(node.ctx, ast.Load)):
+                keys.add(node.attr)
+                attributes.add(id(node.value))
+    for stmt in statements:
+        for node in ast.walk(stmt):
+            if isinstance(node, ast.Name) and node.id == varname and id(node) not in attributes:
+                return None
+            if isinstance(node, (ast.FunctionDef, ast.Lambda, ast.ClassDef)):
+                return None
+    return keys
+
+
+class _LocalBindings(ast.NodeTransformer):
+    """Replace V.key by the local variable _V_key."""
+
+    def __init__(self, varname):
+        self.varname = varname
+
+    def visit_Attribute(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id == self.varname:
+            return ast.copy_location(_name(_LOCAL_PREFIX + node.attr), node)
+        return self.generic_visit(node)
+
+
+def _statement(source, node):
+    """Parse one statement, with the line number of the node."""
+    stmt = ast.parse(source).body[0]
+    for child in ast.walk(stmt):
+        if hasattr(child, 'lineno'):
+            child.lineno = node.lineno
+            child.col_offset = node.col_offset
+    return stmt
+
+def compile_rule(rule):
+    """Compile an update rule into a function without generators.
+
+    Returns the compiled function, which can be installed as the
+    implementation of the rule. Raises a RuleCompilationError if the
+    rule is not on the form that is described in the module docstring.
+    """
+    function = getattr(rule, 'rule_function', rule)
+    if function.func_closure:
+        raise RuleCompilationError("Rules with free variables are not supported")
+    try:
+        source = textwrap.dedent(inspect.getsource(function))
+        filename = inspect.getsourcefile(function) or "<rule>"
+    except (IOError, TypeError):
+        raise RuleCompilationError("The source code of the rule is not available")
+    tree = ast.parse(source)
+    ast.increment_lineno(tree, function.func_code.co_firstlineno - 1)
+    funcdef = tree.body[0]
+    if not isinstance(funcdef, ast.FunctionDef):
+        raise RuleCompilationError("The rule is not a function definition")
+    name = funcdef.name
+    docstring, varname, statements, effects = _split_rule(funcdef)
+
+    yields = _YieldToReturn()
+    statements = [yields.visit(stmt) for stmt in statements]
+    if not yields.returns:
+        raise RuleCompilationError("The precondition does not yield anything")
+    statements.append(_statement("return _NOMATCH", funcdef))
+
+    # decide if the bindings can be stored in local variables
+    keys = _binding_keys(yields.returns[0].value)
+    if keys and len(set(keys)) == len(keys):
+        for ret in yields.returns:
+            if sorted(_binding_keys(ret.value) or ()) != sorted(keys):
+                keys = None
+                break
+    used = _attribute_keys(effects, varname)
+    local_bindings = bool(keys and used is not None and used <= set(keys))
+    if local_bindings:
+        for ret in yields.returns:
+            values = dict((kw.arg, kw.value) for kw in ret.value.keywords)
+            if len(keys) == 1:
+                ret.value = values[keys[0]]
+            else:
+                ret.value = ast.Tuple(elts=[values[key] for key in keys], ctx=ast.Load())
+        local_names = [_LOCAL_PREFIX + key for key in keys]
+        result = "R(%s)" % ", ".join("%s=%s" % (key, local)
+                                     for key, local in zip(keys, local_names))
+        bindings = [_statement("%s = %s" % (", ".join(local_names), _RESULT), funcdef),
+                    _statement("if _trindikit._tracer:\n"
+                               "    _trindikit._tracer.bound(%s)" % result, funcdef)]
+        check_result = [bindings[0], _statement("return " + result, funcdef)]
+        given = [_statement("%s = %s" % (", ".join(local_names),
+                                         ", ".join("_given." + key for key in keys)),
+                            funcdef)] + bindings[1:]
+        transformer = _LocalBindings(varname)
+        effects = [transformer.visit(stmt) for stmt in effects]
+    else:
+        bindings = [_statement("%s = %s" % (varname, _RESULT), funcdef),
+                    _statement("if _trindikit._tracer:\n"
+                               "    _trindikit._tracer.bound(%s)" % varname, funcdef)]
+        check_result = [_statement("return " + _RESULT, funcdef)]
+        given = [_statement("%s = _given" % varname, funcdef)] + bindings[1:]
+
+    argnames = [arg.id for arg in funcdef.args.args]
+    arglist = ", ".join(argnames)
+    precondition_name = "_precondition_" + name
+    pre_def = _statement("def %s(%s): pass" % (precondition_name, arglist), funcdef)
+    pre_def.body = statements
+    evaluate = [_statement("try:\n"
+                           "    %s = %s(%s)\n"
+                           "except StopIteration:\n"
+                           "    raise _PreconditionFailure"
+                           % (_RESULT, precondition_name, arglist), funcdef),
+                _statement("if %s is _NOMATCH:\n"
+                           "    raise _PreconditionFailure" % _RESULT, funcdef)]
+    rule_def = _statement("def %s(%s): pass" % (name, arglist), funcdef)
+    rule_def.body = (docstring + evaluate + bindings +
+                     (effects or [_statement("pass", funcdef)]))
+    check_def = _statement("def _check(%s): pass" % arglist, funcdef)
+    check_def.body = evaluate + check_result
+    apply_def = _statement("def _apply(%s): pass" % ", ".join(["_given"] + argnames),
+                           funcdef)
+    apply_def.body = given + (effects or [_statement("pass", funcdef)])
+    factory = _statement("def _factory(_NOMATCH, _PreconditionFailure, _trindikit): pass",
+                         funcdef)
+    factory.body = [pre_def, rule_def, check_def, apply_def,
+                    _statement("return %s, _check, _apply" % name, funcdef)]
+    module = ast.Module(body=[factory])
+    ast.fix_missing_locations(module)
+
+    code = compile(module, filename, 'exec')
+    factory_code = [const for const in code.co_consts
+                    if isinstance(const, types.CodeType)][0]
+    make_rule = types.FunctionType(factory_code, function.func_globals)
+    compiled, check, apply = make_rule(_NOMATCH, PreconditionFailure, trindikit)
+    compiled.__doc__ = function.__doc__
+    compiled.check = check
+    compiled.apply = apply
+    compiled.local_bindings = local_bindings
+    return compiled
+
+def update_rules(namespace):
+    """Return the update rules in a module, or in a dict."""
+    if isinstance(namespace, types.ModuleType):
+        namespace = vars(namespace)
+    return [obj for _, obj in sorted(namespace.items()) if is_update_rule(obj)]
+
+def compile_rules(namespace):
+    """Compile all update rules in a module (or a dict), and install the
+    compiled functions as their implementations.
+
+    Returns a dict from the names of the rules that could not be compiled
+    to the reasons.
+    """
+    failures = {}
+    for rule in update_rules(namespace):
+        try:
+            rule.implementation = compile_rule(rule)
+        except RuleCompilationError, err:
+            failures[rule.__name__] = str(err)
+    return failures
+
+def decompile_rules(namespace):
+    """Restore the original implementations of all update rules in a
+    module (or a dict).
+    """
+    for rule in update_rules(namespace):
+        rule.implementation = rule.rule_function
+
+######################################################################
+# micro-benchmark
+######################################################################
+
+class StateSampler(Tracer):
+    """A tracer which takes a snapshot of the dialogue state every time
+    an update rule is tried, at most 'limit' times per rule. The
+    snapshots are stored in the dict self.snapshots, by rule name.
+    """
+
+    def __init__(self, dm, limit=100):
+        self.dm = dm
+        self.limit = limit
+        self.snapshots = {}
+
+    def enter(self, kind, name):
+        if kind == "rule":
+            from rule_trace import snapshot_state
+            snapshots = self.snapshots.setdefault(name, [])
+            if len(snapshots) < self.limit:
+                snapshots.append(snapshot_state(self.dm))
+
+
+def sample_states(size=20, dialogues=3, seed=0):
+    """Run simulated dialogues in a synthetic domain (see ibis_synth),
+    and return the dialogue manager and a dict from rule names to the
+    sampled state snapshots.
+    """
+    from ibis import IBIS1, Grammar
+    from ibis_replay import headless
+    from ibis_synth import scaling_domain, SyntheticDB, SimulatedUser, \
+        ScalingResult, run_dialogue
+    domain = scaling_domain(size, seed)
+    dm = headless(IBIS1)(domain, SyntheticDB(), Grammar(), QueueChannel())
+    sampler = StateSampler(dm)
+    previous = set_tracer(sampler)
+    try:
+        for nr in range(dialogues):
+            run_dialogue(dm, SimulatedUser(domain, seed + nr), ScalingResult(size, size))
+    finally:
+        set_tracer(previous)
+    return dm, sampler.snapshots
+
+
+class RuleTiming(object):
+    """Micro-benchmark results for one rule."""
+
+    def __init__(self, name, calls, firings, original, compiled):
+        self.name = name
+        self.calls = calls
+        self.firings = firings
+        self.original = original
+        self.compiled = compiled
+
+    def speedup(self):
+        return self.original / self.compiled if self.compiled else 0.0
+
+
+def _time_function(function, arguments):
+    firings = 0
+    gc.disable()
+    try:
+        start = time.time()
+        for kw in arguments:
+            try:
+                function(**kw)
+                firings += 1
+            except PreconditionFailure:
+                pass
+        elapsed = time.time() - start
+    finally:
+        gc.enable()
+    return elapsed, firings
+
+def benchmark_rule(rule, dm, snapshots, repeat=10):
+    """Time the original and the compiled implementation of a rule, by
+    applying each of them 'repeat' times to fresh copies of every snapshot.
+    The tracer and the garbage collector are turned off. Returns a
+    RuleTiming.
+    """
+    import cPickle as pickle
+    compiled = compile_rule(rule)
+    def arguments():
+        result = []
+        for _ in range(repeat):
+            for snapshot in snapshots:
+                state = pickle.loads(snapshot)
+                result.append(dict((key, state[key] if key in state else
+                                    getattr(dm, key, None))
+                                   for key in rule.argkeys))
+        return result
+    original_arguments = arguments()
+    compiled_arguments = arguments()
+    previous = set_tracer(None)
+    try:
+        original_time, original_firings = _time_function(rule.rule_function,
+                                                         original_arguments)
+        compiled_time, compiled_firings = _time_function(compiled, compiled_arguments)
+    finally:
+        set_tracer(previous)
+    assert original_firings == compiled_firings, \
+        "%s: the compiled rule fired %d times, the original %d times" % (
+        rule.__name__, compiled_firings, original_firings)
+    calls = repeat * len(snapshots)
+    return RuleTiming(rule.__name__, calls, original_firings,
+                      original_time / calls, compiled_time / calls)
+
+def benchmark(rules, dm, samples, repeat=10, out=None):
+    """Benchmark all rules that can be compiled, on the snapshots in the
+    dict 'samples' (see sample_states), and print a table.
+    """
+    out = out or sys.stdout
+    print >>out, "%-24s %7s %7s %13s %13s %8s" % (
+        "rule", "calls", "fired", "original(us)", "compiled(us)", "speedup")
+    timings = []
+    for rule in rules:
+        snapshots = samples.get(rule.__name__)
+        if not snapshots:
+            print >>out, "%-24s (never tried)" % rule.__name__
+            continue
+        try:
+            timing = benchmark_rule(rule, dm, snapshots, repeat)
+        except RuleCompilationError, err:
+            print >>out, "%-24s (not compiled: %s)" % (rule.__name__, err)
+            continue
+        timings.append(timing)
+        print >>out, "%-24s %7d %7d %13.2f %13.2f %7.2fx" % (
+            timing.name, timing.calls, timing.firings,
+            timing.original * 1e6, timing.compiled * 1e6, timing.speedup())
+    return timings
+
+def main(args):
+    import optparse
+    import ibis_rules
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--size", type="int", default=20,
+                      help="size of the synthetic domain [%default]")
+    parser.add_option("--dialogues", type="int", default=3,
+                      help="simulated dialogues for sampling states [%default]")
+    parser.add_option("--repeat", type="int", default=10,
+                      help="apply every rule N times to every state [%default]")
+    options, _ = parser.parse_args(args)
+    dm, samples = sample_states(options.size, options.dialogues)
+    benchmark(update_rules(ibis_rules), dm, samples, options.repeat)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
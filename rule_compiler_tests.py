@@ -0,0 +1,108 @@
+# -*- encoding: utf-8 -*-
+
+#
+# rule_compiler_tests.py
+#
+# This file contains unit tests for compiling update rules.
+#
+
+from ibis import *
+from ibis_replay import *
+from ibis_replay_tests import TRANSCRIPTS, price_system
+from rule_compiler import *
+import ibis_rules
+import unittest
+
+@update_rule
+def effects_first(IS):
+    IS.private.plan.pop()
+
+class BindingTracer(Tracer):
+    def __init__(self):
+        self.bindings = []
+
+    def bound(self, result):
+        self.bindings.append(result)
+
+class RuleCompilerTests(unittest.TestCase):
+    def tearDown(self):
+        decompile_rules(ibis_rules)
+
+    def test_compile_ibis_rules(self):
+        self.assertEqual(compile_rules(ibis_rules), {})
+        self.assertTrue(integrate_answer.implementation is not integrate_answer.rule_function)
+        self.assertTrue(integrate_answer.implementation.local_bindings)
+        self.assertFalse(get_latest_moves.implementation.local_bindings)
+        decompile_rules(ibis_rules)
+        self.assertTrue(integrate_answer.implementation is integrate_answer.rule_function)
+
+    def test_compilation_error(self):
+        self.assertRaises(RuleCompilationError, compile_rule, effects_first)
+
+    def test_compiled_rule(self):
+        compiled = compile_rule(integrate_answer)
+        domain = price_system().DOMAIN
+        IS = record(shared = record(qud = stack(Question),
+                                    com = set(),
+                                    lu = record(moves = moveset)))
+        IS.shared.qud.push(Question("?x.dest_city(x)"))
+        IS.shared.lu.moves = moveset([Answer("yes")])
+        self.assertRaises(PreconditionFailure, compiled, IS=IS, DOMAIN=domain)
+        IS.shared.lu.moves = moveset([Answer("paris")])
+        tracer = BindingTracer()
+        previous = set_tracer(tracer)
+        try:
+            compiled(IS=IS, DOMAIN=domain)
+        finally:
+            set_tracer(previous)
+        self.assertEqual(IS.shared.com, set([Prop("dest_city(paris)")]))
+        self.assertEqual(tracer.bindings[0].asdict(),
+                         {'que': Question("?x.dest_city(x)"), 'ans': ShortAns("paris")})
+
+    def test_compiled_check(self):
+        compiled = compile_rule(integrate_answer)
+        domain = price_system().DOMAIN
+        IS = record(shared = record(qud = stack(Question),
+                                    com = set(),
+                                    lu = record(moves = moveset([Answer("paris")]))))
+        self.assertRaises(PreconditionFailure, compiled.check, IS=IS, DOMAIN=domain)
+        IS.shared.qud.push(Question("?x.dest_city(x)"))
+        self.assertEqual(compiled.check(IS=IS, DOMAIN=domain).ans, ShortAns("paris"))
+        self.assertEqual(IS.shared.com, set())
+
+    def test_compiled_apply(self):
+        domain = price_system().DOMAIN
+        for rule in (integrate_answer, get_latest_moves):
+            compiled = compile_rule(rule)
+            self.assertTrue(hasattr(compiled, 'apply'))
+        compiled = compile_rule(integrate_answer)
+        IS = record(shared = record(qud = stack(Question),
+                                    com = set(),
+                                    lu = record(moves = moveset())))
+        tracer = BindingTracer()
+        previous = set_tracer(tracer)
+        try:
+            compiled.apply(R(que=Question("?x.dest_city(x)"), ans=ShortAns("paris")),
+                           IS=IS, DOMAIN=domain)
+        finally:
+            set_tracer(previous)
+        self.assertEqual(IS.shared.com, set([Prop("dest_city(paris)")]))
+        self.assertEqual(tracer.bindings[0].ans, ShortAns("paris"))
+
+    def test_compiled_replay(self):
+        transcripts = parse_transcripts(TRANSCRIPTS)
+        original = replay(price_system(), transcripts)
+        compile_rules(ibis_rules)
+        compiled = replay(price_system(), transcripts)
+        self.assertEqual(compiled.mismatches(), [])
+        self.assertEqual([stat.rules for stat in original.stats],
+                         [stat.rules for stat in compiled.stats])
+
+    def test_benchmark(self):
+        dm, samples = sample_states(size=5, dialogues=1)
+        timing = benchmark_rule(integrate_answer, dm, samples["integrate_answer"], 2)
+        self.assertEqual(timing.calls, 2 * len(samples["integrate_answer"]))
+        self.assertTrue(timing.firings > 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,346 @@
+# -*- encoding: utf-8 -*-
+
+#
+# rule_trace.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# and the GNU Lesser General Public License along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+
+"""Recording update rule firings, and replaying recorded turns.
+
+A TraceRecorder is a tracer which writes a binary log of every applied
+update rule in a dialogue: the rule name, the values bound by the
+precondition, and the resulting change to the information state. At the
+start of each user turn, just after interpretation, it also stores a
+snapshot of the whole state (the infostate and the MIVS).
+
+replay_log restores each snapshot in a fresh dialogue manager, runs the
+rest of the turn again, and verifies that the same rules fire with the
+same bindings and effects. Since the interpreted moves are part of the
+snapshot, the input is not parsed again.
+
+Usage: python rule_trace.py [--system module:attribute] [--record transcripts] logfile
+"""
+
+import sys
+import time
+import struct
+import zlib
+import cPickle as pickle
+
+from trindikit import *
+
+######################################################################
+# canonical state representations
+######################################################################
+
+def canonical(obj):
+    """Return a canonical, hashable representation of a value, which
+    does not depend on the iteration order of sets.
+    """
+    if isinstance(obj, (record, binding)):
+        return tuple((key, canonical(val)) for key, val in sorted(obj.asdict().items()))
+    elif isinstance(obj, value):
+        return canonical(obj.get())
+    elif isinstance(obj, stack):
+        return tuple(canonical(elem) for elem in obj)
+    elif isinstance(obj, (set, frozenset, tset)):
+        return tuple(sorted(canonical(elem) for elem in obj))
+    elif isinstance(obj, dict):
+        return tuple(sorted((key, canonical(val)) for key, val in obj.items()))
+    elif isinstance(obj, (list, tuple, hypotheses)):
+        return tuple(canonical(elem) for elem in obj)
+    else:
+        return repr(obj)
+
+def flatten_state(dm):
+    """Return a dict from state paths (such as IS.shared.com) to the
+    canonical representations of their values.
+    """
+    result = {}
+    def flatten(path, obj):
+        if isinstance(obj, record):
+            for key, val in obj.asdict().items():
+                flatten(path + "." + key, val)
+        else:
+            result[path] = canonical(obj)
+    for name in state_variables(dm):
+        flatten(name, getattr(dm, name))
+    return result
+
+def state_delta(before, after):
+    """Return the paths whose values differ, as a sorted tuple of
+    pairs (path, new value).
+    """
+    return tuple(sorted((path, val) for path, val in after.items()
+                        if before.get(path) != val))
+
+def snapshot_state(dm):
+    """Pickle the state variables of a dialogue manager."""
+    return pickle.dumps(dict((name, getattr(dm, name))
+                             for name in state_variables(dm)), 2)
+
+def restore_state(dm, snapshot):
+    """Restore the state variables of a dialogue manager from a snapshot.
+
+    The sinks of streamstacks are kept from the current state.
+    """
+    for name, obj in pickle.loads(snapshot).items():
+        current = getattr(dm, name, None)
+        if isinstance(obj, streamstack) and isinstance(current, streamstack):
+            obj.sink = current.sink
+        setattr(dm, name, obj)
+
+######################################################################
+# the binary log
+######################################################################
+
+def write_entry(logfile, entry):
+    """Write one entry to a log file, as a length-prefixed, compressed pickle."""
+    data = zlib.compress(pickle.dumps(entry, 2))
+    logfile.write(struct.pack("<I", len(data)))
+    logfile.write(data)
+
+def read_entries(logfile):
+    """Iterate over the entries in a log file."""
+    while True:
+        header = logfile.read(4)
+        if len(header) < 4:
+            return
+        size, = struct.unpack("<I", header)
+        yield pickle.loads(zlib.decompress(logfile.read(size)))
+
+######################################################################
+# recording
+######################################################################
+
+class TraceRecorder(Tracer):
+    """A tracer which records the rule firings of a dialogue manager.
+
+    TraceRecorder(dm, logfile, deltas) -> new recorder, writing to the
+        binary file object 'logfile'; if 'deltas' is false, the changes
+        to the information state are not recorded, which is much faster
+
+    The log consists of the following entries:
+
+      - ("turn", nr, snapshot), when the interpret rule has fired
+      - ("fire", rulename, bindings, delta), for every applied rule
+      - ("end", nr, seconds), when the turn is finished
+
+    A turn is finished at the start of the next user turn, when a rule
+    in self.end_rules is entered, or when the recorder is closed.
+
+    Like ibis_replay.CountingTracer, the recorder counts the applied 
+    rules in self.count, since the last call to self.reset_count().
+    """
+
+    interpret_rule = "interpret"
+    end_rules = ("input",)
+
+    def __init__(self, dm, logfile, deltas=True):
+        self.dm = dm
+        self.logfile = logfile
+        self.deltas = deltas
+        self.turns = 0
+        self.count = 0
+        self.turn_start = None
+        self.bindings = None
+        self.state = flatten_state(dm) if deltas and hasattr(dm, 'IS') else {}
+
+    def write(self, entry):
+        write_entry(self.logfile, entry)
+
+    def reset_count(self):
+        self.count = 0
+
+    def end_turn(self):
+        if self.turn_start is not None:
+            self.write(("end", self.turns, time.time() - self.turn_start))
+            self.turn_start = None
+
+    def enter(self, kind, name):
+        if kind == "rule":
+            self.bindings = None
+            if name in self.end_rules:
+                self.end_turn()
+
+    def bound(self, result):
+        self.bindings = canonical(result)
+
+    def fired(self, rulename):
+        delta = ()
+        if self.deltas:
+            state = flatten_state(self.dm)
+            delta = state_delta(self.state, state)
+            self.state = state
+        self.write(("fire", rulename, self.bindings, delta))
+        self.count += 1
+        if rulename == self.interpret_rule:
+            self.turns += 1
+            self.write(("turn", self.turns, snapshot_state(self.dm)))
+            self.turn_start = time.time()
+
+    def turn(self):
+        self.end_turn()
+
+    def close(self):
+        """Finish the current turn, and flush the log file."""
+        self.end_turn()
+        self.logfile.flush()
+
+
+class FiringCollector(TraceRecorder):
+    """A TraceRecorder which collects the entries in the list self.entries."""
+
+    def __init__(self, dm, deltas=True):
+        TraceRecorder.__init__(self, dm, None, deltas)
+        self.entries = []
+
+    def write(self, entry):
+        self.entries.append(entry)
+
+def record_transcripts(system, transcripts, logfile, deltas=True):
+    """Record the rule firings when running scripted dialogues (see
+    ibis_replay) against a dialogue system. Returns the list of finished
+    ibis_replay.Sessions.
+    """
+    from ibis_replay import Session
+    sessions = []
+    for transcript in transcripts:
+        session = Session(system, transcript)
+        recorder = TraceRecorder(session.dm, logfile, deltas)
+        previous = set_tracer(recorder)
+        try:
+            while not session.finished():
+                session.step(recorder)
+            recorder.close()
+        finally:
+            set_tracer(previous)
+        sessions.append(session)
+    return sessions
+
+######################################################################
+# replaying
+######################################################################
+
+class RecordedTurn(object):
+    """A recorded turn: the state snapshot and the rule firings."""
+
+    def __init__(self, nr, snapshot):
+        self.nr = nr
+        self.snapshot = snapshot
+        self.firings = []
+        self.seconds = None
+
+
+def read_turns(logfile):
+    """Return the list of RecordedTurns in a log file."""
+    turns = []
+    for entry in read_entries(logfile):
+        if entry[0] == "turn":
+            turns.append(RecordedTurn(entry[1], entry[2]))
+        elif entry[0] == "fire" and turns and turns[-1].seconds is None:
+            turns[-1].firings.append(entry[1:])
+        elif entry[0] == "end" and turns:
+            turns[-1].seconds = entry[2]
+    return turns
+
+
+class ReplayedTurn(object):
+    """The result of replaying a recorded turn."""
+
+    def __init__(self, recorded, firings, seconds):
+        self.recorded = recorded
+        self.firings = firings
+        self.seconds = seconds
+
+    def first_difference(self):
+        """Return the index of the first firing which differs from the
+        recording, or None if the firings are identical.
+        """
+        recorded = self.recorded.firings
+        for nr, (rec, new) in enumerate(zip(recorded, self.firings)):
+            if rec[0] != new[0] or rec[1] != new[1]:
+                return nr
+            if rec[2] and rec[2] != new[2]:
+                return nr
+        if len(recorded) != len(self.firings):
+            return min(len(recorded), len(self.firings))
+        return None
+
+
+def replay_turn(dm, turn, deltas=True):
+    """Restore the snapshot of a recorded turn in the dialogue manager,
+    and run the rest of the turn: update, and then the system turn.
+    Returns a ReplayedTurn.
+    """
+    restore_state(dm, turn.snapshot)
+    collector = FiringCollector(dm, deltas)
+    previous = set_tracer(collector)
+    try:
+        start = time.time()
+        dm.update()
+        dm.system_turn()
+        seconds = time.time() - start
+    finally:
+        set_tracer(previous)
+    firings = [entry[1:] for entry in collector.entries if entry[0] == "fire"]
+    return ReplayedTurn(turn, firings, seconds)
+
+def replay_log(dm, logfile, deltas=True):
+    """Replay all recorded turns in a log file against a dialogue manager,
+    which must use the same domain, database and grammar as the recording.
+    Returns a list of ReplayedTurns.
+    """
+    return [replay_turn(dm, turn, deltas) for turn in read_turns(logfile)]
+
+def main(args):
+    import optparse
+    from ibis_replay import load_system, load_transcripts, headless
+    parser = optparse.OptionParser(usage="%prog [options] logfile")
+    parser.add_option("--system", default="travel:ibis",
+                      help="the dialogue system, as module:attribute [%default]")
+    parser.add_option("--record", metavar="TRANSCRIPTS",
+                      help="first record the dialogues in a transcript file")
+    parser.add_option("--no-deltas", action="store_true",
+                      help="do not compare the changes to the information state")
+    options, files = parser.parse_args(args)
+    if len(files) != 1:
+        parser.error("exactly one log file is required")
+    system = load_system(options.system)
+    if options.record:
+        with open(files[0], "wb") as logfile:
+            record_transcripts(system, load_transcripts(options.record), logfile,
+                               not options.no_deltas)
+    dm = headless(type(system))(system.DOMAIN, system.DATABASE, system.GRAMMAR,
+                                QueueChannel())
+    dm.reset()
+    with open(files[0], "rb") as logfile:
+        results = replay_log(dm, logfile, not options.no_deltas)
+    failures = 0
+    print "%5s %7s %12s %12s  %s" % ("turn", "rules", "recorded(ms)", "replayed(ms)", "result")
+    for result in results:
+        diff = result.first_difference()
+        recorded = result.recorded.seconds
+        print "%5d %7d %12s %12.3f  %s" % (
+            result.recorded.nr, len(result.firings),
+            "-" if recorded is None else "%.3f" % (recorded * 1e3),
+            result.seconds * 1e3,
+            "ok" if diff is None else "differs at firing %d" % (diff + 1))
+        if diff is not None:
+            failures += 1
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,73 @@
+# -*- encoding: utf-8 -*-
+
+#
+# rule_trace_tests.py
+#
+# This file contains unit tests for recording and replaying rule firings.
+#
+
+from ibis import *
+from ibis_replay import *
+from ibis_replay_tests import TRANSCRIPTS, price_system
+from rule_trace import *
+from StringIO import StringIO
+import unittest
+
+class RuleTraceTests(unittest.TestCase):
+    def test_pickle_state(self):
+        dm = price_system()
+        dm.reset()
+        dm.IS.private.agenda.push(Greet())
+        dm.IS.shared.com.add(Prop("dest_city(paris)"))
+        dm.IS.shared.qud.push(Question("?x.price(x)"))
+        snapshot = snapshot_state(dm)
+        before = flatten_state(dm)
+        dm.reset()
+        self.assertNotEqual(flatten_state(dm), before)
+        restore_state(dm, snapshot)
+        self.assertEqual(flatten_state(dm), before)
+        self.assertEqual(dm.PROGRAM_STATE.get(), ProgramState.RUN)
+
+    def test_record_and_replay(self):
+        transcript = parse_transcripts(TRANSCRIPTS)[0]
+        system = price_system()
+        logfile = StringIO()
+        session, = record_transcripts(system, [transcript], logfile)
+        self.assertEqual(session.mismatches, [])
+        logfile.seek(0)
+        turns = read_turns(logfile)
+        self.assertEqual([turn.nr for turn in turns], [1, 2, 3])
+        self.assertTrue(all(turn.firings and turn.seconds is not None
+                            for turn in turns))
+        rules = [firing[0] for firing in turns[2].firings]
+        self.assertTrue("integrate_answer" in rules)
+        self.assertTrue("exec_consultDB" in rules)
+        logfile.seek(0)
+        firings = [entry for entry in read_entries(logfile) if entry[0] == "fire"]
+        self.assertTrue(all(stat.rules > 0 for stat in session.stats))
+        self.assertEqual(sum(stat.rules for stat in session.stats), len(firings))
+        dm = headless(IBIS1)(system.DOMAIN, system.DATABASE, system.GRAMMAR,
+                             QueueChannel())
+        dm.reset()
+        logfile.seek(0)
+        results = replay_log(dm, logfile)
+        self.assertEqual([result.first_difference() for result in results],
+                         [None, None, None])
+        self.assertEqual(dm.CHANNEL.outputs[-1], "The price is 123.")
+
+    def test_replay_difference(self):
+        transcript = parse_transcripts(TRANSCRIPTS)[0]
+        system = price_system()
+        logfile = StringIO()
+        record_transcripts(system, [transcript], logfile)
+        logfile.seek(0)
+        domain = Domain([], {'price': 'int', 'dest_city': 'city'},
+                        {'city': ['paris', 'london']})
+        domain.add_plan("?x.price(x)", [ConsultDB("?x.price(x)")])
+        dm = headless(IBIS1)(domain, system.DATABASE, system.GRAMMAR, QueueChannel())
+        dm.reset()
+        results = replay_log(dm, logfile)
+        self.assertNotEqual(results[0].first_difference(), None)
+
+if __name__ == '__main__':
+    unittest.main()
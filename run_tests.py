@@ -0,0 +1,72 @@
+# -*- encoding: utf-8 -*-
+
+#
+# run_tests.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# and the GNU Lesser General Public License along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+
+"""Running the unit tests with and without typechecking.
+
+The test modules (*_tests.py) are run in a new Python process for each
+mode: with typechecking, as during development, and without, as in
+production, i.e., with python -O and TRINDIKIT_TYPECHECK=0 (see
+trindikit.set_typechecking).
+
+Usage: python run_tests.py [--mode both|on|off] [test modules...]
+"""
+
+import sys
+import os
+import glob
+import subprocess
+
+MODES = {'on':  ([], "1"),
+         'off': (["-O"], "0")}
+
+def test_modules(directory):
+    """Return the names of all test modules in the directory."""
+    return sorted(os.path.splitext(os.path.basename(filename))[0]
+                  for filename in glob.glob(os.path.join(directory, "*_tests.py")))
+
+def run_tests(modules, mode):
+    """Run the test modules with typechecking 'on' or 'off'.
+    Returns True if all tests succeeded.
+    """
+    options, setting = MODES[mode]
+    env = dict(os.environ, TRINDIKIT_TYPECHECK=setting)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable] + options + ["-m", "unittest"] + list(modules)
+    return subprocess.call(command, cwd=directory, env=env) == 0
+
+def main(args):
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options] [test modules...]")
+    parser.add_option("--mode", choices=["both", "on", "off"], default="both",
+                      help="run with typechecking on, off, or both [%default]")
+    options, modules = parser.parse_args(args)
+    modules = modules or test_modules(os.path.dirname(os.path.abspath(__file__)))
+    modes = ["on", "off"] if options.mode == "both" else [options.mode]
+    failed = []
+    for mode in modes:
+        print >>sys.stderr, "Typechecking %s:" % mode
+        if not run_tests(modules, mode):
+            failed.append(mode)
+    if failed:
+        print >>sys.stderr, "FAILED with typechecking %s" % " and ".join(failed)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
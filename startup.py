@@ -0,0 +1,96 @@
+# -*- encoding: utf-8 -*-
+
+#
+# startup.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# and the GNU Lesser General Public License along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+
+"""Measuring the cold start time of modules.
+
+Every module is imported in a new Python process, so that nothing is
+already imported, and the time of the import statement is measured.
+Optionally, a warm-up statement is run and measured after the import,
+such as loading the grammar of a dialogue system.
+
+Usage: python startup.py [--repeat N] [--warmup] [modules...]
+"""
+
+import sys
+import os
+import json
+import subprocess
+
+# The statement which is run after importing a module, with --warmup.
+WARMUP = {'travel': 'travel.ibis.warmup()'}
+
+_SCRIPT = """
+import sys, time, json
+start = time.time()
+import %(module)s
+imported = time.time()
+%(warmup)s
+warm = time.time()
+json.dump({"import": imported - start, "warmup": warm - imported,
+           "modules": sorted(sys.modules)}, sys.stdout)
+"""
+
+class StartupTime(object):
+    """The cold start time of a module, from the fastest of the runs."""
+
+    def __init__(self, module, import_time, warmup_time, modules):
+        self.module = module
+        self.import_time = import_time
+        self.warmup_time = warmup_time
+        self.modules = modules
+
+def cold_start(module, warmup=None, repeat=3):
+    """Import a module (and run the warm-up statement) in 'repeat' new
+    processes. Returns a StartupTime.
+    """
+    script = _SCRIPT % {'module': module, 'warmup': warmup or "pass"}
+    directory = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c", script], cwd=directory)
+        result = json.loads(output)
+        if best is None or result["import"] < best["import"]:
+            best = result
+    return StartupTime(module, best["import"], best["warmup"],
+                       [str(name) for name in best["modules"]])
+
+def main(args):
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options] [modules...]")
+    parser.add_option("--repeat", type="int", default=3,
+                      help="import every module in N processes [%default]")
+    parser.add_option("--warmup", action="store_true",
+                      help="also measure the warm-up, e.g., loading the grammar")
+    options, modules = parser.parse_args(args)
+    print "%-12s %10s %10s %8s  %s" % ("module", "import(ms)", "warmup(ms)", "modules", "nltk")
+    for module in modules or ["ibis_types", "ibis", "travel"]:
+        warmup = WARMUP.get(module) if options.warmup else None
+        try:
+            result = cold_start(module, warmup, options.repeat)
+        except subprocess.CalledProcessError:
+            print "%-12s failed" % module
+            continue
+        print "%-12s %10.1f %10s %8d  %s" % (
+            module, result.import_time * 1e3,
+            "%.1f" % (result.warmup_time * 1e3) if warmup else "-",
+            len(result.modules), "yes" if "nltk" in result.modules else "no")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,22 @@
+# -*- encoding: utf-8 -*-
+
+#
+# startup_tests.py
+#
+# This file contains unit tests for the cold start of modules.
+#
+
+from startup import *
+import unittest
+
+class StartupTests(unittest.TestCase):
+    def test_lazy_nltk(self):
+        for module in ["ibis_types", "ibis", "cfg_grammar", "travel"]:
+            result = cold_start(module, repeat=1)
+            self.assertTrue(module in result.modules)
+            self.assertFalse("nltk" in result.modules)
+            self.assertFalse("numpy" in result.modules)
+            self.assertTrue(result.import_time > 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -80,15 +80,7 @@ database.addEntry({'price':'232', 'from':'berlin', 'to':'paris', 'day':'today'})
 database.addEntry({'price':'345', 'from':'paris', 'to':'london', 'day':'today'})
 
 class TravelGrammar(SimpleGenGrammar, CFG_Grammar):
-    def generateMove(self, move):
-        try:
-            assert isinstance(move, Answer)
-            prop = move.content
-            assert isinstance(prop, Prop)
-            assert prop.pred.content == "price"
-            return "The price is " + str(prop.ind.content)
-        except:
-            return super(TravelGrammar, self).generateMove(move)
+    pass
 
 grammar = TravelGrammar()
 grammar.loadGrammar("file:travel.fcfg")
@@ -99,6 +91,7 @@ grammar.addForm("Ask('?x.depart_day(x)')", "When do you want to leave?")
 grammar.addForm("Ask('?x.return_day(x)')", "When do you want to return?")
 grammar.addForm("Ask('?x.class(x)')", "First or second class?")
 grammar.addForm("Ask('?return()')", "Do you want a return ticket?")
+grammar.addForm("Answer('price({X})')", "The price is {X}")
 
 ibis = IBIS1(domain, database, grammar)
 
@@ -132,4 +125,5 @@ ibis = IBIS1(domain, database, grammar)
 ######################################################################
 
 if __name__=='__main__':
+    set_tracer(PrintTracer())
     ibis.run()
@@ -29,6 +29,15 @@ import inspect
 import functools
 import collections
 import sys
+import os as _os
+import select as _select
+import time as _time
+import json as _json
+import operator as _operator
+import threading as _threading
+import atexit as _atexit
+import ast as _ast
+import textwrap as _textwrap
 
 ######################################################################
 # helper functions
@@ -105,6 +114,15 @@ class value(object):
         """Remove the value of the object, i.e., set it to None."""
         self.value = None
     
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['type'] = _enum_reference(self.type)
+        return state
+
+    def __setstate__(self, state):
+        state['type'] = _enum_dereference(state['type'])
+        self.__dict__.update(state)
+
     def __repr__(self):
         if self.value:
             return "<%s>" % self.value
@@ -159,9 +177,22 @@ class record(object):
         
         The key must be one of the keys that was used at creation.
         """
+        if key.startswith('__'):
+            raise AttributeError(key)
         self._typecheck(key)
         return self.__dict__[key]
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state[_TYPEDICT] = dict((key, _enum_reference(keytype)) for key, keytype
+                                in state[_TYPEDICT].items())
+        return state
+
+    def __setstate__(self, state):
+        state[_TYPEDICT] = dict((key, _enum_dereference(keytype)) for key, keytype
+                                in state[_TYPEDICT].items())
+        self.__dict__.update(state)
+
     def __setattr__(self, key, value):
         """r.__setattr__('key', value) <==> r.key = value
         
@@ -201,9 +232,65 @@ class record(object):
     def __repr__(self):
         return "record(" + "; ".join("%s = %r" % kv for kv in self.asdict().items()) + ")"
 
+######################################################################
+# bindings, the results of preconditions
+######################################################################
+
+class binding(tuple):
+    """Base class for the results of preconditions. 
+    
+    A binding is an immutable tuple of values, which can also be read
+    as attributes. There is one subclass for every combination of keys,
+    created by binding_class. Bindings are much cheaper to create than
+    records, since there is no typechecking and no instance dict.
+    
+    Bindings are printed and traced in the same way as records.
+    """
+    __slots__ = ()
+    _fields = ()
+    
+    def asdict(self):
+        """Return a dict consisting of the keys and values."""
+        return dict(zip(self._fields, self))
+    
+    def __reduce__(self):
+        return (_make_binding, (self._fields, tuple(self)))
+    
+    def __str__(self):
+        return "{" + "; ".join("%s = %s" % kv for kv in zip(self._fields, self)) + "}"
+
+    def __repr__(self):
+        return "R(" + ", ".join("%s=%r" % kv for kv in zip(self._fields, self)) + ")"
+
+_BINDING_CLASSES = {}
+
+def binding_class(keys):
+    """Return the binding class for a sorted tuple of keys."""
+    try:
+        return _BINDING_CLASSES[keys]
+    except KeyError:
+        attrs = dict((key, property(_operator.itemgetter(nr)))
+                     for nr, key in enumerate(keys))
+        attrs['__slots__'] = ()
+        attrs['_fields'] = keys
+        cls = _BINDING_CLASSES[keys] = type('binding', (binding,), attrs)
+        return cls
+
+def _make_binding(keys, values):
+    return tuple.__new__(binding_class(keys), values)
+
 def R(**kw):
-    """Synonym for records. For the lazy ones."""
-    return record(**kw)
+    """Create a binding, the result of a precondition.
+    
+    R(k1=v1, k2=v2, ...) -> a binding where the values can be read as 
+        attributes, e.g., R(que=q).que == q
+    """
+    keys = tuple(sorted(kw))
+    try:
+        cls = _BINDING_CLASSES[keys]
+    except KeyError:
+        cls = binding_class(keys)
+    return tuple.__new__(cls, [kw[key] for key in keys])
 
 ######################################################################
 # stacks and similar types
@@ -276,6 +363,10 @@ class stack(object):
 
     def __iter__(self):
         return self.elements.__iter__()
+
+    def __reversed__(self):
+        """Iterate over the elements, from the topmost one."""
+        return reversed(self.elements)
         
     def __str__(self):
         return "<[ " + ", ".join(map(str, reversed(self.elements))) + " <]"
@@ -310,6 +401,32 @@ class stackset(stack):
         return "<stackset with %s elements>" % len(self)
 
 
+class streamstack(stack):
+    """A stack which passes on every pushed value to a sink function.
+
+    streamstack(type_or_sequence, sink) -> new stack, see the
+        documentation for stack; sink(value) is called after each push
+    """
+
+    def __init__(self, elements=None, sink=None):
+        stack.__init__(self, elements)
+        self.sink = sink
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['sink'] = None
+        return state
+
+    def push(self, value):
+        """Push a value onto the stack, and pass it on to the sink."""
+        stack.push(self, value)
+        if self.sink:
+            self.sink(value)
+
+    def __repr__(self):
+        return "<streamstack with %s elements>" % len(self)
+
+
 class tset(object):
     """Sets with (optional) typechecking. 
     
@@ -364,6 +481,207 @@ class tset(object):
     def __repr__(self):
         return "<set with %s elements>" % len(self)
 
+class moveset(set):
+    """Sets which are partitioned by the classes of their elements.
+    
+    moveset() -> new empty set
+    moveset(sequence) -> new set initialised from sequence's items
+    
+    A moveset is an ordinary set, with an additional method for finding
+    all elements of a given class. This is used for the sets of dialogue
+    moves (LATEST_MOVES and /shared/lu/moves), so that an update rule
+    can look up e.g. the Answer moves directly, instead of testing all
+    moves with isinstance.
+    
+    The elements of a class are found the first time of_type is called
+    for that class after the set was modified, by iterating over the set,
+    so they come in the same order as in the set. They are remembered in
+    an index, which is cleared (but not thrown away) when the set is 
+    modified, so that a set which is refilled every turn does not 
+    allocate a new index every turn.
+    """
+    
+    _index = None
+    
+    def of_type(self, cls):
+        """Return a tuple of the elements which are instances of cls."""
+        index = self._index
+        if index is None:
+            index = self._index = {}
+        try:
+            return index[cls]
+        except KeyError:
+            elems = index[cls] = tuple(elem for elem in self if isinstance(elem, cls))
+            return elems
+    
+    def _modified(method):
+        def modify(self, *args):
+            if self._index:
+                self._index.clear()
+            return method(self, *args)
+        modify.__name__ = method.__name__
+        modify.__doc__ = method.__doc__
+        return modify
+    
+    add = _modified(set.add)
+    clear = _modified(set.clear)
+    discard = _modified(set.discard)
+    remove = _modified(set.remove)
+    pop = _modified(set.pop)
+    update = _modified(set.update)
+    difference_update = _modified(set.difference_update)
+    intersection_update = _modified(set.intersection_update)
+    symmetric_difference_update = _modified(set.symmetric_difference_update)
+    __ior__ = _modified(set.__ior__)
+    __iand__ = _modified(set.__iand__)
+    __isub__ = _modified(set.__isub__)
+    __ixor__ = _modified(set.__ixor__)
+    del _modified
+    
+    def __reduce__(self):
+        return (moveset, (list(self),))
+    
+    def __repr__(self):
+        if not self:
+            return "set()"
+        return "set([" + ", ".join(map(repr, self)) + "])"
+
+def moves_of_type(moves, cls):
+    """Return a tuple of the moves which are instances of cls.
+    
+    This uses the index of a moveset, and tests every element of any
+    other collection, such as a plain set of moves.
+    """
+    if isinstance(moves, moveset):
+        return moves.of_type(cls)
+    return tuple(move for move in moves if isinstance(move, cls))
+
+
+class hypotheses(object):
+    """Lazy streams of interpretation hypotheses.
+    
+    hypotheses() -> new empty stream
+    hypotheses(iterable) -> new stream of the pairs (score, moves) in
+        iterable, which should come in order of decreasing score
+    
+    The hypotheses are only evaluated when they are needed, by get or
+    by iteration, and are then remembered. So a grammar can produce
+    its hypotheses in a generator, and a dialogue manager which only
+    looks at the best hypothesis will only pay for that one. 
+    
+    When a stream is pickled, all remaining hypotheses are evaluated.
+    """
+    
+    def __init__(self, iterable=()):
+        self.set(iterable)
+    
+    def set(self, iterable):
+        """Replace the stream with the hypotheses in iterable."""
+        self._source = iter(iterable)
+        self._pulled = []
+    
+    def clear(self):
+        """Clear the stream from all hypotheses."""
+        self.set(())
+    
+    @property
+    def pulled(self):
+        """The number of hypotheses evaluated so far."""
+        return len(self._pulled)
+    
+    def get(self, n):
+        """Return the n:th hypothesis (score, moves), counting from 0.
+        Raises IndexError if there are not that many hypotheses."""
+        pulled = self._pulled
+        while len(pulled) <= n and self._source is not None:
+            try:
+                pulled.append(next(self._source))
+            except StopIteration:
+                self._source = None
+        return pulled[n]
+    
+    def __iter__(self):
+        n = 0
+        while True:
+            try:
+                yield self.get(n)
+            except IndexError:
+                return
+            n += 1
+    
+    def __getstate__(self):
+        return {'_pulled': list(self), '_source': None}
+    
+    def __str__(self):
+        more = ", ..." if self._source is not None else ""
+        return "[" + ", ".join("%s: %s" % (score, moves) 
+                               for score, moves in self._pulled) + more + "]"
+    
+    def __repr__(self):
+        return "<hypotheses with %s evaluated>" % self.pulled
+
+######################################################################
+# optional typechecking
+######################################################################
+
+# Unchecked variants of the typechecked methods of the containers.
+
+def _unchecked_set(self, value):
+    """Set the value of the object (without typechecking)."""
+    self.value = value
+
+def _unchecked_setattr(self, key, value):
+    """r.__setattr__('key', value) <==> r.key = value (without typechecking)"""
+    self.__dict__[key] = value
+
+def _unchecked_push(self, value):
+    """Push a value onto the stack (without typechecking)."""
+    self.elements.append(value)
+
+def _unchecked_add(self, value):
+    self.elements.add(value)
+
+def _unchecked_typecheck(self, *values):
+    pass
+
+# (class, method name) -> (checked method, unchecked method)
+_TYPECHECKED_METHODS = dict(
+    ((cls, name), (cls.__dict__[name], unchecked))
+    for cls, name, unchecked in [(value, 'set', _unchecked_set),
+                                 (record, '__setattr__', _unchecked_setattr),
+                                 (stack, 'push', _unchecked_push),
+                                 (stack, '_typecheck', _unchecked_typecheck),
+                                 (tset, 'add', _unchecked_add),
+                                 (tset, '_typecheck', _unchecked_typecheck)])
+
+_typechecking = True
+
+def set_typechecking(enabled):
+    """Turn the typechecking of values, records, stacks and sets on or
+    off, returning the previous setting.
+
+    The setting is process-wide: the methods of the container classes
+    are replaced by unchecked variants, so that e.g. stack.push is only
+    a list append. The keys of records are still checked when reading.
+    
+    By default, typechecking is on, unless Python is run with -O or
+    the environment variable TRINDIKIT_TYPECHECK is "0". Note that -O
+    also removes the assertions in the semantic types, such as the
+    checks of the arguments of ibis_types.Prop.
+    """
+    global _typechecking
+    previous = _typechecking
+    _typechecking = bool(enabled)
+    for (cls, name), (checked, unchecked) in _TYPECHECKED_METHODS.items():
+        setattr(cls, name, checked if _typechecking else unchecked)
+    return previous
+
+def typechecking():
+    """Return True if typechecking is on, see set_typechecking."""
+    return _typechecking
+
+set_typechecking(_os.environ.get("TRINDIKIT_TYPECHECK", "1" if __debug__ else "0") != "0")
+
 ######################################################################
 # enumeration class 
 ######################################################################
@@ -400,12 +718,41 @@ def enum(*names):
             return self.__name
         def __init__(self, name):
             self.__name = name
+        def __reduce__(self):
+            return (_enum_instance, (names, self.__name))
     
     for name in names:
         setattr(Enum, name, Enum(name))
     Enum.__new__ = None
+    _ENUMS[names] = Enum
     return Enum
 
+_ENUMS = {}
+
+def _enum_instance(names, name):
+    """Return the named instance of the enumeration class with the 
+    given names. Used for pickling and copying enumeration instances.
+    """
+    return getattr(_ENUMS[names], name)
+
+class _EnumReference(object):
+    """A picklable reference to an enumeration class, which cannot be
+    pickled itself since it is not a module attribute.
+    """
+    def __init__(self, names):
+        self.names = names
+
+def _enum_reference(cls):
+    for names, enumclass in _ENUMS.items():
+        if cls is enumclass:
+            return _EnumReference(names)
+    return cls
+
+def _enum_dereference(cls):
+    if isinstance(cls, _EnumReference):
+        return _ENUMS[cls.names]
+    return cls
+
 # standard enumeration classes: speakers and program states
 
 Speaker = enum('USR', 'SYS')
@@ -416,17 +763,65 @@ ProgramState = enum('RUN', 'QUIT')
 # semantic types and dialogue moves
 ######################################################################
 
+PARSE_CACHE_SIZE = 10000
+
+_parse_cache = {}
+
+class TypeMeta(type):
+    """Metaclass for semantic types, which caches objects created
+    from strings.
+    
+    When a type is called with a single string argument, cls(string),
+    the object is created by cls.from_string(string) the first time,
+    and then the same object is returned for the same class and string.
+    The cache is cleared when it grows larger than PARSE_CACHE_SIZE.
+    All other calls create new objects as usual.
+    """
+    
+    def __call__(cls, *args, **kw):
+        if len(args) == 1 and not kw and isinstance(args[0], basestring):
+            key = (cls, args[0])
+            try:
+                return _parse_cache[key]
+            except KeyError:
+                pass
+            obj = cls.from_string(args[0])
+            if len(_parse_cache) >= PARSE_CACHE_SIZE:
+                _parse_cache.clear()
+            _parse_cache[key] = obj
+            return obj
+        return type.__call__(cls, *args, **kw)
+
+def clear_parse_cache():
+    """Remove all cached objects created from strings, see TypeMeta."""
+    _parse_cache.clear()
+
+
 class Type(object): 
     """An abstract base class for semantic types.
     
     This is meant to be subclassed by the types in a specific 
     dialogue theory implementation. 
+    
+    Objects of semantic types are values, which must not be modified
+    after they are created. Objects created from strings are shared,
+    see TypeMeta.
     """
+    __metaclass__ = TypeMeta
     contentclass = object
     
     def __new__(cls, *args, **kw):
         return object.__new__(cls)
     
+    @classmethod
+    def from_string(cls, string):
+        """Create an object from a string, which is called by cls(string).
+        
+        By default, the string is the argument of the constructor.
+        Subclasses can override this with a parser.
+        """
+        return type.__call__(cls, string)
+    
     def __init__(self, content):
         if isinstance(content, self.contentclass):
             self.content = content
@@ -449,6 +844,14 @@ class Type(object):
     def __hash__(self):
         return hash((type(self), self.content))
 
+    def __getnewargs__(self):
+        return (self.content,)
+
+    def __getstate__(self):
+        # attributes starting with '_' are caches, which are not pickled
+        return dict((key, val) for key, val in self.__dict__.items()
+                    if not key.startswith('_'))
+
 
 class SingletonType(Type):
     """Abstract class for singleton semantic types."""
@@ -469,6 +872,187 @@ class SingletonMove(SingletonType, Move):
 
 
 
+######################################################################
+# tracing update rules
+######################################################################
+
+class Tracer(object):
+    """Base class for tracers, which are notified about update rules.
+
+    The current tracer is set with set_tracer. This base class ignores
+    all notifications, subclasses override the ones they need:
+
+      - self.enter(kind, name) before an update rule, a rule group or 
+        an algorithm is called, where kind is "rule", "group" or 
+        "algorithm"
+      - self.exit(kind, name, success) when it returns; success is False
+        if it raised an exception, such as a PreconditionFailure
+      - self.fired(rulename) after an update rule has been applied
+      - self.bound(result) when a precondition has matched, with the
+        first yielded result
+      - self.turn() at the start of each user turn
+      - self.note(message) for other messages to the developer
+    """
+
+    def enter(self, kind, name):
+        pass
+
+    def exit(self, kind, name, success):
+        pass
+
+    def fired(self, rulename):
+        pass
+
+    def bound(self, result):
+        pass
+
+    def turn(self):
+        pass
+
+    def note(self, message):
+        pass
+
+
+class PrintTracer(Tracer):
+    """A tracer which prints everything to standard output. 
+    
+    Nothing is traced by default; call set_tracer(PrintTracer()) to 
+    follow the update rules, as travel.py does when it is run.
+    """
+
+    def fired(self, rulename):
+        print "-->", rulename
+        print
+
+    def bound(self, result):
+        if result:
+            if isinstance(result, (record, binding)):
+                for key, value in result.asdict().items():
+                    print "...", key, "=", value
+            else:
+                print "...", result
+
+    def note(self, message):
+        print message
+        print
+
+if hasattr(_time, 'process_time'):
+    _cpu_time = _time.process_time
+else:
+    _cpu_time = _time.clock
+
+class RuleProfiler(Tracer):
+    """A tracer which measures the time spent in update rules.
+
+    For every update rule, rule group and algorithm, the profiler counts
+    the attempts, the failed attempts (i.e., precondition failures for 
+    rules and groups) and the firings, and accumulates the wall-clock and
+    CPU time. It also sums up the wall-clock time of the phases (by
+    default update, select, interpret and generate) for every turn.
+
+    The results can be exported with self.snapshot(), self.json() and
+    self.collapsed(); the latter is the "collapsed stack" format which 
+    is read by flamegraph tools.
+    """
+
+    phases = ("update", "select", "interpret", "generate")
+
+    def __init__(self, phases=None):
+        if phases is not None:
+            self.phases = tuple(phases)
+        self.reset()
+
+    def reset(self):
+        """Forget all measurements."""
+        self.stats = {}
+        self.turns = []
+        self.stacks = collections.defaultdict(float)
+        self.stack = []
+
+    def enter(self, kind, name):
+        # A frame: [kind, name, wall start, cpu start, time in children]
+        self.stack.append([kind, name, _time.time(), _cpu_time(), 0.0])
+
+    def exit(self, kind, name, success):
+        frame = self.stack.pop()
+        wall = _time.time() - frame[2]
+        cpu = _cpu_time() - frame[3]
+        stats = self.stats.get((kind, name))
+        if stats is None:
+            stats = self.stats[kind, name] = dict(attempts=0, failures=0, firings=0,
+                                                  wall=0.0, cpu=0.0)
+        stats['attempts'] += 1
+        if success:
+            stats['firings'] += 1
+        else:
+            stats['failures'] += 1
+        stats['wall'] += wall
+        stats['cpu'] += cpu
+        path = ";".join(f[1] for f in self.stack)
+        self.stacks[path + ";" + name if path else name] += wall - frame[4]
+        if self.stack:
+            self.stack[-1][4] += wall
+        if name in self.phases:
+            if not self.turns:
+                self.turns.append({})
+            totals = self.turns[-1]
+            totals[name] = totals.get(name, 0.0) + wall
+
+    def turn(self):
+        self.turns.append({})
+
+    def snapshot(self):
+        """Return the measurements as a dict, with the keys "rule", 
+        "group" and "algorithm", each mapping names to their statistics,
+        and "turns", a list with the phase times of each turn.
+        """
+        result = {"rule": {}, "group": {}, "algorithm": {}, "turns": list(self.turns)}
+        for (kind, name), stats in self.stats.items():
+            result.setdefault(kind, {})[name] = dict(stats)
+        return result
+
+    def json(self, **kw):
+        """Return the measurements as a JSON string, see self.snapshot()."""
+        return _json.dumps(self.snapshot(), **kw)
+
+    def collapsed(self):
+        """Return the time spent in each call stack, in the collapsed
+        stack format, with one line "name;name;name microseconds" per stack.
+        """
+        return "".join("%s %d\n" % (path, round(t * 1e6))
+                       for path, t in sorted(self.stacks.items()))
+
+    def pprint(self, out=None):
+        """Print a table of the rules, groups and algorithms, 
+        sorted by the total time.
+        """
+        out = out or sys.stdout
+        print >>out, "%-10s %-40s %8s %8s %8s %10s %10s" % (
+            "kind", "name", "attempts", "failures", "firings", "wall(ms)", "cpu(ms)")
+        items = sorted(self.stats.items(), key=lambda item: -item[1]['wall'])
+        for (kind, name), stats in items:
+            print >>out, "%-10s %-40s %8d %8d %8d %10.3f %10.3f" % (
+                kind, name[:40], stats['attempts'], stats['failures'], 
+                stats['firings'], stats['wall'] * 1e3, stats['cpu'] * 1e3)
+
+
+_tracer = None
+
+def set_tracer(tracer):
+    """Set the current tracer, returning the previous one.
+
+    The tracer is process-wide. If it is None, which is the default, 
+    nothing is traced, and the update rules are called directly.
+    """
+    global _tracer
+    previous = _tracer
+    _tracer = tracer
+    return previous
+
+def get_tracer():
+    """Return the current tracer, or None if nothing is traced."""
+    return _tracer
+
 ######################################################################
 # algorithm operators and decorators
 ######################################################################
@@ -482,6 +1066,60 @@ class PreconditionFailure(Exception):
     """
     pass
 
+class PreconditionSatisfied(Exception):
+    """An exception used when only checking the precondition of an
+    update rule, see the method check of update rules. It stops the
+    rule before the effects are applied.
+    """
+    def __init__(self, result):
+        Exception.__init__(self, result)
+        self.result = result
+
+_NOT_GIVEN = object()
+
+class _CheckMode(_threading.local):
+    active = False
+    given = _NOT_GIVEN
+
+_check_mode = _CheckMode()
+
+def _is_precondition(node):
+    return (isinstance(node, _ast.Name) and node.id == 'precondition' or
+            isinstance(node, _ast.Attribute) and node.attr == 'precondition')
+
+_precondition_first = {}
+
+def _starts_with_precondition(function):
+    """Test if the body of a function starts with a precondition, i.e.,
+    if the first statement after the docstring is a function whose 
+    outermost decorator is precondition, or a call to precondition, such
+    as "V = precondition(lambda: ...)". The source of the function is 
+    parsed with ast, as in rule_compiler.py; if it is not available, 
+    the function does not start with a precondition.
+    """
+    code = getattr(function, 'func_code', None)
+    if code is None:
+        return False
+    if code not in _precondition_first:
+        try:
+            source = _textwrap.dedent(inspect.getsource(function))
+            funcdef = _ast.parse(source).body[0]
+        except (IOError, TypeError, SyntaxError, IndexError):
+            funcdef = None
+        body = getattr(funcdef, 'body', [])
+        if (body and isinstance(body[0], _ast.Expr) and 
+            isinstance(body[0].value, _ast.Str)):
+            body = body[1:]
+        first = body[0] if body else None
+        if isinstance(first, _ast.FunctionDef):
+            result = bool(first.decorator_list) and _is_precondition(first.decorator_list[0])
+        elif isinstance(first, (_ast.Assign, _ast.Expr)):
+            result = isinstance(first.value, _ast.Call) and _is_precondition(first.value.func)
+        else:
+            result = False
+        _precondition_first[code] = result
+    return _precondition_first[code]
+
 def do(*rules):
     """Execute the first rule whose precondition matches. 
     
@@ -534,22 +1172,261 @@ def repeat(*rules):
         except PreconditionFailure:
             break
 
-def rule_group(*rules):
+def rule_group(*rules, **options):
     """Group together a number of update rules. 
     
     When executed, the rules are tried in order. The first one whose 
     precondition matches is executed, otherwise the group fails.
+    
+    rule_group(rule1, rule2, ..., strategy=..., workers=N) -> a group
+        which first checks the preconditions of all rules, and then
+        lets the conflict resolution strategy choose which one of the
+        matching rules to apply, see resolve. The preconditions are 
+        checked in N parallel worker threads, if N > 1. Such a group
+        can only contain update rules, not other rule groups.
     """
-    group = lambda self: do(self, *rules)
-    group.__name__ = '<' + '|'.join(rule.__name__ for rule in rules) + '>'
-    group.__doc__ = '\n'.join(
+    strategy = options.pop('strategy', None)
+    workers = options.pop('workers', None)
+    if options:
+        raise TypeError("Unknown rule_group options: %s" % ", ".join(options))
+    name = '<' + '|'.join(rule.__name__ for rule in rules) + '>'
+    if strategy is None and not workers:
+        execute = do
+    else:
+        for rule in rules:
+            if not (hasattr(rule, 'check') and hasattr(rule, 'apply')):
+                raise TypeError("A rule_group with a strategy or workers can only "
+                                "contain update rules, not %s" % rule.__name__)
+        def execute(self, *rules):
+            return resolve(self, rules, strategy or first_by_order, workers)
+    def group(self):
+        tracer = _tracer
+        if tracer is None:
+            return execute(self, *rules)
+        tracer.enter("group", name)
+        success = False
+        try:
+            result = execute(self, *rules)
+            success = True
+        finally:
+            tracer.exit("group", name, success)
+        return result
+    group.__name__ = name
+    group.rules = rules
+    group.ordered = execute is do
+    if execute is do:
+        group.__doc__ = '\n'.join(
             ["Try a group of update rules in order:"] + 
             ["%4d. %s" % (nr+1, rule.__name__) for nr, rule in enumerate(rules)] +
             [""] +
             ["The first rule whose precondition matches is executed,"] +
             ["otherwise the rule group reports a PreconditionFailure."])
+    else:
+        group.__doc__ = '\n'.join(
+            ["Check the preconditions of a group of update rules:"] + 
+            ["%4d. %s" % (nr+1, rule.__name__) for nr, rule in enumerate(rules)] +
+            [""] +
+            ["The matching rule chosen by the strategy %s is executed," % 
+             (strategy or first_by_order).__name__] +
+            ["otherwise the rule group reports a PreconditionFailure."])
     return group
 
+######################################################################
+# batch execution: rule groups for many dialogue managers in lockstep
+######################################################################
+
+def batch_do(dms, group):
+    """Execute a rule group for a list of dialogue managers, in lockstep.
+    
+    This has the same effect as do(dm, group) for each dialogue manager,
+    but the rules are tried one at a time for all dialogue managers: 
+    first the rule is applied to every dialogue manager where no earlier
+    rule matched, then the next rule is applied to the remaining ones.
+    The dialogue managers are thereby grouped by the rule which fires, 
+    and the dispatch of each rule (the lookup of its implementation and
+    argument names) is done once per group instead of once per dialogue
+    manager. If no tracer is set, the rule implementations are called 
+    directly; otherwise every rule is traced once per dialogue manager,
+    as in do, but the group is traced once per batch, where it fires if
+    a rule matched for any of the dialogue managers.
+    
+    Groups with a conflict resolution strategy (see rule_group) and 
+    single update rules are applied to one dialogue manager at a time.
+    Returns the list of dialogue managers where no rule matched.
+    """
+    if not getattr(group, 'ordered', False):
+        return _batch_rule(dms, group)
+    tracer = _tracer
+    if tracer is None:
+        return _batch_group(dms, group)
+    tracer.enter("group", group.__name__)
+    pending = dms
+    try:
+        pending = _batch_group(dms, group)
+    finally:
+        tracer.exit("group", group.__name__, len(pending) < len(dms))
+    return pending
+
+def _batch_group(dms, group):
+    pending = dms
+    for rule in group.rules:
+        if not pending:
+            break
+        pending = _batch_rule(pending, rule)
+    return pending
+
+def _batch_rule(dms, rule):
+    """Apply a rule or a group to each dialogue manager, and return
+    the ones where it failed."""
+    failed = []
+    if _tracer is None and hasattr(rule, 'implementation'):
+        implementation = rule.implementation
+        argkeys = rule.argkeys
+        for dm in dms:
+            try:
+                implementation(**dict((key, getattr(dm, key, None)) for key in argkeys))
+            except PreconditionFailure:
+                failed.append(dm)
+    elif getattr(rule, 'ordered', False):
+        failed = batch_do(dms, rule)
+    else:
+        # single update rules under a tracer, and unordered groups
+        for dm in dms:
+            try:
+                rule(dm)
+            except PreconditionFailure:
+                failed.append(dm)
+    return failed
+
+def batch_maybe(dms, group):
+    """Execute a rule group for a list of dialogue managers, in lockstep.
+    Same as maybe(dm, group) for each one, see batch_do.
+    """
+    batch_do(dms, group)
+
+def batch_repeat(dms, group):
+    """Repeat a rule group for a list of dialogue managers, in lockstep.
+    
+    Same as repeat(dm, group) for each one: the group is executed for all
+    dialogue managers, then again for the ones where a rule matched, and
+    so on, until no rule matches. See batch_do.
+    """
+    pending = dms
+    while pending:
+        failed = set(id(dm) for dm in batch_do(pending, group))
+        pending = [dm for dm in pending if id(dm) not in failed]
+
+######################################################################
+# conflict resolution
+######################################################################
+
+def first_by_order(candidates):
+    """Conflict resolution strategy: choose the first matching rule.
+    
+    This is the same rule that an ordinary rule group would apply.
+    """
+    return candidates[0]
+
+def by_priority(candidates):
+    """Conflict resolution strategy: choose the matching rule with the
+    highest priority (see the priority decorator). Rules without a 
+    priority have priority 0. Ties are resolved by the order of rules.
+    """
+    best = candidates[0]
+    for candidate in candidates[1:]:
+        if getattr(candidate[1], 'priority', 0) > getattr(best[1], 'priority', 0):
+            best = candidate
+    return best
+
+def by_specificity(candidates):
+    """Conflict resolution strategy: choose the matching rule whose 
+    precondition result binds the most keys, i.e., the most specific
+    rule. Ties are resolved by the order of rules.
+    """
+    def specificity(result):
+        if isinstance(result, (binding, record)):
+            return len(result.asdict())
+        return 0
+    best = candidates[0]
+    for candidate in candidates[1:]:
+        if specificity(candidate[2]) > specificity(best[2]):
+            best = candidate
+    return best
+
+def priority(level):
+    """Decorator which sets the priority of an update rule, for the 
+    by_priority strategy:
+    
+    @priority(10)
+    @update_rule
+    def name_of_the_rule(ATTR1, ATTR2, ...):
+        ...
+    """
+    def set_priority(rule):
+        rule.priority = level
+        return rule
+    return set_priority
+
+_worker_pools = {}
+
+def _worker_pool(workers):
+    if workers not in _worker_pools:
+        from multiprocessing.pool import ThreadPool
+        if not _worker_pools:
+            _atexit.register(close_worker_pools)
+        _worker_pools[workers] = ThreadPool(workers)
+    return _worker_pools[workers]
+
+def close_worker_pools():
+    """Stop the worker threads of rule groups with workers (see rule_group).
+    This is done automatically at exit, and new threads are started if
+    such a rule group is executed again.
+    """
+    while _worker_pools:
+        _, pool = _worker_pools.popitem()
+        pool.close()
+        pool.join()
+
+def check_preconditions(self, rules, workers=None):
+    """Check the preconditions of the rules, without applying them.
+    
+    Returns the list of candidates (index, rule, result) of the matching
+    rules, in the order of the rules. If workers > 1, the preconditions 
+    are checked in parallel threads. Since no effects are applied when
+    checking, the state is read-only, but the threads run under the
+    interpreter lock, so this only pays off for preconditions which 
+    wait for something, e.g., an external database.
+    """
+    def check(rule):
+        try:
+            return rule.check(self)
+        except PreconditionFailure:
+            return _NO_CANDIDATE
+    if workers and workers > 1 and len(rules) > 1:
+        results = _worker_pool(workers).map(check, rules)
+    else:
+        results = map(check, rules)
+    return [(nr, rule, result) for nr, (rule, result) in enumerate(zip(rules, results))
+            if result is not _NO_CANDIDATE]
+
+_NO_CANDIDATE = object()
+
+def resolve(self, rules, strategy=first_by_order, workers=None):
+    """Execute the rule chosen by a conflict resolution strategy.
+    
+    The preconditions of all rules are checked on the current state
+    (see check_preconditions), and the strategy chooses one of the 
+    candidates (index, rule, result). The effects of that rule are then
+    applied with the result, without evaluating the precondition once 
+    more (see the apply method of update rules). If no rule matches, 
+    report a PreconditionFailure.
+    """
+    candidates = check_preconditions(self, rules, workers)
+    if not candidates:
+        raise PreconditionFailure
+    nr, rule, result = strategy(candidates)
+    return rule.apply(result, self)
+
 def update_rule(function):
     """Turn a function into an update rule.
     
@@ -568,6 +1445,17 @@ def update_rule(function):
                 yield ...result...
         ...some effects applied to ATTR1, ATTR2, ...
         ...the variable V is now bound to the first yielded result...
+    
+    The original function is stored in the attribute rule_function of
+    the update rule, and the function that is called when the rule is
+    applied is stored in the attribute implementation. The latter can
+    be replaced by an equivalent function, see rule_compiler.py.
+    
+    The methods check and apply split the rule in two: check(...) only
+    evaluates the precondition, and apply(result, ...) only applies the
+    effects. They require that the rule starts with a precondition, 
+    which is tested by the method checkable when it is first needed 
+    (since it parses the source of the rule).
     """
     argkeys, varargs, varkw, defaults = inspect.getargspec(function)
     assert not varargs,  "@update_rule does not support a variable *args argument"
@@ -585,11 +1473,92 @@ def update_rule(function):
                     "Either call %s(%s), " % (funcname, callspec) + \
                     "or %s(dm) where dm is a DialogueManager instance." % funcname
             new_kw = dict((key, getattr(args[0], key, None)) for key in argkeys)
-        result = function(**new_kw)
-        print "-->", funcname
-        print
+        tracer = _tracer
+        if tracer is None:
+            return rule.implementation(**new_kw)
+        tracer.enter("rule", funcname)
+        success = False
+        try:
+            result = rule.implementation(**new_kw)
+            success = True
+        finally:
+            tracer.exit("rule", funcname, success)
+        tracer.fired(funcname)
         return result
     
+    def checkable():
+        """True if the rule starts with a precondition, so that it can
+        be split into check and apply."""
+        return _starts_with_precondition(rule.implementation)
+    
+    def check(*args, **kw):
+        """Check the precondition of the rule, without applying the 
+        effects. Returns the result of the precondition, or raises a
+        PreconditionFailure. Called in the same ways as the rule.
+        
+        Raises a SyntaxError, without calling the rule, if the rule
+        does not start with a precondition.
+        """
+        new_kw = kw
+        if args:
+            new_kw = dict((key, getattr(args[0], key, None)) for key in argkeys)
+        implementation = rule.implementation
+        if hasattr(implementation, 'check'):
+            return implementation.check(**new_kw)
+        if not checkable():
+            raise SyntaxError("The update rule %s does not start with a precondition"
+                              % funcname)
+        previous = _check_mode.active
+        _check_mode.active = True
+        try:
+            implementation(**new_kw)
+        except PreconditionSatisfied, satisfied:
+            return satisfied.result
+        finally:
+            _check_mode.active = previous
+        raise SyntaxError("The precondition of the update rule %s was not checked"
+                          % funcname)
+    
+    def apply(result, *args, **kw):
+        """Apply the effects of the rule, with the variable of the
+        precondition bound to result, which has been returned by the
+        check method. The precondition is not evaluated again. Called 
+        with the result followed by the same arguments as the rule.
+        """
+        new_kw = kw
+        if args:
+            new_kw = dict((key, getattr(args[0], key, None)) for key in argkeys)
+        implementation = rule.implementation
+        if hasattr(implementation, 'apply'):
+            call = lambda: implementation.apply(result, **new_kw)
+        elif checkable():
+            def call():
+                _check_mode.given = result
+                try:
+                    return implementation(**new_kw)
+                finally:
+                    _check_mode.given = _NOT_GIVEN
+        else:
+            raise SyntaxError("The update rule %s does not start with a precondition"
+                              % funcname)
+        tracer = _tracer
+        if tracer is None:
+            return call()
+        tracer.enter("rule", funcname)
+        success = False
+        try:
+            value = call()
+            success = True
+        finally:
+            tracer.exit("rule", funcname, success)
+        tracer.fired(funcname)
+        return value
+    
+    rule.rule_function = rule.implementation = function
+    rule.argkeys = argkeys
+    rule.checkable = checkable
+    rule.check = check
+    rule.apply = apply
     if not rule.__doc__:
         rule.__doc__ = "An information state update rule."
     rule.__doc__ = add_to_docstring(rule.__doc__,
@@ -598,6 +1567,48 @@ def update_rule(function):
             "  2. %s(dm), where dm is a DialogueManager instance." % funcname)
     return rule
 
+def algorithm(method):
+    """Turn a dialogue manager method into a traced algorithm.
+
+    To be used as a decorator on algorithms such as update and select,
+    which makes them visible to the current tracer, e.g., a RuleProfiler.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def traced(self, *args, **kw):
+        tracer = _tracer
+        if tracer is None:
+            return method(self, *args, **kw)
+        tracer.enter("algorithm", name)
+        success = False
+        try:
+            result = method(self, *args, **kw)
+            success = True
+        finally:
+            tracer.exit("algorithm", name, success)
+        return result
+    return traced
+
+def trace_batch(name, function, dms):
+    """Call function(dms), an algorithm run for a list of dialogue 
+    managers in lockstep, as a traced algorithm with the given name. 
+    
+    The algorithm is traced once per batch, not once per dialogue 
+    manager as when it is run by each one, see the algorithm decorator.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return function(dms)
+    tracer.enter("algorithm", name)
+    success = False
+    try:
+        result = function(dms)
+        success = True
+    finally:
+        tracer.exit("algorithm", name, success)
+    return result
+
 def precondition(test):
     """Call a generator or a generator function as an update precondition.
     
@@ -628,7 +1639,17 @@ def precondition(test):
     Note, however, that you have to put the generator expression within
     a lambda, and inside parentheses. Otherwise Python will raise a
     StopIteration exception, because of scoping problems.
+    
+    When the effects of a rule are applied with a result that has already
+    been checked (see the apply method of update rules), the precondition
+    returns that result without evaluating the generator.
     """
+    if _check_mode.given is not _NOT_GIVEN:
+        result = _check_mode.given
+        _check_mode.given = _NOT_GIVEN
+        if _tracer:
+            _tracer.bound(result)
+        return result
     try:
         if hasattr(test, 'next'):
             result = test.next()
@@ -637,12 +1658,10 @@ def precondition(test):
         else:
             raise SyntaxError("Precondition must be a generator or a generator "
                               "function. Instead it is a %s" % type(test))
-        if result:
-            if isinstance(result, record):
-                for key, value in result.asdict().items():
-                    print "...", key, "=", value
-            else:
-                print "...", result
+        if _check_mode.active:
+            raise PreconditionSatisfied(result)
+        if _tracer:
+            _tracer.bound(result)
         return result
     except StopIteration:
         raise PreconditionFailure
@@ -695,6 +1714,159 @@ class DialogueManager(object):
         """self.repeat(*rules) <==> repeat(self, *rules)"""
         return repeat(self, *rules)
 
+    def init_session(self):
+        """Initialise the attributes which belong to a single dialogue
+        but are not state variables, such as output sinks. This is 
+        called by SessionTemplate.start, which does not call reset.
+        """
+        pass
+
+######################################################################
+# session templates: cloning and pooling of states
+######################################################################
+
+# The types of the state variables of a dialogue manager.
+STATE_TYPES = (record, value, stack, tset, set, hypotheses)
+
+def state_variables(dm):
+    """Return the names of the state variables of a dialogue manager,
+    i.e., the infostate and the MIVS.
+    """
+    return sorted(name for name, val in vars(dm).items()
+                  if isinstance(val, STATE_TYPES))
+
+def state_copier(template):
+    """Return a function copy(obj=None), which makes structural copies of
+    the state variable 'template', as it is now.
+    
+    copy() returns a new copy, where records, values, stacks and sets are
+    new objects, while all other objects (such as the elements of stacks
+    and sets, which are values) are shared. The type information of
+    records and values is also shared, since it is never modified.
+    
+    copy(obj) resets obj in place so that it becomes equal to the template,
+    and returns it; the parts of obj that have another structure than
+    the template are replaced by new copies.
+    
+    The structure of the template is only traversed once, when creating
+    the copier, so copying is considerably faster than reset.
+    """
+    cls = type(template)
+    if cls is record:
+        typedict = template.__dict__[_TYPEDICT]
+        fields = [(key, state_copier(val)) for key, val in template.__dict__.items()
+                  if key != _TYPEDICT]
+        size = len(fields) + 1
+        def copy(obj=None):
+            if type(obj) is record and obj.__dict__[_TYPEDICT] is typedict:
+                state = obj.__dict__
+                if len(state) != size:
+                    for key in set(state) - set(key for key, _ in fields) - set([_TYPEDICT]):
+                        del state[key]
+                for key, copier in fields:
+                    state[key] = copier(state.get(key))
+                return obj
+            obj = record.__new__(record)
+            state = obj.__dict__
+            state[_TYPEDICT] = typedict
+            for key, copier in fields:
+                state[key] = copier()
+            return obj
+    elif cls is value:
+        state = dict(template.__dict__)
+        def copy(obj=None):
+            if type(obj) is not value:
+                obj = value.__new__(value)
+            obj.__dict__.update(state)
+            return obj
+    elif cls is hypotheses:
+        items = tuple(template)
+        def copy(obj=None):
+            if type(obj) is not hypotheses:
+                obj = hypotheses.__new__(hypotheses)
+            obj.set(items)
+            return obj
+    elif isinstance(template, (stack, tset)):
+        container = list if isinstance(template, stack) else set
+        state = dict(template.__dict__)
+        elements = tuple(state.pop('elements'))
+        def copy(obj=None):
+            if type(obj) is cls:
+                obj.__dict__.update(state)
+                if container is list:
+                    obj.elements[:] = elements
+                else:
+                    obj.elements.clear()
+                    obj.elements.update(elements)
+                return obj
+            obj = cls.__new__(cls)
+            obj.__dict__.update(state)
+            obj.elements = container(elements)
+            return obj
+    elif isinstance(template, set):
+        elements = tuple(template)
+        def copy(obj=None):
+            if type(obj) is cls:
+                if obj:
+                    obj.clear()
+                if elements:
+                    obj.update(elements)
+                return obj
+            return cls(elements)
+    else:
+        def copy(obj=None):
+            return template
+    return copy
+
+def clone_state(obj):
+    """Return a structural copy of a state variable, see state_copier."""
+    return state_copier(obj)()
+
+
+class SessionTemplate(object):
+    """A precomputed state for new dialogues, which is cloned instead 
+    of calling reset for every dialogue.
+    
+    SessionTemplate(dm, pool_size) -> new template, with a copy of the 
+        current state variables of dm, which normally has just been reset
+    
+    template.start(dm) gives a dialogue manager a new state, and 
+    template.finish(dm) puts its state in a pool when the dialogue is
+    over. The pooled states (at most pool_size) are reused by start, 
+    after resetting them in place, so that no new records, stacks or 
+    sets have to be created. Attributes which are not state variables
+    are initialised by dm.init_session().
+    
+    Bound methods of the template's dialogue manager in the state (such
+    as the sink of a streamstack) are bound to the new dialogue manager.
+    """
+    
+    def __init__(self, dm, pool_size=16):
+        self.dm = dm
+        self.names = state_variables(dm)
+        self.copiers = [(name, state_copier(getattr(dm, name))) for name in self.names]
+        self.pool_size = pool_size
+        self.pool = []
+    
+    def start(self, dm):
+        """Give a dialogue manager a new state, equal to the template."""
+        state = self.pool.pop() if self.pool else {}
+        for name, copier in self.copiers:
+            obj = copier(state.get(name))
+            if type(obj) is streamstack:
+                sink = obj.sink
+                if getattr(sink, '__self__', None) is self.dm:
+                    obj.sink = getattr(dm, sink.__name__)
+            setattr(dm, name, obj)
+        dm.init_session()
+    
+    def finish(self, dm):
+        """Put the state of a finished dialogue in the pool. The dialogue
+        manager must not be used again before it is started anew.
+        """
+        if len(self.pool) < self.pool_size:
+            self.pool.append(dict((name, getattr(dm, name)) for name in self.names))
+
 ######################################################################
 # the standard set of module interface variables
 ######################################################################
@@ -705,17 +1877,23 @@ class StandardMIVS(DialogueManager):
     
       - self.INPUT          : value of str
       - self.LATEST_SPEAKER : value of SYS | USR
-      - self.LATEST_MOVES   : set of Move
+      - self.LATEST_MOVES   : moveset of Move
+      - self.HYPOTHESES     : hypotheses of (score, moves)
       - self.NEXT_MOVES     : stack of Move
       - self.OUTPUT         : value of str
       - self.PROGRAM_STATE  : value of RUN | QUIT
+
+    The MIVS are created once, by reset, and are then cleared and 
+    refilled in place every turn. Like all containers, they are not 
+    typechecked if typechecking is switched off, see set_typechecking.
     """
 
     def init_MIVS(self):
         """Initialise the MIVS. To be called from self.reset()."""
         self.INPUT          = value(str)
         self.LATEST_SPEAKER = value(Speaker)
-        self.LATEST_MOVES   = set()
+        self.LATEST_MOVES   = moveset()
+        self.HYPOTHESES     = hypotheses()
         self.NEXT_MOVES     = stack(Move)
         self.OUTPUT         = value(str)
         self.PROGRAM_STATE  = value(ProgramState)
@@ -726,10 +1904,214 @@ class StandardMIVS(DialogueManager):
         print prefix + "INPUT:         ", self.INPUT
         print prefix + "LATEST_SPEAKER:", self.LATEST_SPEAKER
         print prefix + "LATEST_MOVES:  ", self.LATEST_MOVES
+        print prefix + "HYPOTHESES:    ", self.HYPOTHESES
         print prefix + "NEXT_MOVES:    ", self.NEXT_MOVES
         print prefix + "OUTPUT:        ", self.OUTPUT
         print prefix + "PROGRAM_STATE: ", self.PROGRAM_STATE
 
+######################################################################
+# input/output channels
+######################################################################
+
+class Channel(object):
+    """Abstract base class for line-based input/output channels.
+
+    Subclasses need to implement at least:
+      - self.readline() for reading one line of input, without the
+        trailing newline; returns None at the end of the input
+      - self.writeline(line) for writing one line of output
+
+    Output may be buffered until self.flush() is called. 
+    """
+
+    def readline(self):
+        """Read one line of input, or return None at end of input."""
+        raise NotImplementedError
+
+    def writeline(self, line):
+        """Write one line of output."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Send all buffered output."""
+        pass
+
+    def close(self):
+        """Flush the output and close the channel."""
+        self.flush()
+
+
+class ConsoleChannel(Channel):
+    """The interactive console, i.e., standard input and output.
+
+    ConsoleChannel(input_prompt, output_prompt) -> new console channel
+    """
+
+    def __init__(self, input_prompt="U> ", output_prompt="S> "):
+        self.input_prompt = input_prompt
+        self.output_prompt = output_prompt
+
+    def readline(self):
+        try:
+            line = raw_input(self.input_prompt)
+        except EOFError:
+            print "EOF"
+            return None
+        print
+        return line
+
+    def writeline(self, line):
+        print self.output_prompt + line
+        print
+
+
+class QueueChannel(Channel):
+    """An in-memory channel, mainly intended for testing.
+
+    QueueChannel(inputs) -> new channel, reading from the sequence of 
+        strings 'inputs'; more input can be added with self.feed()
+
+    The input ends when the queue is empty. All output is collected 
+    in the list self.outputs.
+    """
+
+    def __init__(self, inputs=()):
+        self.inputs = collections.deque(inputs)
+        self.outputs = []
+
+    def feed(self, *lines):
+        """Add lines to the end of the input queue."""
+        self.inputs.extend(lines)
+
+    def readline(self):
+        if self.inputs:
+            return self.inputs.popleft()
+        return None
+
+    def writeline(self, line):
+        self.outputs.append(line)
+
+
+class BufferedChannel(Channel):
+    """Abstract base class for channels over newline-delimited byte streams.
+
+    Input is read in large chunks and split into lines, and output is 
+    buffered until flush() is called, or until input is read. This means 
+    that there is at most one read and one write per dialogue turn.
+
+    Subclasses need to implement:
+      - self.fileno() for the file descriptor to wait on
+      - self.recv(size) for reading at most size bytes ('' at end of input)
+      - self.send(data) for writing all of the data
+    """
+
+    chunksize = 65536
+
+    def __init__(self):
+        self.lines = collections.deque()
+        self.partial = ""
+        self.pending = []
+        self.eof = False
+
+    def fill(self):
+        """Read one chunk of input into the line buffer.
+        
+        Returns False at the end of the input.
+        """
+        data = self.recv(self.chunksize)
+        if not data:
+            self.eof = True
+            if self.partial:
+                self.lines.append(self.partial)
+                self.partial = ""
+            return False
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        self.lines.extend(line.rstrip("\r") for line in lines)
+        return True
+
+    def ready(self):
+        """Return the number of complete lines that can be read without 
+        blocking, reading all available input into the line buffer.
+        """
+        while not self.eof and _select.select([self.fileno()], [], [], 0)[0]:
+            if not self.fill():
+                break
+        return len(self.lines)
+
+    def readline(self):
+        self.flush()
+        while not self.lines:
+            if self.eof or not self.fill() and not self.lines:
+                return None
+        return self.lines.popleft()
+
+    def writeline(self, line):
+        self.pending.append(line)
+        self.pending.append("\n")
+
+    def flush(self):
+        if self.pending:
+            data = "".join(self.pending)
+            del self.pending[:]
+            self.send(data)
+
+
+class SocketChannel(BufferedChannel):
+    """A channel over a connected stream socket, e.g., a Unix socket.
+
+    SocketChannel(sock) -> new channel, reading and writing to 'sock'
+    """
+
+    def __init__(self, sock):
+        BufferedChannel.__init__(self)
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.flush()
+        self.sock.close()
+
+
+class PipeChannel(BufferedChannel):
+    """A channel over a pair of file descriptors, e.g., Unix pipes.
+
+    PipeChannel(infile, outfile) -> new channel, where infile and outfile
+        are file descriptors or objects with a fileno() method
+    """
+
+    def __init__(self, infile, outfile):
+        BufferedChannel.__init__(self)
+        self.infd = infile if isinstance(infile, int) else infile.fileno()
+        self.outfd = outfile if isinstance(outfile, int) else outfile.fileno()
+
+    def fileno(self):
+        return self.infd
+
+    def recv(self, size):
+        return _os.read(self.infd, size)
+
+    def send(self, data):
+        while data:
+            written = _os.write(self.outfd, data)
+            data = data[written:]
+
+    def close(self):
+        self.flush()
+        _os.close(self.infd)
+        _os.close(self.outfd)
+
+
+CONSOLE = ConsoleChannel()
+
 ######################################################################
 # naive generate and output modules
 ######################################################################
@@ -741,8 +2123,12 @@ class SimpleOutput(DialogueManager):
     LATEST_SPEAKER - a GRAMMAR is required with the method:
     
       - GRAMMAR.generate(set of moves), returning a string.
+
+    The output is written to CHANNEL, which by default is the console.
     """
 
+    CHANNEL = CONSOLE
+
     @update_rule
     def generate(NEXT_MOVES, OUTPUT, GRAMMAR):
         """Convert NEXT_MOVES to a string and put in OUTPUT.
@@ -753,14 +2139,127 @@ class SimpleOutput(DialogueManager):
         OUTPUT.set(GRAMMAR.generate(NEXT_MOVES))
 
     @update_rule
-    def output(NEXT_MOVES, OUTPUT, LATEST_SPEAKER, LATEST_MOVES):
-        """Print the string in OUTPUT to standard output.
+    def output(NEXT_MOVES, OUTPUT, LATEST_SPEAKER, LATEST_MOVES, CHANNEL):
+        """Write the string in OUTPUT to the output channel.
         
-        After printing, the set of NEXT_MOVES is moved to LATEST_MOVES,
+        After writing, the set of NEXT_MOVES is moved to LATEST_MOVES,
         and LATEST_SPEAKER is set to SYS.
         """
-        print "S>", OUTPUT.get() or "[---]"
-        print
+        CHANNEL.writeline(OUTPUT.get() or "[---]")
+        LATEST_SPEAKER.set(Speaker.SYS)
+        LATEST_MOVES.clear()
+        LATEST_MOVES.update(NEXT_MOVES)
+        NEXT_MOVES.clear()
+
+######################################################################
+# streaming generate and output modules
+######################################################################
+
+class PrintSink(object):
+    """An output sink printing phrases to standard output.
+
+    Every phrase is printed on its own line as soon as it arrives,
+    and None ends the utterance.
+    """
+
+    def __init__(self, prompt="S> "):
+        self.prompt = prompt
+        self.started = False
+
+    def __call__(self, phrase):
+        if phrase is None:
+            if self.started:
+                print
+            self.started = False
+        else:
+            print (" " * len(self.prompt) if self.started else self.prompt) + phrase
+            sys.stdout.flush()
+            self.started = True
+
+
+class ChannelSink(object):
+    """An output sink writing each phrase as a line to a channel.
+
+    ChannelSink(channel, terminator="") -> new sink, which writes the 
+        line terminator at the end of each utterance
+
+    The channel is flushed after each line.
+    """
+
+    def __init__(self, channel, terminator=""):
+        self.channel = channel
+        self.terminator = terminator
+
+    def __call__(self, phrase):
+        if phrase is None:
+            phrase = self.terminator
+        self.channel.writeline(phrase)
+        self.channel.flush()
+
+
+class StreamingOutput(SimpleOutput):
+    """Incremental implementations of a generation module and an output module.
+
+    NEXT_MOVES is a streamstack: every move is generated as soon as it
+    is pushed, and the phrase is passed on to OUTPUT_SINK and collected
+    in the list PHRASES. The default sink is a PrintSink if CHANNEL is
+    the console, and a ChannelSink otherwise. But any function taking 
+    one phrase at a time can be used, such as the put method of a Queue.
+    At the end of each utterance, the sink is called with None.
+
+    Apart from the standard MIVS, a GRAMMAR is required with the method:
+
+      - GRAMMAR.generatePhrase(move), returning a string.
+    """
+
+    OUTPUT_SINK = None
+
+    def init_MIVS(self):
+        """Initialise the MIVS, replacing NEXT_MOVES by a streamstack."""
+        super(StreamingOutput, self).init_MIVS()
+        self.init_session()
+        self.NEXT_MOVES = streamstack(Move, sink=self.stream_move)
+
+    def init_session(self):
+        """Create the default OUTPUT_SINK, if there is none, and an
+        empty list of PHRASES.
+        """
+        super(StreamingOutput, self).init_session()
+        self.PHRASES = []
+        if self.OUTPUT_SINK is None:
+            if self.CHANNEL is CONSOLE:
+                self.OUTPUT_SINK = PrintSink()
+            else:
+                self.OUTPUT_SINK = ChannelSink(self.CHANNEL)
+
+    def stream_move(self, move):
+        """Generate a single move and pass the phrase on to OUTPUT_SINK."""
+        phrase = self.GRAMMAR.generatePhrase(move)
+        self.PHRASES.append(phrase)
+        self.OUTPUT_SINK(phrase)
+
+    @update_rule
+    def generate(PHRASES, OUTPUT):
+        """Put the phrases that have been streamed in OUTPUT.
+        
+        The moves in NEXT_MOVES have already been generated one at a
+        time, so the phrases are joined instead of generated again.
+        """
+        OUTPUT.set(" ".join(PHRASES))
+
+    @update_rule
+    def output(NEXT_MOVES, OUTPUT, LATEST_SPEAKER, LATEST_MOVES, OUTPUT_SINK, PHRASES):
+        """End the streamed utterance.
+
+        The phrases have already been passed on to OUTPUT_SINK, which
+        is now called with None. An empty utterance is first passed on
+        as "[---]", as in SimpleOutput. Then the set of NEXT_MOVES is 
+        moved to LATEST_MOVES, and LATEST_SPEAKER is set to SYS.
+        """
+        if not OUTPUT.get():
+            OUTPUT_SINK("[---]")
+        OUTPUT_SINK(None)
+        del PHRASES[:]
         LATEST_SPEAKER.set(Speaker.SYS)
         LATEST_MOVES.clear()
         LATEST_MOVES.update(NEXT_MOVES)
@@ -770,44 +2269,93 @@ class SimpleOutput(DialogueManager):
 # naive interpret and input modules
 ######################################################################
 
+def as_moves(move_or_moves):
+    """Convert the result of GRAMMAR.interpret to a tuple of moves."""
+    if not move_or_moves:
+        return ()
+    elif isinstance(move_or_moves, Move):
+        return (move_or_moves,)
+    return tuple(move_or_moves)
+
+_uses_nbest = {}
+
+def nbest_interpreter(grammar):
+    """Return grammar.interpret_nbest, or None if the grammar has no such
+    method, or if interpret is overridden in a subclass of the class 
+    which defines interpret_nbest, since the override would be skipped.
+    """
+    cls = type(grammar)
+    try:
+        uses = _uses_nbest[cls]
+    except KeyError:
+        nbest_cls = interpret_cls = None
+        for c in cls.__mro__:
+            if nbest_cls is None and 'interpret_nbest' in c.__dict__:
+                nbest_cls = c
+            if interpret_cls is None and 'interpret' in c.__dict__:
+                interpret_cls = c
+        uses = _uses_nbest[cls] = (nbest_cls is not None and 
+                                   (interpret_cls is None or 
+                                    issubclass(nbest_cls, interpret_cls)))
+    return grammar.interpret_nbest if uses else None
+
 class SimpleInput(object):
     """Naive implementations of an input module and an interpretation module.
     
-    Apart from the standard MIVS - LATEST_MOVES, INPUT and LATEST_SPEAKER - 
-    a GRAMMAR is required with the method:
+    Apart from the standard MIVS - LATEST_MOVES, HYPOTHESES, INPUT and 
+    LATEST_SPEAKER - a GRAMMAR is required with the method:
     
       - GRAMMAR.interpret(string), returning a move or a sequence of moves.
+    
+    If the GRAMMAR also has a method interpret_nbest(string), returning
+    an iterator of pairs (score, move or moves) in order of decreasing 
+    score, all of them are put in HYPOTHESES. But if interpret is
+    overridden in a subclass of the class which defines interpret_nbest,
+    interpret is used instead, see nbest_interpreter.
+
+    The input is read from CHANNEL, which by default is the console.
     """
 
+    CHANNEL = CONSOLE
+
     @update_rule
-    def interpret(INPUT, LATEST_MOVES, GRAMMAR):
+    def interpret(INPUT, LATEST_MOVES, HYPOTHESES, GRAMMAR):
         """Convert an INPUT string to a set of LATEST_MOVES.
         
-        Calls GRAMMAR.interpret to convert the string in INPUT
-        to a set of LATEST_MOVES.
+        Calls GRAMMAR.interpret_nbest (or GRAMMAR.interpret) to convert
+        the string in INPUT to a stream of HYPOTHESES. Only the best 
+        hypothesis is evaluated, and put in LATEST_MOVES.
         """
         LATEST_MOVES.clear()
+        HYPOTHESES.clear()
         if INPUT.value != '':
-            move_or_moves = GRAMMAR.interpret(INPUT.get())
-            if not move_or_moves:
-                print "Did not understand:", INPUT
-                print
-            elif isinstance(move_or_moves, Move):
-                LATEST_MOVES.add(move_or_moves)
+            nbest = nbest_interpreter(GRAMMAR)
+            if nbest is None:
+                stream = [(1.0, GRAMMAR.interpret(INPUT.get()))]
+            else:
+                stream = nbest(INPUT.get())
+            HYPOTHESES.set((score, as_moves(move_or_moves))
+                           for score, move_or_moves in stream)
+            try:
+                score, moves = HYPOTHESES.get(0)
+            except IndexError:
+                moves = ()
+            if not moves:
+                if _tracer:
+                    _tracer.note("Did not understand: %s" % INPUT)
             else:
-                LATEST_MOVES.update(move_or_moves)
+                LATEST_MOVES.update(moves)
 
     @update_rule
-    def input(INPUT, LATEST_SPEAKER):
-        """Inputs a string from standard input.
+    def input(INPUT, LATEST_SPEAKER, PROGRAM_STATE, CHANNEL):
+        """Inputs a string from the input channel.
         
         The string is put in INPUT, and LATEST_SPEAKER is set to USR.
+        At the end of the input, PROGRAM_STATE is set to QUIT instead.
         """
-        try:
-            str = raw_input("U> ")
-        except EOFError:
-            print "EOF"
-            sys.exit()
-        INPUT.set(str)
+        line = CHANNEL.readline()
+        if line is None:
+            PROGRAM_STATE.set(ProgramState.QUIT)
+            return
+        INPUT.set(line)
         LATEST_SPEAKER.set(Speaker.USR)
-        print
@@ -0,0 +1,345 @@
+# -*- encoding: utf-8 -*-
+
+#
+# trindikit_tests.py
+#
+# This file contains unit tests for the TrindiKit datatypes.
+#
+
+from trindikit import *
+import copy
+import cPickle as pickle
+import os
+import socket
+import unittest
+
+@update_rule
+def pick_any(MOVES, PICKED):
+    @precondition
+    def V():
+        for move in MOVES:
+            yield R(move=move)
+    PICKED.push(("any", V.move))
+
+@priority(10)
+@update_rule
+def pick_large(MOVES, PICKED):
+    @precondition
+    def V():
+        for move in MOVES:
+            if move > 10:
+                yield R(move=move)
+    PICKED.push(("large", V.move))
+
+@update_rule
+def pick_pair(MOVES, PICKED):
+    V = precondition(lambda: (R(first=m1, second=m2)
+                              for m1 in MOVES for m2 in MOVES if m1 < m2))
+    PICKED.push(("pair", V.first))
+
+@update_rule
+def pick_top(MOVES, PICKED):
+    @precondition
+    def V():
+        yield R(move=MOVES.top())
+    PICKED.push(("top", MOVES.pop()))
+
+@update_rule
+def pick_counted(MOVES, PICKED):
+    @precondition
+    def V():
+        PICKED.push(("counted", None))
+        yield R(move=MOVES.top())
+    PICKED.push(("top", V.move))
+
+@update_rule
+def push_only(MOVES, PICKED):
+    PICKED.push(("push", None))
+
+class RuleDM(DialogueManager):
+    def __init__(self, *moves):
+        self.MOVES = stack(moves)
+        self.PICKED = stack()
+
+class StreamDM(StandardMIVS):
+    def reset(self):
+        self.init_MIVS()
+        self.IS = record(agenda=stack(), bel=set(), sub=record(flag=value(1, 2)))
+        self.NEXT_MOVES = streamstack(int, sink=self.stream)
+        self.streamed = []
+
+    def stream(self, move):
+        self.streamed.append(move)
+
+    def init_session(self):
+        self.streamed = []
+
+class TrindikitTests(unittest.TestCase):
+    def setUp(self):
+        self.previous_tracer = set_tracer(None)
+
+    def tearDown(self):
+        set_tracer(self.previous_tracer)
+
+    def test_binding(self):
+        V = R(que="?x.price(x)", ans="paris")
+        self.assertTrue(isinstance(V, binding))
+        self.assertEqual(V.que, "?x.price(x)")
+        self.assertEqual(V.ans, "paris")
+        self.assertEqual(V.asdict(), {'que': "?x.price(x)", 'ans': "paris"})
+        self.assertTrue(type(V) is type(R(ans=1, que=2)))
+        self.assertFalse(type(V) is type(R(que=1)))
+        self.assertRaises(AttributeError, setattr, V, 'que', 1)
+        self.assertRaises(AttributeError, getattr, V, 'move')
+        self.assertEqual(repr(V), "R(ans='paris', que='?x.price(x)')")
+        self.assertEqual(pickle.loads(pickle.dumps(V, 2)), V)
+        self.assertEqual(copy.deepcopy(V).que, V.que)
+
+    def test_precondition_binding(self):
+        moves = stack([1, 2, 3])
+        V = precondition(lambda: (R(move=move, next=move + 1)
+                                  for move in moves if move > 1))
+        self.assertEqual((V.move, V.next), (2, 3))
+        self.assertRaises(PreconditionFailure, precondition,
+                          lambda: (R(move=move) for move in moves if move > 3))
+
+    def test_moveset(self):
+        moves = moveset([1, 2.5, "a", 3])
+        self.assertEqual(sorted(moves.of_type(int)), [1, 3])
+        self.assertEqual(moves.of_type(float), (2.5,))
+        self.assertEqual(moves.of_type(list), ())
+        self.assertEqual(len(moves.of_type(object)), 4)
+        moves.discard(1)
+        moves.add(4)
+        self.assertEqual(sorted(moves.of_type(int)), [3, 4])
+        moves |= set([5])
+        self.assertEqual(sorted(moves.of_type(int)), [3, 4, 5])
+        index = moves._index
+        moves.clear()
+        self.assertEqual(moves.of_type(int), ())
+        self.assertTrue(moves._index is index)
+        self.assertEqual(repr(moves), "set()")
+        moves.update([(1, 2)])
+        self.assertEqual(repr(moves), "set([(1, 2)])")
+        self.assertEqual(pickle.loads(pickle.dumps(moves, 2)).of_type(tuple), ((1, 2),))
+        self.assertTrue(isinstance(copy.copy(moves), moveset))
+        self.assertEqual(moves_of_type(moves, tuple), ((1, 2),))
+        self.assertEqual(sorted(moves_of_type(set([1, 2.5, 3]), int)), [1, 3])
+
+    def test_hypotheses(self):
+        evaluated = []
+        def stream():
+            for score in (0.9, 0.5, 0.1):
+                evaluated.append(score)
+                yield score, (score,)
+        hyps = hypotheses(stream())
+        self.assertEqual(hyps.get(0), (0.9, (0.9,)))
+        self.assertEqual(evaluated, [0.9])
+        self.assertEqual(hyps.get(0), (0.9, (0.9,)))
+        self.assertEqual(hyps.pulled, 1)
+        self.assertEqual(pickle.loads(pickle.dumps(hyps, 2)).pulled, 3)
+        self.assertEqual([score for score, moves in hyps], [0.9, 0.5, 0.1])
+        self.assertEqual(evaluated, [0.9, 0.5, 0.1])
+        self.assertRaises(IndexError, hyps.get, 3)
+        hyps.clear()
+        self.assertEqual(list(hyps), [])
+
+    def test_typecheck_moves(self):
+        previous = set_typechecking(True)
+        try:
+            dm = StandardMIVS()
+            dm.init_MIVS()
+            self.assertRaises(TypeError, dm.NEXT_MOVES.push, 1)
+            set_typechecking(False)
+            dm.NEXT_MOVES.push(1)
+            self.assertEqual(list(dm.NEXT_MOVES), [1])
+        finally:
+            set_typechecking(previous)
+
+    def test_set_typechecking(self):
+        previous = set_typechecking(True)
+        try:
+            self.assertTrue(typechecking())
+            containers = value(int), record(a=int), stack(int), stackset(int), tset(int)
+            flag, rec, stk, stkset, st = containers
+            self.assertRaises(TypeError, flag.set, "x")
+            self.assertRaises(TypeError, setattr, rec, 'a', "x")
+            self.assertRaises(TypeError, stk.push, "x")
+            self.assertRaises(TypeError, stkset.push, "x")
+            self.assertRaises(TypeError, st.add, "x")
+            self.assertTrue(set_typechecking(False))
+            self.assertFalse(typechecking())
+            flag.set("x")
+            rec.a = "x"
+            stk.push("x")
+            stkset.push("x")
+            st.add("x")
+            self.assertEqual((flag.get(), rec.a, list(stk), list(stkset), "x" in st),
+                             ("x", "x", ["x"], ["x"], True))
+            self.assertRaises(KeyError, getattr, rec, 'b')
+        finally:
+            set_typechecking(previous)
+
+    def test_session_template(self):
+        dm = StreamDM()
+        dm.reset()
+        dm.IS.agenda.push(1)
+        template = SessionTemplate(dm, pool_size=1)
+        self.assertEqual(template.names, ["HYPOTHESES", "INPUT", "IS", "LATEST_MOVES",
+                                          "LATEST_SPEAKER", "NEXT_MOVES", "OUTPUT",
+                                          "PROGRAM_STATE"])
+        dm1, dm2 = StreamDM(), StreamDM()
+        template.start(dm1)
+        dm1.IS.agenda.push(2)
+        dm1.IS.bel.add("p")
+        dm1.IS.sub.flag.set(2)
+        dm1.NEXT_MOVES.push(3)
+        self.assertEqual(dm1.streamed, [3])
+        self.assertEqual(list(dm.IS.agenda), [1])
+        self.assertEqual(dm.IS.bel, set())
+        self.assertEqual(dm.IS.sub.flag.get(), None)
+        self.assertEqual(dm.PROGRAM_STATE.get(), ProgramState.RUN)
+        template.finish(dm1)
+        template.start(dm2)
+        self.assertTrue(dm2.IS is dm1.IS)
+        self.assertEqual(list(dm2.IS.agenda), [1])
+        self.assertEqual(dm2.IS.bel, set())
+        self.assertEqual(dm2.IS.sub.flag.get(), None)
+        self.assertEqual(len(dm2.NEXT_MOVES), 0)
+        self.assertEqual(dm2.streamed, [])
+        dm2.NEXT_MOVES.push(4)
+        self.assertEqual((dm1.streamed, dm2.streamed), ([3], [4]))
+        if typechecking():
+            self.assertRaises(TypeError, dm2.IS.sub.flag.set, 3)
+
+    def test_check(self):
+        dm = RuleDM(3)
+        self.assertEqual(pick_any.check(dm).move, 3)
+        self.assertRaises(PreconditionFailure, pick_large.check, dm)
+        self.assertEqual(len(dm.PICKED), 0)
+        self.assertFalse(push_only.checkable())
+        self.assertTrue(pick_any.checkable())
+        self.assertTrue(pick_pair.checkable())
+        import trindikit
+        @update_rule
+        def documented(MOVES):
+            """A docstring, followed by a qualified precondition."""
+            V = trindikit.precondition(lambda: (R(move=m) for m in MOVES))
+        @update_rule
+        def late(MOVES, PICKED):
+            PICKED.push(("late", None))
+            @precondition
+            def V():
+                yield R()
+        self.assertTrue(documented.checkable())
+        self.assertEqual(documented.check(dm).move, 3)
+        self.assertFalse(late.checkable())
+        self.assertRaises(SyntaxError, late.check, dm)
+        self.assertRaises(SyntaxError, push_only.check, dm)
+        self.assertRaises(SyntaxError, push_only.apply, None, dm)
+        self.assertEqual(len(dm.PICKED), 0)
+
+    def test_apply(self):
+        dm = RuleDM(3, 20)
+        pick_pair.apply(R(first=20, second=3), dm)
+        self.assertEqual(dm.PICKED.top(), ("pair", 20))
+        dm = RuleDM(3)
+        rule_group(pick_counted, pick_any, strategy=first_by_order)(dm)
+        self.assertEqual(list(dm.PICKED), [("counted", None), ("top", 3)])
+
+    def test_conflict_resolution(self):
+        rules = pick_any, pick_pair, pick_large
+        for strategy, expected in [(None, "any"), (first_by_order, "any"),
+                                   (by_priority, "large"), (by_specificity, "pair")]:
+            for workers in (None, 3):
+                dm = RuleDM(3, 20)
+                group = rule_group(strategy=strategy, workers=workers, *rules)
+                group(dm)
+                self.assertEqual(dm.PICKED.top()[0], expected)
+                self.assertEqual(len(dm.PICKED), 1)
+        dm = RuleDM()
+        self.assertRaises(PreconditionFailure,
+                          rule_group(strategy=by_priority, *rules), dm)
+        self.assertRaises(TypeError, rule_group, pick_any, order=True)
+        self.assertRaises(TypeError, rule_group, rule_group(pick_any), pick_pair,
+                          strategy=by_priority)
+
+    def test_batch(self):
+        group = rule_group(rule_group(pick_large), pick_pair)
+        for tracer in (None, Tracer()):
+            previous = set_tracer(tracer)
+            try:
+                dms = RuleDM(20), RuleDM(1, 2), RuleDM(5)
+                self.assertEqual(batch_do(list(dms), group), [dms[2]])
+                self.assertEqual([list(dm.PICKED) for dm in dms],
+                                 [[("large", 20)], [("pair", 1)], []])
+                batch_maybe(list(dms), rule_group(pick_large, strategy=by_priority))
+                self.assertEqual(len(dms[0].PICKED), 2)
+                dms = RuleDM(1, 2, 3), RuleDM(), RuleDM(4)
+                batch_repeat(list(dms), rule_group(pick_top))
+                self.assertEqual([list(dm.PICKED) for dm in dms],
+                                 [[("top", 3), ("top", 2), ("top", 1)], [], [("top", 4)]])
+            finally:
+                set_tracer(previous)
+
+    def check_buffered_channel(self, channel, write, close):
+        channel.chunksize = 4
+        self.assertEqual(channel.ready(), 0)
+        write("hello\nwor")
+        self.assertEqual(channel.ready(), 1)
+        self.assertEqual(channel.readline(), "hello")
+        self.assertEqual(channel.ready(), 0)
+        write("ld\r\nagain\n")
+        self.assertEqual(channel.readline(), "world")
+        self.assertEqual(channel.readline(), "again")
+        write("no newline")
+        close()
+        self.assertEqual(channel.ready(), 1)
+        self.assertEqual(channel.readline(), "no newline")
+        self.assertEqual(channel.readline(), None)
+        self.assertEqual(channel.ready(), 0)
+
+    def test_socket_channel(self):
+        sock, other = socket.socketpair()
+        channel = SocketChannel(sock)
+        try:
+            channel.writeline("first")
+            channel.writeline("second")
+            other.setblocking(0)
+            self.assertRaises(socket.error, other.recv, 100)
+            channel.flush()
+            self.assertEqual(other.recv(100), "first\nsecond\n")
+            other.setblocking(1)
+            self.check_buffered_channel(channel, other.sendall, other.close)
+        finally:
+            channel.close()
+            other.close()
+
+    def test_pipe_channel(self):
+        inread, inwrite = os.pipe()
+        outread, outwrite = os.pipe()
+        channel = PipeChannel(inread, outwrite)
+        channel.writeline("first")
+        channel.flush()
+        self.assertEqual(os.read(outread, 100), "first\n")
+        self.check_buffered_channel(channel, lambda data: os.write(inwrite, data),
+                                    lambda: os.close(inwrite))
+        channel.close()
+        os.close(outread)
+
+    def test_channel_sink(self):
+        channel = QueueChannel()
+        sink = ChannelSink(channel)
+        for phrase in ["Hello.", "Where do you want to go?", None, "Bye.", None]:
+            sink(phrase)
+        self.assertEqual(channel.outputs, ["Hello.", "Where do you want to go?", "",
+                                           "Bye.", ""])
+
+    def test_private_imports(self):
+        namespace = {}
+        exec "from trindikit import *" in namespace
+        for name in ("os", "select", "time", "json", "threading"):
+            self.assertFalse(name in namespace, name)
+
+if __name__ == '__main__':
+    unittest.main()